@@ -0,0 +1,4 @@
+# Django 起動時に Celery アプリを読み込み、@shared_task が使えるようにする
+from .celery import app as celery_app
+
+__all__ = ("celery_app",)
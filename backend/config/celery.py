@@ -0,0 +1,13 @@
+import os
+from celery import Celery
+
+# Celeryワーカーからも Django の設定を読み込めるようにする
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+app = Celery("config")
+
+# CELERY_ で始まる設定を settings.py から読み込む
+app.config_from_object("django.conf:settings", namespace="CELERY")
+
+# 各アプリの tasks.py を自動検出
+app.autodiscover_tasks()
@@ -55,6 +55,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # ← 一番上に追加
+    'mainapp.audio.middleware.GenerationCancellationMiddleware',  # クライアント切断時に生成を打ち切る
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -268,6 +269,36 @@ INSTALLED_APPS += [
 # ─── メディアファイル用設定 ───────────────────────────────────────────
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# ファイルの保存先
+# - audio: 生成した音声ライブラリ（S3 などに変える場合は AUDIO_STORAGE_BACKEND と OPTIONS を差し替える）
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'audio': {
+        'BACKEND': os.getenv('AUDIO_STORAGE_BACKEND', 'django.core.files.storage.FileSystemStorage'),
+    },
+}
+
+# 保存済み音声のダウンロード
+# - AUDIO_DOWNLOAD_OFFLOAD: 本体の送信をフロントのサーバーに任せる方式
+#   （'' = Django が配信 / 'x-accel' = nginx の X-Accel-Redirect / 'x-sendfile' = Apache・lighttpd の X-Sendfile）
+# - AUDIO_ACCEL_REDIRECT_PREFIX: MEDIA_ROOT を alias した nginx の internal location
+# - AUDIO_SIGNED_URL_MAX_AGE: 認証なしで取得できる署名付きURLの有効期限（秒）
+AUDIO_DOWNLOAD_OFFLOAD = os.getenv('AUDIO_DOWNLOAD_OFFLOAD', '').lower()
+AUDIO_ACCEL_REDIRECT_PREFIX = os.getenv('AUDIO_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+AUDIO_SIGNED_URL_MAX_AGE = int(os.getenv('AUDIO_SIGNED_URL_MAX_AGE', '3600'))
+# 音声編集の結果として返せる最大の長さ（秒）
+AUDIO_EDIT_MAX_DURATION = float(os.getenv('AUDIO_EDIT_MAX_DURATION', '600'))
+# 下書きのリファインで、ティアのスケジュールのうち最後の何割をやり直すか（0 より大きく 1 以下）
+AUDIO_REFINE_DEFAULT_STRENGTH = float(os.getenv('AUDIO_REFINE_DEFAULT_STRENGTH', '0.5'))
+# Idempotency-Key で受け付けたリクエストの結果を再送に返す期間（秒）
+AUDIO_IDEMPOTENCY_KEY_TTL = int(os.getenv('AUDIO_IDEMPOTENCY_KEY_TTL', '86400'))
+# Idempotency-Key のリクエストを処理中とみなす期間（秒。過ぎたら落ちたものとして同じキーの再送が引き継ぐ）
+# - 既定は推論のタイムアウト（AUDIO_INFERENCE_TIMEOUT）と同じ
+AUDIO_IDEMPOTENCY_LOCK_SECONDS = float(os.getenv(
+    'AUDIO_IDEMPOTENCY_LOCK_SECONDS', os.getenv('AUDIO_INFERENCE_TIMEOUT', '600')
+))
 # ─────────────────────────────────────────────────────────────────────
 
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
@@ -277,3 +308,115 @@ STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 
 
 
+
+
+# ── Celery（非同期音声生成ジョブ）──────────────────────────────────
+CELERY_BROKER_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TIMEZONE = TIME_ZONE
+# ジョブの状態は GenerationJob モデルで管理するため、タスク結果は保存しない
+CELERY_TASK_IGNORE_RESULT = True
+# 生成は長時間かかるため、1ワーカーが先読みするタスクは1件に限定
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+# ローカル開発用：True にするとワーカーなしでリクエスト内で同期実行される
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False').lower() == 'true'
+# ─────────────────────────────────────────────────────────────────────
+
+# ── 音声生成のマイクロバッチ設定 ──────────────────────────────────────
+# 最初のリクエストが届いてから、同時リクエストを集めて待つ時間（ミリ秒）。0 で待たない
+AUDIO_BATCH_WINDOW_MS = int(os.getenv('AUDIO_BATCH_WINDOW_MS', '30'))
+# 1回のパイプライン呼び出しでまとめる最大リクエスト数
+AUDIO_BATCH_MAX_SIZE = int(os.getenv('AUDIO_BATCH_MAX_SIZE', '4'))
+# 一括生成 API（/api/audio/generate/batch/）の1リクエストで生成できる音声の本数の上限
+AUDIO_BATCH_API_MAX_OUTPUTS = int(os.getenv('AUDIO_BATCH_API_MAX_OUTPUTS', '32'))
+# 長尺生成（/api/audio/generate/long/）で1回に生成するウィンドウの長さと、隣のウィンドウと重ねる長さ（秒）
+# - ウィンドウはモデルが一度に生成できる長さ（Stable Audio Open は約47秒）以下にする
+# - これより長い音声は /api/audio/generate/long/ でのみ生成できる
+AUDIO_LONGFORM_WINDOW = float(os.getenv('AUDIO_LONGFORM_WINDOW', '47'))
+AUDIO_LONGFORM_OVERLAP = float(os.getenv('AUDIO_LONGFORM_OVERLAP', '2'))
+# ─────────────────────────────────────────────────────────────────────
+
+# ── 音声生成モデルと結果キャッシュ ────────────────────────────────────
+AUDIO_MODEL_ID = os.getenv('AUDIO_MODEL_ID', 'stabilityai/stable-audio-open-1.0')
+AUDIO_MODEL_REVISION = os.getenv('AUDIO_MODEL_REVISION', 'main')
+# 推論の実行プロファイル（'auto' なら CUDA → bf16 対応 CPU → fp32 CPU の順に判定）
+# - intra_op_threads / inter_op_threads: PyTorch の演算スレッド数（None ならデフォルト）
+# - inference_mode: torch.inference_mode() で実行するかどうか
+# - attention: scaled_dot_product_attention のカーネル（auto / flash / efficient / math）
+AUDIO_EXECUTION_PROFILE = os.getenv('AUDIO_EXECUTION_PROFILE', 'auto')
+AUDIO_EXECUTION_PROFILES = {
+    'cuda-fp16': {
+        'device': 'cuda', 'dtype': 'float16',
+        'intra_op_threads': None, 'inter_op_threads': None,
+        'inference_mode': True, 'attention': 'auto',
+    },
+    'cpu-bf16': {
+        'device': 'cpu', 'dtype': 'bfloat16',
+        'intra_op_threads': None, 'inter_op_threads': 1,
+        'inference_mode': True, 'attention': 'auto',
+    },
+    'cpu-fp32': {
+        'device': 'cpu', 'dtype': 'float32',
+        'intra_op_threads': None, 'inter_op_threads': 1,
+        'inference_mode': True, 'attention': 'auto',
+    },
+}
+# CPU 推論時の量子化（none / int8-dynamic）
+# - int8-dynamic は DiT と T5 エンコーダーの Linear 層を動的 int8 量子化したものを使う
+# - 事前に python manage.py build_quantized_model で作成しておく
+AUDIO_QUANTIZATION = os.getenv('AUDIO_QUANTIZATION', 'none')
+AUDIO_QUANTIZED_MODEL_DIR = os.getenv('AUDIO_QUANTIZED_MODEL_DIR', str(BASE_DIR / 'model_cache' / 'quantized'))
+# 生成ティア（品質と速度のトレードオフ。プランごとに選択できる上限がある）
+# - scheduler: default（モデル同梱）/ dpmsolver-sde / dpmsolver-ode
+# - steps: 推論ステップ数（リクエストの steps より優先）
+# - guidance_cutoff: この割合のステップを過ぎたら CFG の無条件側を計算しない（1.0 なら最後まで計算）
+AUDIO_GENERATION_TIERS = {
+    'draft': {'scheduler': 'dpmsolver-ode', 'steps': 16, 'guidance_cutoff': 0.5},
+    'standard': {'scheduler': 'dpmsolver-ode', 'steps': 40, 'guidance_cutoff': 0.75},
+    'high': {'scheduler': 'dpmsolver-sde', 'steps': 100, 'guidance_cutoff': 1.0},
+}
+# VAE のタイル分割デコード（0 なら従来どおり全体を1回でデコードする）
+# - AUDIO_VAE_TILE_SECONDS 秒ずつ、AUDIO_VAE_TILE_OVERLAP_SECONDS 秒重ねてデコードし、重なりをクロスフェードでつなぐ
+# - デコードのピークメモリがタイルの長さで決まるため、長い音声を同時に生成できる数が増える
+# - 効果と出力の差は python manage.py benchmark_vae_decoding で計測できる
+AUDIO_VAE_TILE_SECONDS = float(os.getenv('AUDIO_VAE_TILE_SECONDS', '0'))
+AUDIO_VAE_TILE_OVERLAP_SECONDS = float(os.getenv('AUDIO_VAE_TILE_OVERLAP_SECONDS', '2'))
+# DiT と VAE デコーダーを torch.compile するかどうか
+# - バッチサイズはバケット（1, 2, 4, …, AUDIO_BATCH_MAX_SIZE）に切り上げて、形状ごとの再コンパイルを防ぐ
+# - コンパイル結果は AUDIO_COMPILE_CACHE_DIR に保存され、再起動後も再利用される
+# - python manage.py warmup_compiled_pipeline で全バケットを事前にコンパイルできる
+AUDIO_COMPILE = os.getenv('AUDIO_COMPILE', 'False').lower() == 'true'
+AUDIO_COMPILE_MODE = os.getenv('AUDIO_COMPILE_MODE', 'default')  # default / max-autotune-no-cudagraphs など
+AUDIO_COMPILE_CACHE_DIR = os.getenv('AUDIO_COMPILE_CACHE_DIR', str(BASE_DIR / 'model_cache' / 'compile'))
+# 推論のアドミッション制御
+# - AUDIO_ADMISSION_MAX_COST: 同時に実行する推論コストの上限（CFG 込みのステップ数の合計。打ち切り後のステップは 0.5）
+# - AUDIO_ADMISSION_MAX_QUEUE: 枠が空くのを待てるリクエスト数（超えると 503 + Retry-After）
+# - AUDIO_ADMISSION_DEFAULT_RETRY_AFTER: 処理量を実測できていないときの Retry-After（秒）
+AUDIO_ADMISSION_MAX_COST = float(os.getenv('AUDIO_ADMISSION_MAX_COST', '400'))
+AUDIO_ADMISSION_MAX_QUEUE = int(os.getenv('AUDIO_ADMISSION_MAX_QUEUE', '16'))
+AUDIO_ADMISSION_DEFAULT_RETRY_AFTER = int(os.getenv('AUDIO_ADMISSION_DEFAULT_RETRY_AFTER', '10'))
+# ユーザーの同時実行数が上限（プランの最大同時生成数）に達していたジョブを再実行するまでの秒数
+AUDIO_JOB_REQUEUE_DELAY = float(os.getenv('AUDIO_JOB_REQUEUE_DELAY', '2.0'))
+# 生成中のジョブがキャンセルされていないかを確認する間隔（秒）
+AUDIO_JOB_CANCEL_POLL_INTERVAL = float(os.getenv('AUDIO_JOB_CANCEL_POLL_INTERVAL', '1.0'))
+# ジョブの進捗イベント（SSE）を中継する Redis と、最新の進捗を保持する秒数
+AUDIO_PROGRESS_REDIS_URL = os.getenv('AUDIO_PROGRESS_REDIS_URL') or CELERY_BROKER_URL
+AUDIO_PROGRESS_SNAPSHOT_TTL = int(os.getenv('AUDIO_PROGRESS_SNAPSHOT_TTL', '3600'))
+# SSE のストリームで、イベントがない間にジョブの状態を DB で確認する間隔（秒。キープアライブも兼ねる）
+AUDIO_PROGRESS_STREAM_INTERVAL = float(os.getenv('AUDIO_PROGRESS_STREAM_INTERVAL', '5.0'))
+# ワーカー起動時にモデルを読み込んでウォームアップするかどうか（gunicorn / Celery）
+AUDIO_PRELOAD_PIPELINE = os.getenv('AUDIO_PRELOAD_PIPELINE', 'True').lower() == 'true'
+# 推論サーバーのアドレス（unix:///path/to.sock または tcp://host:port）
+# - 設定すると Django / Celery ワーカーはモデルを読み込まず、推論サーバーに生成を依頼する
+AUDIO_INFERENCE_SERVER = os.getenv('AUDIO_INFERENCE_SERVER', '')
+AUDIO_INFERENCE_TIMEOUT = float(os.getenv('AUDIO_INFERENCE_TIMEOUT', '600'))
+# シード値を指定した生成結果を保存するディレクトリと合計サイズ上限（バイト）
+AUDIO_RESULT_CACHE_DIR = os.getenv('AUDIO_RESULT_CACHE_DIR', str(BASE_DIR / 'audio_cache'))
+AUDIO_RESULT_CACHE_MAX_BYTES = int(os.getenv('AUDIO_RESULT_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+# テキストエンコーダー出力（プロンプト埋め込み）をメモリに保持する件数
+AUDIO_EMBEDDING_CACHE_SIZE = int(os.getenv('AUDIO_EMBEDDING_CACHE_SIZE', '256'))
+# 音声エンコード（WAV / FLAC / Ogg Opus / MP3）を実行するスレッド数
+AUDIO_ENCODE_WORKERS = int(os.getenv('AUDIO_ENCODE_WORKERS', '2'))
+# ─────────────────────────────────────────────────────────────────────
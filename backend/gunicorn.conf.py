@@ -0,0 +1,71 @@
+"""
+gunicorn 設定ファイル
+
+- preload_app で Django とモデルをマスタープロセスで1回だけ読み込み、fork 後の各ワーカーで
+  読み取り専用の重みを copy-on-write で共有する
+- 起動直後の最初のリクエストも、ウォームアップ済みの定常状態のレイテンシで処理できる
+"""
+
+import gc
+import multiprocessing
+import os
+
+# fork 前の CUDA 利用可否チェックで CUDA ランタイムを初期化しないようにする
+os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+
+# 同時リクエストをマイクロバッチにまとめられるよう、ワーカーごとに複数スレッドで処理する
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# 生成は数十秒かかるためタイムアウトを長めにする
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+
+preload_app = True
+
+
+def _uses_cuda():
+    import torch
+    return torch.cuda.is_available()
+
+
+def _should_preload():
+    # 推論サーバーを使う場合、Web ワーカーではモデルを読み込まない
+    from django.conf import settings
+    return settings.AUDIO_PRELOAD_PIPELINE and not settings.AUDIO_INFERENCE_SERVER
+
+
+def on_starting(server):
+    """
+    マスタープロセスで Django アプリの読み込み後、ワーカーを fork する前に呼ばれる
+    - CPU 推論の場合はここでモデルを読み込み、ウォームアップしてから fork する
+    - CUDA は fork 前に初期化すると子プロセスで使えないため、各ワーカーの post_fork で読み込む
+    """
+    if not _should_preload() or _uses_cuda():
+        return
+
+    from mainapp.audio.pipeline import preload_audio_pipeline
+    preload_audio_pipeline()
+
+    # 読み込んだオブジェクトを GC の追跡対象から外し、GC が参照カウント領域に書き込んで
+    # 共有ページがコピーされるのを防ぐ
+    gc.freeze()
+    server.log.info("Audio pipeline preloaded in master (pid %s)", os.getpid())
+
+
+def post_fork(server, worker):
+    """各ワーカーの fork 直後に呼ばれる"""
+    import torch
+    from mainapp.audio.profiles import get_execution_profile
+
+    # マスターの演算スレッド数を引き継ぐと CPU を取り合うため、実行プロファイルで
+    # スレッド数が指定されていなければワーカー数で分け合う
+    if not get_execution_profile()['intra_op_threads']:
+        torch.set_num_threads(max(1, multiprocessing.cpu_count() // workers))
+
+    if _should_preload() and _uses_cuda():
+        from mainapp.audio.pipeline import preload_audio_pipeline
+        preload_audio_pipeline()
+        server.log.info("Audio pipeline loaded in worker (pid %s)", worker.pid)
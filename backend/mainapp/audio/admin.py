@@ -1,3 +1,27 @@
 from django.contrib import admin
+from .models import GeneratedAudio, GenerationJob, IdempotencyKey
 
-# Register your models here.
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'duration', 'steps', 'created_at', 'finished_at']
+    list_filter = ['status', 'plan', 'created_at']
+    search_fields = ['user__email', 'prompt']
+    readonly_fields = ['id', 'created_at', 'started_at', 'finished_at']
+    raw_id_fields = ['user']
+
+
+@admin.register(GeneratedAudio)
+class GeneratedAudioAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'prompt', 'seed', 'duration', 'output_format', 'size', 'created_at']
+    list_filter = ['output_format', 'created_at']
+    search_fields = ['user__email', 'prompt']
+    readonly_fields = ['id', 'created_at']
+    raw_id_fields = ['user']
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ['key', 'user', 'audio', 'created_at']
+    search_fields = ['user__email', 'key']
+    readonly_fields = ['created_at']
+    raw_id_fields = ['user', 'audio']
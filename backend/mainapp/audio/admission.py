@@ -0,0 +1,263 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .batching import GenerationCancelled
+from .sampling import get_tier, refine_start_step
+
+# 処理量の実測に使う直近の時間窓（秒）
+THROUGHPUT_WINDOW = 60.0
+
+# 待機中にキャンセルを確認する間隔（秒）
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class AdmissionRejected(Exception):
+    """推論の待ち行列が満杯で、リクエストを受け付けられない"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Inference queue is full. Retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+def inference_cost(steps, tier=None, strength=None):
+    """
+    1リクエストの推論コスト（DiT の実行回数を CFG 込みで数えたもの）
+    - Stable Audio は音声長によらず固定長の潜在変数を生成するため、計算量はステップ数で決まる
+    - CFG を打ち切ったステップは条件付き側だけを計算するので、半分として数える
+    - リファイン（strength）はスケジュールの終わりの側の実行するステップだけを数える
+    """
+    cutoff = (get_tier(tier) or {}).get('guidance_cutoff', 1.0)
+    start = refine_start_step(steps, strength)
+    guided = min(max(steps * cutoff - start, 0.0), steps - start)
+    return guided + (steps - start - guided) / 2.0
+
+
+# 潜在表現の再デコード（VAE のみ）1回分の推論コスト。DiT の実行1回分として数える
+DECODE_COST = 1.0
+
+
+def make_requester(user_id, limits):
+    """
+    スケジューリングに使うリクエスト元の情報（推論サーバーにもそのまま送れるよう dict にする）
+    - weight: プランの優先度（重み付き公平キューイングの重み）
+    - max_in_flight: ユーザーごとの同時実行数の上限
+    """
+    return {
+        'user': str(user_id),
+        'plan': limits['plan'],
+        'weight': limits['priority'],
+        'max_in_flight': limits['max_concurrent_jobs'],
+    }
+
+
+# リクエスト元が指定されていない場合（ウォームアップ・ベンチマークなど）の扱い
+ANONYMOUS_REQUESTER = {'user': '', 'plan': '', 'weight': 1, 'max_in_flight': 0}
+
+# プランごとに保持する待ち時間のサンプル数
+WAIT_SAMPLES = 1000
+
+# 仮想終了時刻を記録しておくユーザー数の目安（超えたら仮想時刻を過ぎたものを捨てる）
+MAX_TRACKED_USERS = 10000
+
+
+class Waiter:
+    """枠が空くのを待っている1リクエスト"""
+    __slots__ = ('cost', 'requester', 'finish_tag', 'enqueued_at')
+
+    def __init__(self, cost, requester, finish_tag):
+        self.cost = cost
+        self.requester = requester
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    実行中の推論コストの合計に上限を設けるアドミッション制御
+    - 上限を超える分は待ち行列で待たせ、待ち行列も満杯なら AdmissionRejected を送出する
+    - 待ち行列は重み付き公平キューイング（WFQ）で、ユーザーごとの仮想終了時刻
+      （これまでに割り当てたコスト / プランの重み）が小さいものから実行する。
+      1人が大量に投入しても、他のユーザーは自分の重みに応じた順番で実行される
+    - ユーザーごとの同時実行数と待機数の合計は、プランの最大同時生成数までに制限する
+    - 直近に完了したコストから処理量を実測し、待ち行列が捌けるまでの時間を Retry-After として返す
+    - 実行中が0件なら、上限より大きいリクエストも1件だけ受け付ける（永久に待たせない）
+    """
+
+    def __init__(self, max_cost, max_queue, default_retry_after=10):
+        self.max_cost = max_cost
+        self.max_queue = max_queue
+        self.default_retry_after = default_retry_after
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._completed = deque()
+        self._virtual_time = 0.0
+        self._finish_tags = {}
+        self._user_in_flight = {}
+        self._wait_samples = {}
+        self.in_flight = 0
+        self.in_flight_cost = 0.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def acquire(self, cost, cancel_token=None, requester=None):
+        """コストの枠が空くまで待ってから確保する（待ち行列が満杯なら AdmissionRejected）"""
+        requester = requester or ANONYMOUS_REQUESTER
+        with self._condition:
+            waiter = Waiter(cost, requester, self._next_finish_tag(cost, requester))
+            if not self._waiting and self._can_run(waiter):
+                self._admit(waiter)
+                return
+
+            user = requester['user']
+            user_waiting = sum(1 for other in self._waiting if other.requester['user'] == user)
+            user_total = self._user_in_flight.get(user, 0) + user_waiting
+            limit = requester['max_in_flight']
+            if len(self._waiting) >= self.max_queue or (user and limit and user_total >= limit):
+                self.rejected += 1
+                raise AdmissionRejected(self._retry_after())
+
+            # 同じユーザーの後続のリクエストがこの待機者の後ろに並ぶよう、仮想終了時刻を先に進めておく
+            previous_tag = self._finish_tags.get(user)
+            self._finish_tags[user] = waiter.finish_tag
+            self._waiting.append(waiter)
+            admitted = False
+            try:
+                while self._next_waiter() is not waiter or not self._can_run(waiter):
+                    if cancel_token is not None and cancel_token.is_cancelled:
+                        raise GenerationCancelled()
+                    self._condition.wait(CANCEL_POLL_INTERVAL)
+                admitted = True
+            finally:
+                self._waiting.remove(waiter)
+                # 実行せずに抜けた場合は、進めた仮想終了時刻を戻す（後続がこれを元に並んでいなければ）
+                if not admitted and self._finish_tags.get(user) == waiter.finish_tag:
+                    if previous_tag is None:
+                        del self._finish_tags[user]
+                    else:
+                        self._finish_tags[user] = previous_tag
+                # 先頭が抜けたので、次の待機者に確認させる
+                self._condition.notify_all()
+            self._admit(waiter)
+
+    def release(self, cost, requester=None):
+        requester = requester or ANONYMOUS_REQUESTER
+        with self._condition:
+            self.in_flight -= 1
+            self.in_flight_cost -= cost
+            user = requester['user']
+            self._user_in_flight[user] -= 1
+            if not self._user_in_flight[user]:
+                del self._user_in_flight[user]
+            self._completed.append((time.monotonic(), cost))
+            self._condition.notify_all()
+
+    def _next_finish_tag(self, cost, requester):
+        """ユーザーの仮想終了時刻（前回の終了時刻か現在の仮想時刻の遅い方 + コスト / 重み）"""
+        start = max(self._virtual_time, self._finish_tags.get(requester['user'], 0.0))
+        return start + cost / max(requester['weight'], 1)
+
+    def _next_waiter(self):
+        """同時実行数の上限に達していないユーザーのうち、仮想終了時刻が最も小さい待機者"""
+        candidates = [waiter for waiter in self._waiting if self._under_user_limit(waiter.requester)]
+        return min(candidates, key=lambda waiter: waiter.finish_tag, default=None)
+
+    def _under_user_limit(self, requester):
+        limit = requester['max_in_flight']
+        return not limit or self._user_in_flight.get(requester['user'], 0) < limit
+
+    def _can_run(self, waiter):
+        if not self._under_user_limit(waiter.requester):
+            return False
+        return self.in_flight == 0 or self.in_flight_cost + waiter.cost <= self.max_cost
+
+    def _admit(self, waiter):
+        user = waiter.requester['user']
+        # 仮想時刻を実行を始めたリクエストの開始時刻まで進める（待っていないユーザーの過去の分は持ち越さない）
+        self._virtual_time = max(self._virtual_time, waiter.finish_tag - waiter.cost / max(waiter.requester['weight'], 1))
+        self._finish_tags[user] = max(self._finish_tags.get(user, 0.0), waiter.finish_tag)
+        if len(self._finish_tags) > MAX_TRACKED_USERS:
+            self._finish_tags = {
+                key: tag for key, tag in self._finish_tags.items() if tag > self._virtual_time
+            }
+        self._user_in_flight[user] = self._user_in_flight.get(user, 0) + 1
+        self.in_flight += 1
+        self.in_flight_cost += waiter.cost
+        self.admitted += 1
+        samples = self._wait_samples.setdefault(waiter.requester['plan'], deque(maxlen=WAIT_SAMPLES))
+        samples.append(time.monotonic() - waiter.enqueued_at)
+
+    def _throughput(self):
+        """直近の時間窓で完了したコストから、1秒あたりに処理できるコストを求める（不明なら None）"""
+        now = time.monotonic()
+        while self._completed and now - self._completed[0][0] > THROUGHPUT_WINDOW:
+            self._completed.popleft()
+        if len(self._completed) < 2:
+            return None
+        # 最初の完了時刻より前に処理された分は時間窓に含まれないため、先頭のコストは数えない
+        span = now - self._completed[0][0]
+        completed_cost = sum(cost for _, cost in self._completed) - self._completed[0][1]
+        return completed_cost / span if span > 0 and completed_cost > 0 else None
+
+    def _drain_seconds(self):
+        """実行中と待機中のコストを捌き切るまでの見積もり秒数（不明なら None）"""
+        throughput = self._throughput()
+        if throughput is None:
+            return None
+        queued_cost = sum(waiter.cost for waiter in self._waiting)
+        return (self.in_flight_cost + queued_cost) / throughput
+
+    def _retry_after(self):
+        drain_seconds = self._drain_seconds()
+        if drain_seconds is None:
+            return self.default_retry_after
+        return max(1, int(drain_seconds + 0.5))
+
+    def stats(self):
+        """監視用の現在の待ち行列の長さと実行中のコスト"""
+        with self._condition:
+            throughput = self._throughput()
+            return {
+                'in_flight': self.in_flight,
+                'in_flight_cost': self.in_flight_cost,
+                'max_cost': self.max_cost,
+                'queue_depth': len(self._waiting),
+                'queued_cost': sum(waiter.cost for waiter in self._waiting),
+                'max_queue': self.max_queue,
+                'throughput': throughput,
+                'estimated_drain_seconds': self._drain_seconds(),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'wait_by_plan': {
+                    plan or 'none': summarize_waits(samples) for plan, samples in self._wait_samples.items()
+                },
+            }
+
+
+def summarize_waits(samples):
+    """待ち時間（秒）のサンプルの件数・平均・p50・p95・最大"""
+    values = sorted(samples)
+    count = len(values)
+    return {
+        'count': count,
+        'mean': sum(values) / count,
+        'p50': values[int(count * 0.5)],
+        'p95': values[min(int(count * 0.95), count - 1)],
+        'max': values[-1],
+    }
+
+
+_controller = None
+
+def get_admission_controller():
+    """アドミッション制御を一度だけ初期化して返す"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            settings.AUDIO_ADMISSION_MAX_COST,
+            settings.AUDIO_ADMISSION_MAX_QUEUE,
+            settings.AUDIO_ADMISSION_DEFAULT_RETRY_AFTER,
+        )
+    return _controller
@@ -0,0 +1,280 @@
+import io
+
+import numpy as np
+import soundfile as sf
+
+from .encoding import get_encode_executor
+
+# 最も細かい波形ピークの1点あたりのサンプル数と、解像度を下げるときの倍率
+PEAKS_BASE_BLOCK = 256
+PEAKS_LEVEL_FACTOR = 4
+# これより点数が少なくなる解像度は作らない
+PEAKS_MIN_COUNT = 64
+
+# ラウドネス（ITU-R BS.1770）のゲーティングブロック長・間隔（秒）とゲートの閾値
+LOUDNESS_BLOCK = 0.4
+LOUDNESS_HOP = 0.1
+LOUDNESS_ABSOLUTE_GATE = -70.0
+LOUDNESS_RELATIVE_GATE = -10.0
+
+# トゥルーピークを求めるときのオーバーサンプリング倍率
+TRUE_PEAK_OVERSAMPLING = 4
+
+# FFT でフィルターをかけるときに末尾に足す無音（秒）。信号の末尾と先頭が回り込んで混ざらないようにする
+FFT_PADDING = 0.1
+
+# 無音とみなすレベル（dBFS）と、無音区間として返す最短の長さ（秒）
+SILENCE_THRESHOLD_DB = -60.0
+SILENCE_MIN_DURATION = 0.3
+
+# 無音の dB 値の代わりに使う下限（log10(0) を避ける）
+MIN_POWER = 1e-12
+
+
+def to_db(power):
+    """パワー（振幅の2乗）を dB に変換する"""
+    return 10.0 * np.log10(np.maximum(power, MIN_POWER))
+
+
+def fast_fft_length(n):
+    """n 以上で、素因数が 2, 3, 5 だけの最小の長さ（FFT が速い長さ）"""
+    best = 1 << max(n - 1, 0).bit_length()
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            # 2 のべき乗を掛けて n 以上になる最小の値
+            length = power35 << max((n - 1) // power35, 0).bit_length()
+            best = min(best, length)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def biquad_response(b, a, z):
+    """双二次フィルター (b0, b1, b2) / (a0, a1, a2) の、z = e^{-jω} における周波数応答"""
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+def k_weighting_response(sampling_rate, n):
+    """
+    BS.1770 の K 特性（高域シェルフ + 高域通過）の、長さ n の rfft の各ビンにおける応答
+    - 係数は任意のサンプリングレートで使えるよう、アナログの設計値から双一次変換で求める
+    """
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(n).astype(np.float32))
+
+    # 高域シェルフ（頭部による音響効果）: 1500Hz, +4dB
+    gain = 10 ** (4.0 / 40)
+    w0 = 2 * np.pi * 1500.0 / sampling_rate
+    alpha = np.sin(w0) / (2 * (1 / np.sqrt(2)))
+    cos_w0 = np.cos(w0)
+    shelf = biquad_response(
+        (
+            gain * ((gain + 1) + (gain - 1) * cos_w0 + 2 * np.sqrt(gain) * alpha),
+            -2 * gain * ((gain - 1) + (gain + 1) * cos_w0),
+            gain * ((gain + 1) + (gain - 1) * cos_w0 - 2 * np.sqrt(gain) * alpha),
+        ),
+        (
+            (gain + 1) - (gain - 1) * cos_w0 + 2 * np.sqrt(gain) * alpha,
+            2 * ((gain - 1) - (gain + 1) * cos_w0),
+            (gain + 1) - (gain - 1) * cos_w0 - 2 * np.sqrt(gain) * alpha,
+        ),
+        z,
+    )
+
+    # 高域通過（RLB 特性）: 38Hz
+    w0 = 2 * np.pi * 38.0 / sampling_rate
+    alpha = np.sin(w0) / (2 * 0.5)
+    cos_w0 = np.cos(w0)
+    highpass = biquad_response(
+        ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2),
+        (1 + alpha, -2 * cos_w0, 1 - alpha),
+        z,
+    )
+    return (shelf * highpass).astype(np.complex64)
+
+
+def integrated_loudness(weighted, sampling_rate):
+    """
+    K 特性をかけた信号 [channels, samples] から統合ラウドネス（LUFS）を求める
+    - 400ms のブロックを 100ms ずつずらし、絶対ゲート（-70 LUFS）と相対ゲート（-10 LU）をかける
+    - ブロックごとの平均パワーは累積和から差分で求める（ブロックの重なりを再計算しない）
+    - ゲートを通るブロックがなければ None
+    """
+    num_samples = weighted.shape[1]
+    block = min(int(LOUDNESS_BLOCK * sampling_rate), num_samples)
+    hop = max(int(LOUDNESS_HOP * sampling_rate), 1)
+    if block == 0:
+        return None
+
+    cumulative = np.zeros((weighted.shape[0], num_samples + 1))
+    np.cumsum(np.square(weighted, dtype=np.float64), axis=1, out=cumulative[:, 1:])
+    starts = np.arange(0, num_samples - block + 1, hop)
+    block_power = ((cumulative[:, starts + block] - cumulative[:, starts]) / block).sum(axis=0)
+    block_loudness = -0.691 + to_db(block_power)
+
+    gated = block_power[block_loudness > LOUDNESS_ABSOLUTE_GATE]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + to_db(gated.mean()) + LOUDNESS_RELATIVE_GATE
+    gated = block_power[(block_loudness > LOUDNESS_ABSOLUTE_GATE) & (block_loudness > relative_gate)]
+    if not len(gated):
+        return None
+    return float(-0.691 + to_db(gated.mean()))
+
+
+def true_peak(spectrum, n, num_samples, sample_peak):
+    """
+    サンプル間のピーク（dBTP 用の振幅）を求める
+    - 元信号（長さ n の rfft）に位相シフトをかけて、サンプルの間（1/4, 2/4, 3/4）の値を帯域制限補間で復元する
+    """
+    peak = sample_peak
+    step = np.exp(2j * np.pi * np.fft.rfftfreq(n).astype(np.float32) / TRUE_PEAK_OVERSAMPLING)
+    shift = step
+    for _ in range(1, TRUE_PEAK_OVERSAMPLING):
+        shifted = np.fft.irfft(spectrum * shift, n=n)[:, :num_samples]
+        peak = max(peak, float(np.abs(shifted).max()))
+        shift = shift * step
+    return peak
+
+
+def block_reduce(values, block, reduce, pad_value):
+    """1次元配列をブロックごとに集約する（端数は pad_value で埋める）"""
+    remainder = -len(values) % block
+    if remainder:
+        values = np.concatenate([values, np.full(remainder, pad_value, dtype=values.dtype)])
+    return reduce(values.reshape(-1, block), axis=1)
+
+
+def peak_levels(lows, highs):
+    """
+    最も細かい min/max ピークから、PEAKS_LEVEL_FACTOR 倍ずつ粗い解像度を作る
+    - 粗い解像度は1つ前の解像度を集約するので、元の音声を読み直さない
+    """
+    levels = [(PEAKS_BASE_BLOCK, lows, highs)]
+    while len(levels[-1][1]) // PEAKS_LEVEL_FACTOR >= PEAKS_MIN_COUNT:
+        samples_per_peak, lows, highs = levels[-1]
+        levels.append((
+            samples_per_peak * PEAKS_LEVEL_FACTOR,
+            block_reduce(lows, PEAKS_LEVEL_FACTOR, np.min, np.inf),
+            block_reduce(highs, PEAKS_LEVEL_FACTOR, np.max, -np.inf),
+        ))
+    return levels
+
+
+def silence_regions(block_power, sampling_rate, num_samples):
+    """
+    最も細かいブロックのパワーから、SILENCE_MIN_DURATION 秒以上続く無音区間 [開始, 終了]（秒）を求める
+    - 最後のブロックは端数のことがあるため、終了は音声の長さで打ち切る
+    """
+    silent = np.concatenate([[False], to_db(block_power) < SILENCE_THRESHOLD_DB, [False]])
+    edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+    block_seconds = PEAKS_BASE_BLOCK / sampling_rate
+    total_seconds = num_samples / sampling_rate
+    regions = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        start_seconds = start * block_seconds
+        end_seconds = min(end * block_seconds, total_seconds)
+        if end_seconds - start_seconds >= SILENCE_MIN_DURATION:
+            regions.append([round(float(start_seconds), 3), round(float(end_seconds), 3)])
+    return regions
+
+
+def k_weighted(audio_np, sampling_rate):
+    """
+    音声 [samples, channels] に K 特性をかける（空でない音声のみ）
+    - 戻り値: (長さ n の rfft のスペクトル, K 特性をかけた信号 [channels, samples], n)
+    - スペクトルはトゥルーピークの計算にもそのまま使える
+    """
+    num_samples = audio_np.shape[0]
+    # チャンネルごとに連続したメモリに並べ替えてから FFT する
+    n = fast_fft_length(num_samples + int(FFT_PADDING * sampling_rate))
+    spectrum = np.fft.rfft(np.ascontiguousarray(audio_np.T), n=n)
+    weighted = np.fft.irfft(spectrum * k_weighting_response(sampling_rate, n), n=n)[:, :num_samples]
+    return spectrum, weighted, n
+
+
+def measure_loudness(audio_np, sampling_rate):
+    """音声 [samples, channels] の統合ラウドネス（LUFS）。無音なら None"""
+    if not audio_np.shape[0]:
+        return None
+    _, weighted, _ = k_weighted(audio_np, sampling_rate)
+    return integrated_loudness(weighted, sampling_rate)
+
+
+def analyze_audio(audio_np, sampling_rate):
+    """
+    生成した音声 [samples, channels] を解析し、(メタデータ, 波形ピークのバイナリ) を返す
+    - 波形ピーク: 複数解像度の min/max（全チャンネルをまとめた包絡）を float16 で並べたもの
+      （各解像度は [min0, max0, min1, max1, ...]。位置はメタデータの offset / count）
+    - ラウドネス: RMS（dBFS）・統合ラウドネス（LUFS）・サンプルピーク・トゥルーピーク（dBTP）
+    - 無音区間: [開始, 終了]（秒）のリスト
+    - サンプルごとの集計は1回だけ行い、スペクトルも K 特性とトゥルーピークで共有する
+    """
+    audio_np = np.asarray(audio_np, dtype=np.float32)
+    if audio_np.ndim == 1:
+        audio_np = audio_np[:, None]
+    num_samples, channels = audio_np.shape
+
+    # サンプルごとの min / max / パワーを1回で求め、以降はブロック単位で扱う
+    columns = list(audio_np.T)
+    lows = np.minimum.reduce(columns)
+    highs = np.maximum.reduce(columns)
+    power = np.einsum('ij,ij->i', audio_np, audio_np) / channels
+    base_lows = block_reduce(lows, PEAKS_BASE_BLOCK, np.min, np.inf)
+    base_highs = block_reduce(highs, PEAKS_BASE_BLOCK, np.max, -np.inf)
+    block_power = block_reduce(power, PEAKS_BASE_BLOCK, np.sum, 0.0) / PEAKS_BASE_BLOCK
+
+    sample_peak = float(max(highs.max(initial=0.0), -lows.min(initial=0.0)))
+    mean_power = float(power.mean()) if num_samples else 0.0
+
+    loudness = None
+    peak = sample_peak
+    if num_samples:
+        spectrum, weighted, n = k_weighted(audio_np, sampling_rate)
+        loudness = integrated_loudness(weighted, sampling_rate)
+        del weighted
+        peak = true_peak(spectrum, n, num_samples, sample_peak)
+
+    levels = []
+    buffer = io.BytesIO()
+    for samples_per_peak, level_lows, level_highs in peak_levels(base_lows, base_highs):
+        interleaved = np.stack([level_lows, level_highs], axis=1).astype('<f2')
+        levels.append({
+            'samples_per_peak': samples_per_peak,
+            'count': len(interleaved),
+            'offset': buffer.tell(),
+        })
+        buffer.write(interleaved.tobytes())
+
+    metadata = {
+        'sampling_rate': sampling_rate,
+        'channels': channels,
+        'duration': round(num_samples / sampling_rate, 3),
+        'rms_db': round(float(to_db(mean_power)), 2),
+        'loudness_lufs': round(loudness, 2) if loudness is not None else None,
+        'sample_peak_db': round(float(to_db(sample_peak ** 2)), 2),
+        'true_peak_db': round(float(to_db(peak ** 2)), 2),
+        'silences': silence_regions(block_power, sampling_rate, num_samples),
+        'peaks': {'format': 'float16-le', 'levels': levels},
+    }
+    return metadata, buffer.getvalue()
+
+
+def analyze_encoded_audio(data):
+    """エンコード済みの音声（結果キャッシュのヒットなど）をデコードしてから解析する"""
+    audio_np, sampling_rate = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    return analyze_audio(audio_np, sampling_rate)
+
+
+def submit_analysis(audio_np, sampling_rate):
+    """
+    解析をエンコード用のスレッドプールで実行し、Future を返す
+    - FFT・集計の処理中は GIL が解放されるので、同じ音声のエンコードと並列に進む
+    """
+    return get_encode_executor().submit(analyze_audio, audio_np, sampling_rate)
+
+
+def submit_encoded_analysis(data):
+    """エンコード済みの音声の解析をエンコード用のスレッドプールで実行し、Future を返す"""
+    return get_encode_executor().submit(analyze_encoded_audio, data)
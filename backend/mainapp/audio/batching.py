@@ -0,0 +1,141 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GenerationCancelled(Exception):
+    """生成がキャンセルされた（クライアントの切断・ジョブの削除など）"""
+
+
+class CancellationToken:
+    """
+    生成のキャンセルを伝えるトークン
+    - リクエスト側のスレッドで cancel() し、推論スレッドがステップごとに is_cancelled を確認する
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def is_cancelled(self):
+        return self._event.is_set()
+
+
+class BatchItem:
+    """
+    マイクロバッチに投入される1件分の生成リクエスト
+    """
+    __slots__ = ('key', 'prompt', 'neg_prompt', 'seed', 'cancel_token', 'on_progress', 'init_latents', 'future')
+
+    def __init__(self, key, prompt, neg_prompt, seed, cancel_token=None, on_progress=None, init_latents=None):
+        self.key = key
+        self.prompt = prompt
+        self.neg_prompt = neg_prompt
+        self.seed = seed
+        self.cancel_token = cancel_token
+        # ステップごとに on_progress(step, total_steps, eta) が推論スレッドから呼ばれる（ブロックしないこと）
+        self.on_progress = on_progress
+        # リファインの場合は下書きの潜在表現 [channels, frames]（key の strength の割合だけノイズ除去する）
+        self.init_latents = init_latents
+        self.future = Future()
+
+    @property
+    def is_cancelled(self):
+        return self.cancel_token is not None and self.cancel_token.is_cancelled
+
+
+class MicroBatchScheduler:
+    """
+    同時に届いた生成リクエストを短い時間窓で集め、まとめてパイプラインに渡すスケジューラー
+
+    - key が同じ（= 1回のパイプライン呼び出しで処理できる）リクエスト同士をバッチにする
+    - バッチの実行は専用スレッド1本で行うため、共有パイプラインが同時に呼ばれることはない
+    - run_batch(key, items) はアイテムと同じ順序で結果のリストを返す関数
+    """
+
+    def __init__(self, run_batch, window_ms=30, max_batch_size=4):
+        self.run_batch = run_batch
+        self.window = max(window_ms, 0) / 1000.0
+        self.max_batch_size = max(max_batch_size, 1)
+        # 1回の収集で取り込む最大件数（高負荷時に収集が終わらなくなるのを防ぐ）
+        self.max_pending = self.max_batch_size * 4
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, key, prompt, neg_prompt, seed, cancel_token=None, on_progress=None, init_latents=None):
+        """リクエストをキューに追加し、結果を受け取る Future を返す"""
+        item = BatchItem(key, prompt, neg_prompt, seed, cancel_token, on_progress, init_latents)
+        self._ensure_worker()
+        self._queue.put(item)
+        return item.future
+
+    def _ensure_worker(self):
+        # gunicorn などで fork された場合はスレッドが引き継がれないため、プロセスごとに起動する
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name='audio-micro-batch', daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        """最初の1件が届いてから時間窓が閉じるまで、リクエストを集める"""
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(items) < self.max_pending:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    items.append(self._queue.get(timeout=remaining))
+                else:
+                    # 時間窓を過ぎても既にキューにあるものは取り込む
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+
+            # 互換性のあるリクエストごとにグループ化（到着順は維持）
+            groups = {}
+            for item in items:
+                groups.setdefault(item.key, []).append(item)
+
+            for key, group in groups.items():
+                for start in range(0, len(group), self.max_batch_size):
+                    self._run(key, group[start:start + self.max_batch_size])
+
+    def _run(self, key, batch):
+        # 待機中にキャンセルされたリクエストはバッチから外す
+        running = []
+        for item in batch:
+            if not item.future.set_running_or_notify_cancel():
+                continue
+            if item.is_cancelled:
+                item.future.set_exception(GenerationCancelled())
+                continue
+            running.append(item)
+        batch = running
+        if not batch:
+            return
+
+        try:
+            results = self.run_batch(key, batch)
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+            return
+
+        for item, result in zip(batch, results):
+            item.future.set_result(result)
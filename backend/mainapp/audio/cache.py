@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from django.conf import settings
+from .pipeline import get_inference_profile
+from .sampling import get_tier
+
+
+def normalize_text(text):
+    """前後の空白を除き、連続する空白を1つにまとめる"""
+    return ' '.join((text or '').split())
+
+
+def make_cache_key(params):
+    """
+    生成パラメータとモデルリビジョン・量子化モード・実行プロファイルから、結果キャッシュのキーを作る
+    - シード値が同じなら同じ音声が生成されるため、パラメータが同じ結果は再利用できる
+    - 同じシード値でもデバイス・dtype（cuda-fp16 / cpu-bf16 / cpu-fp32）が違えば出力が変わるため、
+      推論を実行するプロセスのプロファイルもキーに含める（キャッシュを共有・プロファイルを切り替えても混ざらない）
+    """
+    profile = get_inference_profile()
+    normalized = {
+        'prompt': normalize_text(params['prompt']),
+        'neg_prompt': normalize_text(params['neg_prompt']),
+        'steps': int(params['steps']),
+        'duration': round(float(params['duration']), 3),
+        'seed': int(params['seed']),
+        'format': params.get('output_format', 'wav'),
+        'quality': params.get('quality', 'standard'),
+        # ティアは名前ではなく設定内容（スケジューラー・CFG の打ち切り位置）で区別する
+        'tier': get_tier(params.get('tier')),
+        'model': settings.AUDIO_MODEL_ID,
+        'revision': settings.AUDIO_MODEL_REVISION,
+        'quantization': settings.AUDIO_QUANTIZATION,
+        'device': profile['device'],
+        'dtype': profile['dtype'],
+    }
+    if settings.AUDIO_VAE_TILE_SECONDS > 0:
+        # タイル分割デコードの結果は全体を1回でデコードした結果とわずかに異なる
+        normalized['vae_tiling'] = [settings.AUDIO_VAE_TILE_SECONDS, settings.AUDIO_VAE_TILE_OVERLAP_SECONDS]
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def latents_cache_key(cache_key):
+    """生成結果と一緒にキャッシュする潜在表現のキー（キャッシュから返した音声もリファインできるようにする）"""
+    return f"{cache_key}.latents"
+
+
+# 他のプロセスの書き込みも反映するため、キャッシュの合計サイズをディレクトリから数え直す間隔（秒）
+RESCAN_INTERVAL = 300
+
+# 上限を超えたときは上限のこの割合まで削除し、ディレクトリの走査を頻繁に繰り返さないようにする
+EVICT_TARGET_RATIO = 0.9
+
+# 書き込み中にプロセスが落ちて残った一時ファイルを、走査のついでに削除するまでの時間（秒）
+STALE_TMP_SECONDS = 60 * 60
+
+
+class AudioResultCache:
+    """
+    エンコード済み音声をディスクに保存する結果キャッシュ
+    - 合計サイズが max_bytes を超えたら、最後に使われた日時（mtime）が古い順に削除する（LRU）
+    - 合計サイズは書き込みごとに加算して管理し、ディレクトリを走査するのは上限を超えたときと
+      RESCAN_INTERVAL ごとの数え直しのときだけにする（書き込みのたびに全ファイルを stat しない）
+    - 複数プロセスから同じディレクトリを共有しても壊れないよう、書き込みは一時ファイル経由で置き換える
+      （書き込み中に落ちたプロセスの一時ファイルは、STALE_TMP_SECONDS を過ぎたら走査のときに削除する）
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None
+        self._scanned_at = 0.0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """キャッシュされた音声データを返す。なければ None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        # 使われたことを記録して、LRUの削除対象から外す
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def set(self, key, data):
+        """音声データを保存し、上限を超えていれば古いものから削除する"""
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._account(len(data) - replaced)
+
+    def _account(self, delta):
+        """合計サイズに書き込んだ分を加え、上限を超えていれば古いものから削除する"""
+        with self._lock:
+            if self._total is None or time.monotonic() - self._scanned_at > RESCAN_INTERVAL:
+                self._total = sum(size for _, size, _ in self._entries())
+                self._scanned_at = time.monotonic()
+            else:
+                self._total += delta
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    remove_stale_tmp(path)
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """ディレクトリを走査して、合計サイズが上限の EVICT_TARGET_RATIO 以下になるまで古い順に削除する（_lock の中で呼ぶ）"""
+        entries = list(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        if total > self.max_bytes:
+            entries.sort(key=lambda entry: entry[2])
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self._total = total
+        self._scanned_at = time.monotonic()
+
+
+def remove_stale_tmp(path):
+    """書き込み中の一時ファイルのうち、STALE_TMP_SECONDS より古いもの（書き込んだプロセスが落ちた）を削除する"""
+    try:
+        if time.time() - os.path.getmtime(path) > STALE_TMP_SECONDS:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_result_cache = None
+
+def get_result_cache():
+    """結果キャッシュを一度だけ初期化して返す"""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = AudioResultCache(
+            settings.AUDIO_RESULT_CACHE_DIR,
+            settings.AUDIO_RESULT_CACHE_MAX_BYTES,
+        )
+    return _result_cache
@@ -0,0 +1,57 @@
+import os
+
+import torch
+from django.conf import settings
+
+
+def batch_buckets(max_batch_size=None):
+    """
+    コンパイル済みグラフを用意するバッチサイズの一覧（2の累乗 + 最大バッチサイズ）
+    - バッチサイズが変わるたびに再コンパイルされないよう、実際のバッチはこのどれかに切り上げる
+    """
+    max_batch_size = max(max_batch_size or settings.AUDIO_BATCH_MAX_SIZE, 1)
+    buckets = []
+    size = 1
+    while size < max_batch_size:
+        buckets.append(size)
+        size *= 2
+    buckets.append(max_batch_size)
+    return buckets
+
+
+def bucket_batch_size(size):
+    """size 以上で最小のバケットを返す"""
+    for bucket in batch_buckets():
+        if bucket >= size:
+            return bucket
+    return size
+
+
+def configure_compile_cache():
+    """
+    Inductor / Triton の生成物をディスク上の永続ディレクトリに保存する
+    - 再起動後も同じグラフは保存済みのカーネルを読み込むだけで済み、コンパイルし直さない
+    """
+    cache_dir = str(settings.AUDIO_COMPILE_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    # torch の import 時に既定の一時ディレクトリが設定されるため、上書きする
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = os.path.join(cache_dir, 'inductor')
+    os.environ['TRITON_CACHE_DIR'] = os.path.join(cache_dir, 'triton')
+
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+    inductor_config.autotune_local_cache = True
+
+
+def compile_pipeline(pipe):
+    """
+    DiT と VAE デコーダーを torch.compile する
+    - forward をインスタンス属性として差し替えるため、CFG の打ち切り（sampling.guidance_truncation）は
+      コンパイル済みの forward を呼び出す形でそのまま使える
+    - dynamic=False でバッチサイズごとに形状を固定したグラフを作る（バッチはバケットに切り上げる）
+    """
+    configure_compile_cache()
+    mode = settings.AUDIO_COMPILE_MODE
+    pipe.transformer.forward = torch.compile(pipe.transformer.forward, mode=mode, dynamic=False)
+    pipe.vae.decoder.forward = torch.compile(pipe.vae.decoder.forward, mode=mode, dynamic=False)
+    return pipe
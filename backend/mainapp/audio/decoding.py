@@ -0,0 +1,114 @@
+import contextlib
+import math
+
+import torch
+from diffusers.models.autoencoders.autoencoder_oobleck import OobleckDecoderOutput
+
+
+def seconds_to_latent_frames(vae, seconds):
+    """秒数を VAE の潜在表現のフレーム数に変換する（1フレーム = hop_length サンプル）"""
+    return max(int(round(seconds * vae.sampling_rate / vae.hop_length)), 1)
+
+
+def tile_starts(length, tile, overlap, fixed_shape=False):
+    """
+    潜在表現の長さ length を、overlap フレーム以上ずつ重なる最大 tile フレームのタイルに分けて開始位置を返す
+    - 最後のタイルは短くなる。fixed_shape なら末尾に合わせて前にずらし、すべてのタイルを同じ形にする
+      （torch.compile 済みのデコーダーを形状ごとに再コンパイルしないようにする）
+    """
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - overlap, tile - overlap))
+    if fixed_shape:
+        starts[-1] = length - tile
+    return starts
+
+
+def decode_range(latents, tile, length=None, fixed_shape=False):
+    """
+    実際にデコードするタイルの長さと潜在表現のフレーム数を返す
+    - length は潜在表現の長さまで。fixed_shape ならタイル1つ分より短くしない
+    """
+    frames = latents.shape[-1]
+    tile = min(tile, frames)
+    length = frames if length is None else min(length, frames)
+    if fixed_shape:
+        length = max(length, tile)
+    return tile, length
+
+
+def iter_tiled_decode(vae, latents, tile, overlap, length=None, fixed_shape=False):
+    """
+    潜在表現 [batch, channels, frames] をタイルごとにデコードし、確定した PCM [batch, channels, samples] を先頭から順に返す
+    - 重なり部分は、タイル端の影響を受ける両端を除いた中央で線形にクロスフェードしてつなぐ
+    - 同時に持つのは1タイル分の中間表現と、次のタイルと重なる部分の PCM だけなので、
+      ピークメモリは音声長ではなくタイルの長さで決まる
+    - length を指定した場合は先頭 length フレームまでしかデコードしない
+    """
+    hop = vae.hop_length
+    tile, length = decode_range(latents, tile, length, fixed_shape)
+    starts = tile_starts(length, tile, overlap, fixed_shape)
+
+    tail = None
+    for index, start in enumerate(starts):
+        # インスタンス属性の decode（tiled_decoding で差し替えたもの）ではなく、クラスの decode を呼ぶ
+        audio = type(vae).decode(vae, latents[..., start:min(start + tile, length)]).sample
+        if tail is not None:
+            blend = tail.shape[-1]
+            # 重なりの両端 1/4 はタイル端のゼロ埋めの影響を受けるため使わず、中央の半分で線形にクロスフェードする
+            position = torch.arange(blend, device=audio.device, dtype=audio.dtype) + 0.5
+            fade_in = ((position - blend / 4) / (blend / 2)).clamp(0, 1)
+            audio[..., :blend] = tail * (1 - fade_in) + audio[..., :blend] * fade_in
+        if index + 1 < len(starts):
+            settled = (starts[index + 1] - start) * hop
+            yield audio[..., :settled]
+            tail = audio[..., settled:]
+        else:
+            yield audio
+
+
+def tiled_decode(vae, latents, tile, overlap, length=None, fixed_shape=False):
+    """iter_tiled_decode の結果を確保済みの出力に順に書き込んで返す（タイルの結果を連結し直さない）"""
+    total = decode_range(latents, tile, length, fixed_shape)[1] * vae.hop_length
+    output = None
+    position = 0
+    for chunk in iter_tiled_decode(vae, latents, tile, overlap, length, fixed_shape):
+        if output is None:
+            output = chunk.new_empty(chunk.shape[:-1] + (total,))
+        output[..., position:position + chunk.shape[-1]] = chunk
+        position += chunk.shape[-1]
+    # デコーダーの構成によっては出力がフレーム数 * hop_length より少し短くなる
+    return output[..., :position]
+
+
+@contextlib.contextmanager
+def tiled_decoding(vae, duration, tile_seconds, overlap_seconds, fixed_shape=False):
+    """
+    パイプライン呼び出しの間だけ VAE のデコードをタイル分割に置き換える
+    - tile_seconds が 0 以下なら何もしない（従来どおり全体を1回でデコードする）
+    - パイプラインは最大長の潜在表現をデコードしてから音声長で切り出すため、
+      音声長（+ 重なり1つ分）より後ろのタイルはデコードしない
+    - fixed_shape ならすべてのタイルを同じ形にする（torch.compile 済みのデコーダー向け）
+    - バッチは専用スレッドで1つずつ実行されるため、共有パイプラインを一時的に書き換えても競合しない
+    """
+    if tile_seconds <= 0:
+        yield
+        return
+
+    tile = seconds_to_latent_frames(vae, tile_seconds)
+    overlap = min(seconds_to_latent_frames(vae, overlap_seconds), tile - 1)
+    length = math.ceil(duration * vae.sampling_rate / vae.hop_length) + overlap
+    instance_decode = vae.__dict__.get('decode')
+
+    def decode_tiles(z, return_dict=True, generator=None):
+        sample = tiled_decode(vae, z, tile, overlap, length, fixed_shape)
+        return OobleckDecoderOutput(sample=sample) if return_dict else (sample,)
+
+    vae.decode = decode_tiles
+    try:
+        yield
+    finally:
+        if instance_decode is not None:
+            vae.decode = instance_decode
+        else:
+            del vae.decode
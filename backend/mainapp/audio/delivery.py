@@ -0,0 +1,169 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date, parse_http_date_safe
+
+from .encoding import STREAM_CHUNK_SIZE
+from .usage import get_user_plan_limits
+
+# 署名付きURLの署名に使う salt（他の用途の署名と取り違えないようにする）
+SIGNED_URL_SALT = 'mainapp.audio.download'
+
+# 署名付きURLで配信できる保存済み音声の種類
+SIGNED_KIND_LIBRARY = 'library'
+SIGNED_KIND_JOB = 'job'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Range ヘッダーの範囲がファイルの外にある（416）"""
+
+
+def audio_checksum(data):
+    """保存する音声データの SHA-256（強い ETag に使う）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_range(header, size):
+    """
+    Range ヘッダーを (開始位置, 終了位置) に変換する（終了位置を含む）
+    - 単一の範囲のみ対応。複数範囲や解釈できない値は無視して全体を返す（None）
+    - 範囲がファイルの外なら RangeNotSatisfiable を送出する
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or not any(match.groups()):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # bytes=-500 : 末尾の500バイト
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def iter_file_range(file, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    """ファイルの指定範囲をチャンクごとに返し、読み終えたら閉じる"""
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def offload_path(field_file):
+    """
+    フロントのサーバーに配信を任せる場合の X-Accel-Redirect / X-Sendfile の値
+    - ローカルのファイルシステム以外（S3 など）に保存されている場合は None
+    """
+    mode = settings.AUDIO_DOWNLOAD_OFFLOAD
+    if not mode:
+        return None
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        return None
+    if mode == 'x-sendfile':
+        return path
+    return settings.AUDIO_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + field_file.name.lstrip('/')
+
+
+def stored_audio_response(request, field_file, content_type, filename, checksum, last_modified):
+    """
+    保存済みの音声ファイルを返す
+    - ETag（内容の SHA-256）と Last-Modified を付け、If-None-Match / If-Modified-Since には 304 を返す
+    - Range（単一範囲）には 206 で該当部分だけを返す。If-Range が一致しなければ全体を返す
+    - AUDIO_DOWNLOAD_OFFLOAD が設定されていれば、本体の送信は nginx などに任せる
+    """
+    etag = quote_etag(checksum or f"{field_file.name}-{field_file.size}")
+    last_modified_ts = int(last_modified.timestamp()) if last_modified else None
+
+    def add_headers(response):
+        response["ETag"] = etag
+        if last_modified_ts is not None:
+            response["Last-Modified"] = http_date(last_modified_ts)
+        # 認証付きの内容なので共有キャッシュには置かせず、ブラウザには毎回 ETag で再検証させる
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    conditional_response = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+    if conditional_response is not None:
+        return add_headers(conditional_response)
+
+    disposition = f'attachment; filename="{filename}"'
+    path = offload_path(field_file)
+    if path is not None:
+        # Range・条件付きリクエストの処理も含めて、フロントのサーバーがファイルを配信する
+        response = HttpResponse(content_type=content_type)
+        header = 'X-Sendfile' if settings.AUDIO_DOWNLOAD_OFFLOAD == 'x-sendfile' else 'X-Accel-Redirect'
+        response[header] = path
+        response["Content-Disposition"] = disposition
+        return add_headers(response)
+
+    size = field_file.size
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # If-Range は強い比較で、ETag か Last-Modified が一致するときだけ Range を適用する
+    if not if_range or if_range == etag or (
+        last_modified_ts is not None and parse_http_date_safe(if_range) == last_modified_ts
+    ):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416, content_type=content_type)
+            response["Content-Range"] = f"bytes */{size}"
+            response["Accept-Ranges"] = 'bytes'
+            return add_headers(response)
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    response = StreamingHttpResponse(
+        iter_file_range(field_file.open('rb'), start, length),
+        status=206 if byte_range else 200,
+        content_type=content_type,
+    )
+    if byte_range:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Content-Length"] = str(length)
+    response["Accept-Ranges"] = 'bytes'
+    response["Content-Disposition"] = disposition
+    return add_headers(response)
+
+
+def make_signed_url(request, kind, object_id):
+    """
+    認証ヘッダーなしで保存済み音声を取得できる、有効期限付きの署名付きURL
+    - <audio src> のようにヘッダーを付けられないプレーヤーから直接再生・シークできるようにする
+    - プランでダウンロードが許可されていないユーザーには発行しない（None を返す）
+    """
+    if request is not None and not get_user_plan_limits(request.user)['can_download']:
+        return None
+    token = signing.dumps({'kind': kind, 'id': str(object_id)}, salt=SIGNED_URL_SALT)
+    path = reverse('audio-signed-download', args=[token])
+    return request.build_absolute_uri(path) if request else path
+
+
+def load_signed_token(token):
+    """署名付きURLのトークンを検証して {'kind', 'id'} を返す（期限切れ・改ざんは BadSignature）"""
+    return signing.loads(token, salt=SIGNED_URL_SALT, max_age=settings.AUDIO_SIGNED_URL_MAX_AGE)
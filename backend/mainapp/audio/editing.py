@@ -0,0 +1,277 @@
+import io
+import os
+import struct
+
+import numpy as np
+import soundfile as sf
+
+from .analysis import measure_loudness
+from .encoding import resample
+
+# 1回の編集で指定できる操作の数
+MAX_OPERATIONS = 32
+
+# int16 の PCM を float32 に変換するときの倍率
+PCM16_SCALE = 1.0 / 32768
+
+# フェードの形（equal_power は2つの音声を重ねても音量が落ち込まない）
+FADE_CURVES = ['linear', 'equal_power']
+
+
+class EditError(Exception):
+    """編集の指定が不正（400 で返す）"""
+
+
+def wav_memmap(path):
+    """
+    16bit PCM の WAV のサンプル部分をメモリマップした int16 配列 [frames, channels] とサンプリングレートを返す
+    - ファイル全体を読まず、切り出した範囲だけがページインされる
+    - 16bit PCM の WAV でなければ None
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+                f.seek(chunk_size - 16 + (chunk_size & 1), io.SEEK_CUR)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                # チャンクは2バイト境界に揃えられている
+                f.seek(chunk_size + (chunk_size & 1), io.SEEK_CUR)
+
+    if fmt is None:
+        return None
+    audio_format, channels, sampling_rate, _, _, bits = fmt
+    if audio_format != 1 or bits != 16:
+        return None
+    # 書き込み途中などでサイズが正しくない場合に備え、ファイルの終端を超えないようにする
+    frames = min(chunk_size, os.path.getsize(path) - offset) // (2 * channels)
+    if not frames:
+        return np.zeros((0, channels), dtype=np.int16), sampling_rate
+    return np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(frames, channels)), sampling_rate
+
+
+def open_stored_audio(field_file):
+    """
+    保存済みの音声を [frames, channels] の配列とサンプリングレートで開く
+    - ローカルの 16bit WAV はメモリマップした int16 のまま返す（to_float で変換する）
+    - それ以外（FLAC・圧縮フォーマット・S3 など）はデコードして float32 で返す
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+    if path is not None:
+        mapped = wav_memmap(path)
+        if mapped is not None:
+            return mapped
+
+    with field_file.open('rb') as f:
+        data = f.read()
+    return sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+
+
+def to_float(audio):
+    """int16 のままの配列を float32 に変換する（変換済みならそのまま返す）"""
+    if audio.dtype == np.int16:
+        return audio.astype(np.float32) * PCM16_SCALE
+    return audio
+
+
+def seconds_to_frames(seconds, sampling_rate):
+    return int(round(seconds * sampling_rate))
+
+
+def get_number(op, key, default=None, minimum=None, maximum=None):
+    """操作のパラメータを数値として取り出す（不正なら EditError）"""
+    value = op.get(key, default)
+    if value is None:
+        raise EditError(f"{op.get('op')}の{key}は必須です。")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise EditError(f"{op.get('op')}の{key}は数値で指定してください。")
+    if not np.isfinite(value) or (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise EditError(f"{op.get('op')}の{key}が範囲外です。")
+    return value
+
+
+def fade_curves(length, curve):
+    """長さ length のフェードイン・フェードアウトの係数"""
+    position = (np.arange(length, dtype=np.float32) + 0.5) / max(length, 1)
+    if curve == 'equal_power':
+        return np.sin(position * (np.pi / 2)), np.cos(position * (np.pi / 2))
+    return position, 1.0 - position
+
+
+def match_format(audio, sampling_rate, channels, source_rate):
+    """別の音声をサンプリングレートとチャンネル数を揃えて float32 にする"""
+    audio = to_float(audio)
+    if source_rate != sampling_rate:
+        audio = resample(np.asarray(audio), source_rate, sampling_rate)
+    if audio.shape[1] != channels:
+        # モノラルは複製し、それ以外はチャンネルの平均をとってから複製する
+        audio = np.repeat(audio.mean(axis=1, keepdims=True), channels, axis=1)
+    return audio
+
+
+def trim(audio, sampling_rate, op):
+    """start〜end 秒を切り出す（int16 のメモリマップならコピーせずに範囲を絞るだけ）"""
+    duration = len(audio) / sampling_rate
+    start = get_number(op, 'start', 0.0, minimum=0.0)
+    end = get_number(op, 'end', duration, minimum=0.0)
+    if end <= start:
+        raise EditError("trimのendはstartより後を指定してください。")
+    return audio[seconds_to_frames(start, sampling_rate):seconds_to_frames(end, sampling_rate)]
+
+
+def fade(audio, sampling_rate, op):
+    """先頭を in 秒でフェードイン、末尾を out 秒でフェードアウトする"""
+    audio = to_float(audio).copy()
+    curve = op.get('curve', 'linear')
+    if curve not in FADE_CURVES:
+        raise EditError(f"fadeのcurveは{', '.join(FADE_CURVES)}のいずれかを指定してください。")
+    fade_in = min(seconds_to_frames(get_number(op, 'in', 0.0, minimum=0.0), sampling_rate), len(audio))
+    fade_out = min(seconds_to_frames(get_number(op, 'out', 0.0, minimum=0.0), sampling_rate), len(audio))
+    if fade_in:
+        audio[:fade_in] *= fade_curves(fade_in, curve)[0][:, None]
+    if fade_out:
+        audio[len(audio) - fade_out:] *= fade_curves(fade_out, curve)[1][:, None]
+    return audio
+
+
+def gain(audio, sampling_rate, op):
+    """db だけ音量を変える"""
+    return to_float(audio) * np.float32(10 ** (get_number(op, 'db', minimum=-60.0, maximum=24.0) / 20))
+
+
+def normalize(audio, sampling_rate, op):
+    """
+    音量を揃える
+    - lufs を指定した場合は統合ラウドネス、それ以外はサンプルピーク（peak_db、既定 -1 dBFS）を基準にする
+    """
+    audio = to_float(audio)
+    if 'lufs' in op:
+        target = get_number(op, 'lufs', minimum=-60.0, maximum=0.0)
+        loudness = measure_loudness(audio, sampling_rate)
+        if loudness is None:
+            return audio
+        return audio * np.float32(10 ** ((target - loudness) / 20))
+
+    target = get_number(op, 'peak_db', -1.0, minimum=-60.0, maximum=0.0)
+    peak = float(np.abs(audio).max(initial=0.0))
+    if peak == 0:
+        return audio
+    return audio * np.float32(10 ** (target / 20) / peak)
+
+
+def loop(audio, sampling_rate, op):
+    """
+    末尾 crossfade 秒を先頭に重ねて継ぎ目のないループにし、count 回繰り返す
+    - ループの長さは元の長さ - crossfade 秒。末尾から先頭に戻るところでも音が途切れない
+    """
+    audio = to_float(audio)
+    count = int(get_number(op, 'count', 1, minimum=1, maximum=1000))
+    overlap = seconds_to_frames(get_number(op, 'crossfade', 0.0, minimum=0.0), sampling_rate)
+    if overlap * 2 > len(audio):
+        raise EditError("loopのcrossfadeは音声長の半分以下で指定してください。")
+
+    looped = audio[:len(audio) - overlap].copy()
+    if overlap:
+        fade_in, fade_out = fade_curves(overlap, 'equal_power')
+        looped[:overlap] = audio[:overlap] * fade_in[:, None] + audio[len(audio) - overlap:] * fade_out[:, None]
+    return np.tile(looped, (count, 1))
+
+
+def concat(audio, sampling_rate, op, other):
+    """別の音声を後ろにつなげる（crossfade 秒だけ重ねてクロスフェードする）"""
+    audio = to_float(audio)
+    overlap = seconds_to_frames(get_number(op, 'crossfade', 0.0, minimum=0.0), sampling_rate)
+    if overlap > min(len(audio), len(other)):
+        raise EditError("concatのcrossfadeは両方の音声長以下で指定してください。")
+
+    result = np.empty((len(audio) + len(other) - overlap, audio.shape[1]), dtype=np.float32)
+    result[:len(audio)] = audio
+    result[len(audio):] = other[overlap:]
+    if overlap:
+        fade_in, fade_out = fade_curves(overlap, 'equal_power')
+        head = slice(len(audio) - overlap, len(audio))
+        result[head] = audio[head] * fade_out[:, None] + other[:overlap] * fade_in[:, None]
+    return result
+
+
+def mix(audio, sampling_rate, op, other):
+    """別の音声を offset 秒の位置から gain_db の音量で重ねる（はみ出す分は長さを伸ばす）"""
+    audio = to_float(audio)
+    offset = seconds_to_frames(
+        get_number(op, 'offset', 0.0, minimum=0.0, maximum=len(audio) / sampling_rate), sampling_rate
+    )
+    other = other * np.float32(10 ** (get_number(op, 'gain_db', 0.0, minimum=-60.0, maximum=24.0) / 20))
+
+    length = max(len(audio), offset + len(other))
+    result = np.zeros((length, audio.shape[1]), dtype=np.float32)
+    result[:len(audio)] = audio
+    result[offset:offset + len(other)] += other
+    return result
+
+
+# 音声1つを対象にする操作と、別の音声（source）を組み合わせる操作
+SINGLE_OPERATIONS = {
+    'trim': trim,
+    'fade': fade,
+    'gain': gain,
+    'normalize': normalize,
+    'loop': loop,
+}
+SOURCE_OPERATIONS = {
+    'concat': concat,
+    'mix': mix,
+}
+
+
+def apply_edits(audio, sampling_rate, operations, load_source, max_duration):
+    """
+    音声 [frames, channels] に操作を順に適用して、float32 の配列を返す
+    - load_source(id) は concat / mix に使う別の音声を (配列, サンプリングレート) で返す
+    - 各操作は配列全体に対するベクトル演算で、サンプルごとの Python のループは使わない
+    - 途中・最終結果が max_duration 秒を超える場合は EditError
+    """
+    if not isinstance(operations, list) or len(operations) > MAX_OPERATIONS:
+        raise EditError(f"operationsは{MAX_OPERATIONS}件以下のリストで指定してください。")
+
+    max_frames = seconds_to_frames(max_duration, sampling_rate)
+    for op in operations:
+        if not isinstance(op, dict):
+            raise EditError("operationsの各要素はオブジェクトで指定してください。")
+        name = op.get('op')
+        if name in SINGLE_OPERATIONS:
+            if name == 'loop' and len(audio) * get_number(op, 'count', 1, minimum=1, maximum=1000) > max_frames:
+                raise EditError(f"編集後の音声長は最大{max_duration}秒までです。")
+            audio = SINGLE_OPERATIONS[name](audio, sampling_rate, op)
+        elif name in SOURCE_OPERATIONS:
+            other, source_rate = load_source(op.get('source'))
+            if 'start' in op or 'end' in op:
+                other = trim(other, source_rate, dict(op, op=name))
+            other = match_format(other, sampling_rate, audio.shape[1], source_rate)
+            audio = SOURCE_OPERATIONS[name](audio, sampling_rate, op, other)
+        else:
+            raise EditError(
+                f"opは{', '.join(list(SINGLE_OPERATIONS) + list(SOURCE_OPERATIONS))}のいずれかを指定してください。"
+            )
+        if len(audio) > max_frames:
+            raise EditError(f"編集後の音声長は最大{max_duration}秒までです。")
+
+    if not len(audio):
+        raise EditError("編集後の音声が空です。")
+    # 音量を上げた結果 ±1 を超えた部分は、エンコード時に折り返さないよう切り詰める
+    return np.clip(to_float(audio), -1.0, 1.0)
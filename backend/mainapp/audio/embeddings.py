@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+
+import torch
+from django.conf import settings
+
+
+class PromptEmbeddingCache:
+    """
+    T5テキストエンコーダーの出力（hidden states と attention mask）を保持する LRU キャッシュ
+    - キーは (モデルID, リビジョン, テキスト)
+    - ネガティブプロンプトはほぼ固定、人気のプロンプトは繰り返されるため、エンコーダーの実行を省略できる
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """キーごとの値（なければ None）のリストを返し、ヒット・ミスを記録する"""
+        values = []
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                values.append(value)
+        return values
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """監視用のヒット率カウンター"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+@torch.no_grad()
+def _run_text_encoder(pipe, texts):
+    """テキストをトークン化して T5 エンコーダーを実行する（パイプラインの encode_prompt と同じ処理）"""
+    text_inputs = pipe.tokenizer(
+        texts,
+        padding="max_length",
+        max_length=pipe.tokenizer.model_max_length,
+        truncation=True,
+        return_tensors="pt",
+    )
+    input_ids = text_inputs.input_ids.to(pipe.device)
+    attention_mask = text_inputs.attention_mask.to(pipe.device)
+    pipe.text_encoder.eval()
+    hidden_states = pipe.text_encoder(input_ids, attention_mask=attention_mask)[0]
+    return hidden_states, attention_mask
+
+
+def encode_texts(pipe, texts, cache, model_key, negative=False):
+    """
+    テキストのリストを (embeds[B, L, D], attention_mask[B, L]) にエンコードする
+    - キャッシュにないテキストだけを1回のエンコーダー呼び出しでまとめて計算する
+    - negative=True の場合は、パイプラインと同じくパディング位置を0にする
+    """
+    keys = [(model_key, text) for text in texts]
+    values = cache.get_many(keys)
+
+    missing = list(dict.fromkeys(text for text, value in zip(texts, values) if value is None))
+    if missing:
+        hidden_states, attention_mask = _run_text_encoder(pipe, missing)
+        computed = {}
+        for i, text in enumerate(missing):
+            value = (hidden_states[i].clone(), attention_mask[i].clone())
+            computed[text] = value
+            cache.put((model_key, text), value)
+        values = [value if value is not None else computed[text] for text, value in zip(texts, values)]
+
+    embeds = torch.stack([value[0] for value in values])
+    attention_mask = torch.stack([value[1] for value in values])
+    if negative:
+        embeds = torch.where(attention_mask.to(torch.bool).unsqueeze(2), embeds, 0.0)
+    return embeds, attention_mask
+
+
+_embedding_cache = None
+
+def get_embedding_cache():
+    """プロンプト埋め込みキャッシュを一度だけ初期化して返す"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = PromptEmbeddingCache(settings.AUDIO_EMBEDDING_CACHE_SIZE)
+    return _embedding_cache
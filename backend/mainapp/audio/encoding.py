@@ -0,0 +1,143 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+# レスポンスとして送り出す1チャンクのサイズ
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 出力フォーマットの定義
+# - sampling_rates: エンコーダーが対応するサンプリングレート（None なら任意）
+OUTPUT_FORMATS = {
+    'wav': {
+        'format': 'WAV', 'subtype': 'PCM_16', 'content_type': 'audio/wav',
+        'extension': 'wav', 'lossy': False, 'sampling_rates': None,
+    },
+    'flac': {
+        'format': 'FLAC', 'subtype': 'PCM_16', 'content_type': 'audio/flac',
+        'extension': 'flac', 'lossy': False, 'sampling_rates': None,
+    },
+    'ogg': {
+        'format': 'OGG', 'subtype': 'OPUS', 'content_type': 'audio/ogg; codecs=opus',
+        'extension': 'ogg', 'lossy': True, 'sampling_rates': (48000, 24000, 16000, 12000, 8000),
+    },
+    'mp3': {
+        'format': 'MP3', 'subtype': 'MPEG_LAYER_III', 'content_type': 'audio/mpeg',
+        'extension': 'mp3', 'lossy': True,
+        'sampling_rates': (48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000),
+    },
+}
+
+# 'opus' は 'ogg' の別名として受け付ける
+FORMAT_ALIASES = {
+    'opus': 'ogg',
+}
+
+# 品質レベル（低い順）と libsndfile の compression_level の対応
+# - 非可逆フォーマットでは 0 が最高品質（最大ビットレート）、1 が最小サイズ
+QUALITY_LEVELS = ['low', 'standard', 'high']
+QUALITY_COMPRESSION_LEVELS = {
+    'low': 0.9,
+    'standard': 0.5,
+    'high': 0.1,
+}
+
+
+def available_formats():
+    """この環境の libsndfile でエンコードできるフォーマット名の一覧"""
+    supported = sf.available_formats()
+    return [
+        name for name, spec in OUTPUT_FORMATS.items()
+        if spec['format'] in supported and spec['subtype'] in sf.available_subtypes(spec['format'])
+    ]
+
+
+def normalize_format(name):
+    """リクエストのフォーマット名を正規化する。未対応なら None"""
+    name = FORMAT_ALIASES.get((name or 'wav').lower(), (name or 'wav').lower())
+    return name if name in available_formats() else None
+
+
+def resample(audio_np, src_rate, dst_rate):
+    """
+    FFT を使ってサンプリングレートを変換する（全チャンネルをまとめてベクトル演算）
+    """
+    if src_rate == dst_rate:
+        return audio_np
+    num_samples = audio_np.shape[0]
+    dst_samples = int(round(num_samples * dst_rate / src_rate))
+    spectrum = np.fft.rfft(audio_np, axis=0)
+    dst_bins = dst_samples // 2 + 1
+    if dst_bins > spectrum.shape[0]:
+        pad = np.zeros((dst_bins - spectrum.shape[0],) + spectrum.shape[1:], dtype=spectrum.dtype)
+        spectrum = np.concatenate([spectrum, pad], axis=0)
+    else:
+        spectrum = spectrum[:dst_bins]
+    resampled = np.fft.irfft(spectrum, n=dst_samples, axis=0) * (dst_samples / num_samples)
+    return resampled.astype(np.float32, copy=False)
+
+
+def encode_audio(audio_np, sampling_rate, output_format='wav', quality='standard'):
+    """
+    numpy配列[samples, channels]を指定フォーマットでメモリ上にエンコードする
+    - 戻り値は BytesIO のバッファを参照する memoryview（コピーしない）
+    """
+    spec = OUTPUT_FORMATS[output_format]
+
+    # エンコーダーが対応していないサンプリングレートは、対応する中で最も近いものに変換する
+    rates = spec['sampling_rates']
+    if rates and sampling_rate not in rates:
+        target_rate = min(rates, key=lambda rate: (rate < sampling_rate, abs(rate - sampling_rate)))
+        audio_np = resample(audio_np, sampling_rate, target_rate)
+        sampling_rate = target_rate
+
+    kwargs = {}
+    if spec['lossy']:
+        kwargs['compression_level'] = QUALITY_COMPRESSION_LEVELS[quality]
+
+    buffer = io.BytesIO()
+    sf.write(buffer, audio_np, sampling_rate, format=spec['format'], subtype=spec['subtype'], **kwargs)
+    return buffer.getbuffer()
+
+
+_encode_executor = None
+_encode_executor_lock = threading.Lock()
+
+def get_encode_executor():
+    """エンコードなど生成後の処理を実行するスレッドプールを一度だけ初期化して返す"""
+    global _encode_executor
+    with _encode_executor_lock:
+        if _encode_executor is None:
+            _encode_executor = ThreadPoolExecutor(
+                max_workers=settings.AUDIO_ENCODE_WORKERS,
+                thread_name_prefix='audio-encode',
+            )
+    return _encode_executor
+
+
+def submit_encode(audio_np, sampling_rate, output_format='wav', quality='standard'):
+    """
+    エンコードを専用のスレッドプールで実行し、Future を返す
+    - 推論スレッドはすぐに次のバッチに進めるため、エンコードと次の推論が重なって実行される
+    - libsndfile の処理中は GIL が解放されるので、複数のエンコードも並列に進む
+    """
+    return get_encode_executor().submit(encode_audio, audio_np, sampling_rate, output_format, quality)
+
+
+def iter_chunks(data, chunk_size=STREAM_CHUNK_SIZE):
+    """bytes / memoryview をコピーせずにチャンクごとに切り出す"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+def audio_streaming_response(data, content_type, filename):
+    """エンコード済み音声を Content-Length 付きのストリーミングレスポンスにする"""
+    response = StreamingHttpResponse(iter_chunks(data), content_type=content_type)
+    response["Content-Length"] = str(len(data))
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,77 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+# Idempotency-Key ヘッダーの最大長
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """同じキーのリクエストが処理中か、キーが別の内容のリクエストに使われている"""
+
+    def __init__(self, detail, status_code):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def request_fingerprint(path, data):
+    """リクエストのパスと内容のハッシュ（同じキーで別のリクエストが送られていないかの確認に使う）"""
+    if hasattr(data, 'dict'):
+        data = data.dict()
+    payload = json.dumps({'path': path, 'data': data}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def claim_idempotency_key(user, key, fingerprint):
+    """
+    冪等キーを確保する
+    - 新しいキーなら処理中として記録し (記録, None) を返す
+    - 処理済みのキーなら (None, 最初の結果の GeneratedAudio) を返す
+    - 処理中のキー（409）や、別の内容のリクエストに使われたキー（422）は IdempotencyConflict を送出する
+    - 処理中のまま AUDIO_IDEMPOTENCY_LOCK_SECONDS を過ぎた記録（ワーカーが落ちたなど）は、
+      条件付き更新で引き継いで (記録, None) を返す（同時に引き継げるのは1つのリクエストだけ）
+    - 有効期限（AUDIO_IDEMPOTENCY_KEY_TTL）を過ぎた記録は、確保のついでに削除する
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.AUDIO_IDEMPOTENCY_KEY_TTL)
+    IdempotencyKey.objects.filter(user=user, created_at__lt=expired).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint), None
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.select_related('audio').filter(user=user, key=key).first()
+    if record is not None and record.fingerprint != fingerprint:
+        raise IdempotencyConflict("このIdempotency-Keyは別の内容のリクエストに使われています。", 422)
+    if record is not None and record.audio is None:
+        stale = now - timedelta(seconds=settings.AUDIO_IDEMPOTENCY_LOCK_SECONDS)
+        taken_over = IdempotencyKey.objects.filter(
+            pk=record.pk, audio__isnull=True, created_at=record.created_at, created_at__lt=stale,
+        ).update(created_at=now)
+        if taken_over:
+            record.created_at = now
+            return record, None
+    if record is None or record.audio is None:
+        # 他のリクエストが処理中（record が None なら、確保の直後に処理が失敗して削除された）
+        raise IdempotencyConflict("同じIdempotency-Keyのリクエストを処理中です。", 409)
+    return None, record.audio
+
+
+def finish_idempotency_key(record, audio_id):
+    """
+    処理の結果を記録する（audio_id が None なら失敗として削除し、同じキーで再試行できるようにする）
+    - 処理に時間がかかり、他のリクエストに記録を引き継がれていた場合は何もしない（引き継いだ側の結果を残す）
+    """
+    claimed = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at, audio__isnull=True)
+    if audio_id is None:
+        claimed.delete()
+    else:
+        claimed.update(audio_id=audio_id)
@@ -0,0 +1,251 @@
+import json
+import select
+import socket
+import struct
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .admission import AdmissionRejected
+from .batching import GenerationCancelled
+
+# フレーム形式（すべてビッグエンディアン）
+#   magic(4B) | ヘッダー長 uint32 | ペイロード長 uint64 | ヘッダー(JSON, UTF-8) | ペイロード(バイナリ)
+# - ヘッダーには操作名やパラメータ、ペイロードには音声・潜在表現の float32 の配列をそのまま入れる
+# - 音声を JSON / base64 に変換しないため、エンコード・デコードのコストとサイズが増えない
+# - 生成リクエストで progress を指定すると、応答の前に {'progress': {...}} だけのフレームが送られる
+FRAME_MAGIC = b'AUD1'
+FRAME_PREFIX = struct.Struct('!4sIQ')
+
+# 異常なフレームで巨大なバッファを確保しないための上限
+MAX_HEADER_BYTES = 1024 * 1024
+MAX_PAYLOAD_BYTES = 1024 * 1024 * 1024
+
+# 応答待ちの間にキャンセルを確認する間隔（秒）
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class InferenceServerError(RuntimeError):
+    """推論サーバーがエラーを返した、または通信に失敗した"""
+
+
+def parse_address(address):
+    """
+    'unix:///path/to.sock' または 'tcp://host:port' を (ソケットファミリー, アドレス) に変換する
+    """
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    if address.startswith('tcp://'):
+        host, _, port = address[len('tcp://'):].rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError(f"Unsupported inference server address: {address}")
+
+
+def _recv_exactly(sock, size, allow_eof=False):
+    """
+    size バイトを受信しきるまで読む（ペイロードは確保済みのバッファに直接受信する）
+    - allow_eof=True なら、1バイトも受信しないうちに接続が閉じた場合に None を返す
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            if allow_eof and received == 0:
+                return None
+            raise ConnectionError("Connection closed while receiving a frame")
+        received += n
+    return buffer
+
+
+def send_frame(sock, header, payload=b''):
+    """ヘッダー(dict)とペイロード(bytes 互換)を1フレームとして送信する"""
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    payload = memoryview(payload).cast('B')
+    sock.sendall(FRAME_PREFIX.pack(FRAME_MAGIC, len(header_bytes), len(payload)) + header_bytes)
+    if len(payload):
+        sock.sendall(payload)
+
+
+def recv_frame(sock):
+    """1フレームを受信して (ヘッダー(dict), ペイロード(bytearray)) を返す。接続が閉じていれば None"""
+    prefix = _recv_exactly(sock, FRAME_PREFIX.size, allow_eof=True)
+    if prefix is None:
+        return None
+
+    magic, header_size, payload_size = FRAME_PREFIX.unpack(prefix)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Invalid frame")
+    if header_size > MAX_HEADER_BYTES or payload_size > MAX_PAYLOAD_BYTES:
+        raise ValueError("Frame too large")
+
+    header = json.loads(_recv_exactly(sock, header_size).decode('utf-8'))
+    payload = _recv_exactly(sock, payload_size) if payload_size else bytearray()
+    return header, payload
+
+
+def pack_audio(audio_np):
+    """numpy配列[samples, channels]をヘッダー情報とペイロードに変換する"""
+    audio_np = np.ascontiguousarray(audio_np, dtype='<f4')
+    return {'shape': list(audio_np.shape), 'dtype': '<f4'}, audio_np
+
+
+def unpack_audio(header, payload):
+    """pack_audio の逆変換（受信バッファをコピーせずに numpy配列として参照する）"""
+    return np.frombuffer(payload, dtype=header['dtype']).reshape(header['shape'])
+
+
+def pack_audios(audios):
+    """複数の numpy配列を1つのペイロードに連結する（ヘッダーにはそれぞれの形状を入れる）"""
+    audios = [np.ascontiguousarray(audio_np, dtype='<f4') for audio_np in audios]
+    payload = np.concatenate([audio_np.ravel() for audio_np in audios]) if audios else np.empty(0, dtype='<f4')
+    return {'shapes': [list(audio_np.shape) for audio_np in audios], 'dtype': '<f4'}, payload
+
+
+def unpack_audios(header, payload):
+    """pack_audios の逆変換（それぞれ受信バッファをコピーせずに参照する）"""
+    audios = []
+    offset = 0
+    itemsize = np.dtype(header['dtype']).itemsize
+    for shape in header['shapes']:
+        count = int(np.prod(shape))
+        audios.append(np.frombuffer(payload, dtype=header['dtype'], count=count, offset=offset).reshape(shape))
+        offset += count * itemsize
+    return audios
+
+
+class InferenceClient:
+    """
+    推論サーバーのクライアント
+    - リクエストごとに接続して1往復する（Unix ドメインソケット・localhost なら接続コストは小さい）
+    """
+
+    def __init__(self, address, timeout=None):
+        self.address = address
+        self.family, self.sockaddr = parse_address(address)
+        self.timeout = timeout
+
+    def _request(self, header, payload=b'', cancel_token=None, on_progress=None):
+        try:
+            with socket.socket(self.family, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                if self.family == socket.AF_INET:
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.connect(self.sockaddr)
+                send_frame(sock, header, payload)
+                # 応答の前に届く進捗フレームは on_progress に渡し、応答が届くまで読み続ける
+                while True:
+                    if cancel_token is not None:
+                        self._wait_for_response(sock, cancel_token)
+                    frame = recv_frame(sock)
+                    if frame is None or 'progress' not in frame[0]:
+                        break
+                    if on_progress is not None:
+                        on_progress(**frame[0]['progress'])
+        except (OSError, ValueError) as e:
+            raise InferenceServerError(f"Inference server request failed: {e}") from e
+
+        if frame is None:
+            raise InferenceServerError("Inference server closed the connection")
+        response, payload = frame
+        if response.get('cancelled'):
+            raise GenerationCancelled()
+        if response.get('rejected'):
+            raise AdmissionRejected(response['retry_after'])
+        if not response.get('ok'):
+            raise InferenceServerError(response.get('error') or "Inference server error")
+        return response, payload
+
+    def _wait_for_response(self, sock, cancel_token):
+        """
+        応答が届くまで待ち、その間にキャンセルされたら接続を閉じる
+        - サーバーは接続が閉じられたことを検知して生成を打ち切る
+        """
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        while True:
+            readable, _, _ = select.select([sock], [], [], CANCEL_POLL_INTERVAL)
+            if readable:
+                return
+            if cancel_token.is_cancelled:
+                raise GenerationCancelled()
+            if deadline is not None and time.monotonic() > deadline:
+                raise socket.timeout("timed out")
+
+    def generate(self, prompt, neg_prompt, steps, duration, seed, tier=None, cancel_token=None, on_progress=None,
+                 requester=None, init_latents=None, strength=None):
+        """
+        音声を1本生成して (numpy配列[samples, channels], サンプリングレート, 潜在表現 numpy[channels, frames]) を返す
+        - on_progress を渡すと、サーバーが生成中に送る進捗フレームごとに呼ばれる
+        - init_latents（リファインする下書きの潜在表現）はペイロードで送る
+        """
+        header = {
+            'op': 'generate',
+            'prompt': prompt,
+            'neg_prompt': neg_prompt,
+            'steps': steps,
+            'duration': duration,
+            'seed': seed,
+            'tier': tier,
+            'progress': on_progress is not None,
+            'requester': requester,
+        }
+        payload = b''
+        if init_latents is not None:
+            header['init_latents'], payload = pack_audio(init_latents)
+            header['strength'] = strength
+        response, payload = self._request(header, payload, cancel_token=cancel_token, on_progress=on_progress)
+        audio_np, latents = unpack_audios(response, payload)
+        return audio_np, response['sampling_rate'], latents
+
+    def generate_batch(self, items, cancel_token=None, requester=None):
+        """
+        複数の音声をまとめて生成して ([numpy配列[samples, channels], ...], サンプリングレート, [潜在表現, ...]) を返す
+        - items は prompt / neg_prompt / steps / duration / seed / tier の dict のリスト
+        """
+        response, payload = self._request({
+            'op': 'generate_batch',
+            'items': items,
+            'requester': requester,
+        }, cancel_token=cancel_token)
+        # ペイロードには音声、潜在表現の順に並んでいる
+        arrays = unpack_audios(response, payload)
+        return arrays[:len(items)], response['sampling_rate'], arrays[len(items):]
+
+    def decode(self, latents, duration, cancel_token=None, requester=None):
+        """保存済みの潜在表現をデコードして (numpy配列[samples, channels], サンプリングレート) を返す"""
+        header, payload = pack_audio(latents)
+        response, payload = self._request({
+            'op': 'decode',
+            'duration': duration,
+            'latents': header,
+            'requester': requester,
+        }, payload, cancel_token=cancel_token)
+        return unpack_audio(response, payload), response['sampling_rate']
+
+    def profile(self):
+        """推論サーバーの実行プロファイル（name / device / dtype）"""
+        response, _ = self._request({'op': 'profile'})
+        return response['profile']
+
+    def stats(self):
+        """推論サーバー側の監視用カウンター"""
+        response, _ = self._request({'op': 'stats'})
+        return response['stats']
+
+
+_client = None
+
+
+def get_inference_client():
+    """推論サーバーが設定されていればクライアントを返す。未設定なら None（プロセス内で推論する）"""
+    global _client
+    if not settings.AUDIO_INFERENCE_SERVER:
+        return None
+    if _client is None:
+        _client = InferenceClient(
+            settings.AUDIO_INFERENCE_SERVER,
+            timeout=settings.AUDIO_INFERENCE_TIMEOUT,
+        )
+    return _client
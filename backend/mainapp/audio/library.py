@@ -0,0 +1,82 @@
+import io
+
+import numpy as np
+from django.core.files.base import ContentFile
+
+from .analysis import analyze_encoded_audio
+from .delivery import audio_checksum
+from .encoding import OUTPUT_FORMATS
+from .models import GeneratedAudio
+from .sampling import get_tier
+
+
+def pack_latents(latents):
+    """潜在表現 [channels, frames] を float16 の .npy のバイト列にする（1本あたり 100KB 程度）"""
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(latents, dtype=np.float16), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def unpack_latents(data):
+    """pack_latents の逆変換（float32 で返す）"""
+    return np.load(io.BytesIO(data), allow_pickle=False).astype(np.float32)
+
+
+def load_latents(audio):
+    """ライブラリの音声に保存された潜在表現を読み込む（保存されていなければ None）"""
+    if not audio.latents_file:
+        return None
+    with audio.latents_file.open('rb') as f:
+        return unpack_latents(f.read())
+
+
+def sampling_settings(params, strength=None):
+    """潜在表現と一緒に保存するサンプリングの設定（リファインの既定値や再現に使う）"""
+    tier_options = get_tier(params['tier']) or {}
+    return {
+        'scheduler': tier_options.get('scheduler', 'default'),
+        'steps': params['steps'],
+        'guidance_cutoff': tier_options.get('guidance_cutoff', 1.0),
+        'strength': strength,
+    }
+
+
+def attach_analysis(audio, analysis):
+    """
+    解析結果（メタデータ, 波形ピーク）をライブラリの音声に設定する（保存は呼び出し側）
+    - 波形ピークは音声と同じ場所に .peaks として保存する
+    """
+    metadata, peaks = analysis
+    audio.analysis = dict(metadata, peaks=dict(metadata['peaks'], checksum=audio_checksum(peaks)))
+    audio.peaks_file.save(f"audio_{audio.id}.peaks", ContentFile(peaks), save=False)
+
+
+def save_to_library(user, params, data, analysis=None, latents=None, refined_from=None, strength=None):
+    """
+    エンコード済みの音声をユーザーのライブラリに保存する
+    - 再ダウンロードはファイルの読み出しだけで済み、推論も使用量の消費もしない
+    - analysis は analyze_audio() の結果。なければエンコード済みの音声から解析する
+    - latents は pack_latents() のバイト列。リファインした音声は refined_from と strength も記録する
+    """
+    audio = GeneratedAudio(
+        user=user,
+        prompt=params['prompt'],
+        neg_prompt=params['neg_prompt'],
+        duration=params['duration'],
+        steps=params['steps'],
+        seed=params['seed'],
+        output_format=params['output_format'],
+        quality=params['quality'],
+        tier=params['tier'],
+        size=len(data),
+        checksum=audio_checksum(data),
+        sampling=sampling_settings(params, strength),
+        refined_from=refined_from,
+    )
+    extension = OUTPUT_FORMATS[params['output_format']]['extension']
+    audio.file.save(f"audio_{audio.id}.{extension}", ContentFile(data), save=False)
+    if latents is not None:
+        audio.latents_file.save(f"audio_{audio.id}.latents.npy", ContentFile(latents), save=False)
+    attach_analysis(audio, analysis or analyze_encoded_audio(data))
+    audio.save()
+    return audio
@@ -0,0 +1,72 @@
+import math
+import struct
+
+import numpy as np
+
+from .editing import fade_curves
+
+
+def plan_windows(duration, window, overlap):
+    """
+    duration 秒を、隣と overlap 秒ずつ重なる最大 window 秒のウィンドウに分けて [(開始秒, 長さ秒), ...] を返す
+    - モデルが一度に生成できる長さ（window）以下ならウィンドウは1つ
+    """
+    if duration <= window:
+        return [(0.0, duration)]
+    hop = window - overlap
+    count = math.ceil((duration - overlap) / hop)
+    return [(index * hop, min(window, duration - index * hop)) for index in range(count)]
+
+
+def window_frames(windows, sampling_rate, max_frames):
+    """
+    各ウィンドウのサンプル数（パイプラインと同じく int(長さ * サンプリングレート)）
+    - max_frames には実際に生成した最初のウィンドウのサンプル数を渡し、モデルの出力より長く見積もらないようにする
+    """
+    return [min(int(length * sampling_rate), max_frames) for _, length in windows]
+
+
+def total_frames(frames, overlap_frames):
+    """つなぎ合わせた後のサンプル数（重なりの分だけ短くなる）"""
+    return sum(frames) - overlap_frames * (len(frames) - 1)
+
+
+def fit_length(audio, frames):
+    """ウィンドウの長さを予定のサンプル数に揃える（端数の違いで Content-Length とずれないようにする）"""
+    if len(audio) >= frames:
+        return audio[:frames]
+    return np.concatenate([audio, np.zeros((frames - len(audio), audio.shape[1]), dtype=audio.dtype)])
+
+
+def stitch_windows(windows, overlap_frames):
+    """
+    順に生成されたウィンドウ [samples, channels] を、重なりを等パワーでクロスフェードしながらつなぐ
+    - 確定した部分（次のウィンドウと重ならない部分）を順に返す
+    - 保持するのは直前のウィンドウの重なり部分だけなので、全体の長さによらずメモリ使用量は一定
+    """
+    fade_in, fade_out = fade_curves(overlap_frames, 'equal_power')
+    tail = None
+    for audio in windows:
+        audio = np.array(audio, dtype=np.float32)
+        if tail is not None:
+            audio[:overlap_frames] = tail * fade_out[:, None] + audio[:overlap_frames] * fade_in[:, None]
+        yield audio[:len(audio) - overlap_frames]
+        tail = audio[len(audio) - overlap_frames:]
+    if tail is not None and len(tail):
+        yield tail
+
+
+def wav_header(frames, channels, sampling_rate):
+    """16bit PCM の WAV ヘッダー（長さを先に書くので、サンプルを順に送り出せる）"""
+    data_size = frames * channels * 2
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sampling_rate, sampling_rate * channels * 2, channels * 2, 16,
+        b'data', data_size,
+    )
+
+
+def pcm16_bytes(audio):
+    """float32 の音声を 16bit PCM（リトルエンディアン）のバイト列にする"""
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
@@ -0,0 +1 @@
+# audio management commands 
\ No newline at end of file
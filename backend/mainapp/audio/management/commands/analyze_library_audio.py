@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.audio.analysis import analyze_encoded_audio
+from mainapp.audio.library import attach_analysis
+from mainapp.audio.models import GeneratedAudio
+
+
+class Command(BaseCommand):
+    help = '波形ピーク・ラウドネスが未解析のライブラリの音声を解析して保存します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='解析済みの音声も解析し直す')
+
+    def handle(self, *args, **options):
+        audios = GeneratedAudio.objects.all()
+        if not options['all']:
+            audios = audios.filter(peaks_file='')
+
+        analyzed = failed = 0
+        for audio in audios.iterator():
+            try:
+                with audio.file.open('rb') as f:
+                    data = f.read()
+                if audio.peaks_file:
+                    audio.peaks_file.delete(save=False)
+                attach_analysis(audio, analyze_encoded_audio(data))
+                audio.save(update_fields=['analysis', 'peaks_file'])
+                analyzed += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{audio.id}: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'{analyzed}件を解析しました（失敗: {failed}件）'))
@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from mainapp.audio.encoding import QUALITY_LEVELS, available_formats, encode_audio
+
+class Command(BaseCommand):
+    help = '出力フォーマット・品質ごとのエンコード時間と削減できるバイト数を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=30.0, help='計測に使う音声の長さ（秒）')
+        parser.add_argument('--sampling-rate', type=int, default=44100, help='サンプリングレート')
+        parser.add_argument('--repeat', type=int, default=3, help='各条件の計測回数（最速値を採用）')
+
+    def make_test_audio(self, duration, sampling_rate):
+        """生成音声に近い、倍音とノイズを含むステレオ信号を作る"""
+        rng = np.random.default_rng(0)
+        t = np.arange(int(duration * sampling_rate)) / sampling_rate
+        tones = sum(
+            np.sin(2 * np.pi * freq * t) / (i + 1)
+            for i, freq in enumerate([110.0, 220.0, 330.0, 440.0, 880.0])
+        )
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 0.5 * t)
+        left = 0.2 * tones * envelope + 0.02 * rng.standard_normal(t.shape)
+        right = 0.2 * np.roll(tones, 441) * envelope + 0.02 * rng.standard_normal(t.shape)
+        return np.stack([left, right], axis=1).astype(np.float32)
+
+    def handle(self, *args, **options):
+        duration = options['duration']
+        sampling_rate = options['sampling_rate']
+        audio = self.make_test_audio(duration, sampling_rate)
+
+        self.stdout.write(f'{duration}秒 / {sampling_rate}Hz / ステレオ の音声で計測します\n')
+        self.stdout.write(f"{'format':<8}{'quality':<10}{'bytes':>12}{'ratio':>9}{'saved':>12}{'encode(ms)':>12}{'x realtime':>12}")
+
+        wav_size = None
+        for output_format in available_formats():
+            qualities = QUALITY_LEVELS if output_format in ('ogg', 'mp3') else ['standard']
+            for quality in qualities:
+                best = None
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    data = encode_audio(audio, sampling_rate, output_format, quality)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+
+                size = len(data)
+                if wav_size is None:
+                    wav_size = size
+                self.stdout.write(
+                    f'{output_format:<8}{quality:<10}{size:>12,}{size / wav_size:>9.2%}'
+                    f'{wav_size - size:>12,}{best * 1000:>12.1f}{duration / best:>12.1f}'
+                )
+
+        self.stdout.write(self.style.SUCCESS('計測が完了しました'))
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+import torch
+from django.core.management.base import BaseCommand
+
+from mainapp.audio.pipeline import load_audio_pipeline
+from mainapp.audio.profiles import apply_thread_settings, inference_context, resolve_execution_profile
+
+DEFAULT_PROMPTS = [
+    'Upbeat electronic dance music with a driving bassline',
+    'Calm acoustic guitar melody in a quiet room',
+    'Heavy rain and distant thunder',
+]
+
+
+def snr_db(reference, estimate):
+    """reference に対する estimate の信号対雑音比（dB）"""
+    noise = np.sum((reference - estimate) ** 2)
+    if noise == 0:
+        return float('inf')
+    return float(10 * np.log10(np.sum(reference ** 2) / noise))
+
+
+class Command(BaseCommand):
+    help = '動的 int8 量子化モデルと fp32 モデルの生成時間と出力の差を比較します（CPU）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', type=int, default=20, help='推論ステップ数')
+        parser.add_argument('--duration', type=float, default=5.0, help='生成する音声の長さ（秒）')
+        parser.add_argument('--seed', type=int, default=0, help='シード値（両モデルで共通）')
+        parser.add_argument('--prompt', action='append', dest='prompts', help='比較に使うプロンプト（複数指定可）')
+
+    def generate(self, pipe, profile, prompt, steps, duration, seed):
+        generator = torch.Generator('cpu').manual_seed(seed)
+        with inference_context(profile):
+            start = time.perf_counter()
+            result = pipe(
+                prompt,
+                negative_prompt='Low quality.',
+                num_inference_steps=steps,
+                audio_end_in_s=duration,
+                num_waveforms_per_prompt=1,
+                generator=generator,
+            )
+            elapsed = time.perf_counter() - start
+        return result.audios[0].float().numpy(), elapsed
+
+    @torch.no_grad()
+    def text_embedding_similarity(self, reference_pipe, quantized_pipe, prompt):
+        """T5 エンコーダー出力のコサイン類似度（トークン平均）"""
+        embeddings = []
+        for pipe in (reference_pipe, quantized_pipe):
+            inputs = pipe.tokenizer(
+                prompt, padding='max_length', max_length=pipe.tokenizer.model_max_length,
+                truncation=True, return_tensors='pt',
+            )
+            embeddings.append(pipe.text_encoder(inputs.input_ids, attention_mask=inputs.attention_mask)[0][0])
+        return torch.nn.functional.cosine_similarity(embeddings[0], embeddings[1], dim=-1).mean().item()
+
+    def handle(self, *args, **options):
+        steps = options['steps']
+        duration = options['duration']
+        seed = options['seed']
+        prompts = options['prompts'] or DEFAULT_PROMPTS
+
+        profile = resolve_execution_profile('cpu-fp32')
+        apply_thread_settings(profile)
+        self.stdout.write('fp32 と int8 のパイプラインを読み込み中...')
+        reference_pipe = load_audio_pipeline(profile)
+        quantized_pipe = load_audio_pipeline(profile, 'int8-dynamic')
+
+        # 初回呼び出しの初期化コストを計測から除く
+        for pipe in (reference_pipe, quantized_pipe):
+            self.generate(pipe, profile, 'warmup', 2, 1.0, seed)
+
+        self.stdout.write(f'{steps}ステップ / {duration}秒 / シード {seed} で比較します\n')
+        self.stdout.write(f"{'prompt':<40}{'fp32(s)':>10}{'int8(s)':>10}{'speedup':>9}{'SNR(dB)':>10}{'max diff':>10}{'text cos':>10}")
+
+        reference_times, quantized_times = [], []
+        for prompt in prompts:
+            reference, reference_time = self.generate(reference_pipe, profile, prompt, steps, duration, seed)
+            quantized, quantized_time = self.generate(quantized_pipe, profile, prompt, steps, duration, seed)
+            reference_times.append(reference_time)
+            quantized_times.append(quantized_time)
+
+            self.stdout.write(
+                f'{prompt[:38]:<40}{reference_time:>10.2f}{quantized_time:>10.2f}'
+                f'{reference_time / quantized_time:>8.2f}x{snr_db(reference, quantized):>10.1f}'
+                f'{np.abs(reference - quantized).max():>10.4f}'
+                f'{self.text_embedding_similarity(reference_pipe, quantized_pipe, prompt):>10.4f}'
+            )
+
+        self.stdout.write(
+            f'\n平均: fp32 {np.mean(reference_times):.2f}秒 / int8 {np.mean(quantized_times):.2f}秒 '
+            f'({np.mean(reference_times) / np.mean(quantized_times):.2f}x)'
+        )
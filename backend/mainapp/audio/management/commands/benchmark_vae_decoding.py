@@ -0,0 +1,115 @@
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+import torch
+from diffusers import AutoencoderOobleck
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mainapp.audio.decoding import seconds_to_latent_frames, tiled_decode
+from mainapp.audio.profiles import DTYPES, apply_thread_settings, inference_context, resolve_execution_profile
+from .benchmark_quantization import snr_db
+
+
+def peak_rss_bytes():
+    """このプロセスのこれまでのピーク RSS（Linux の ru_maxrss は KB 単位）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_vae(model, profile):
+    """VAE だけを読み込む（model が None なら同じ構成のランダムな重みで作る）"""
+    if model is None:
+        torch.manual_seed(0)
+        vae = AutoencoderOobleck()
+    else:
+        model_id, revision = model
+        vae = AutoencoderOobleck.from_pretrained(model_id, subfolder='vae', revision=revision, cache_dir="./model_cache")
+    return vae.to(profile['device'], DTYPES[profile['dtype']]).eval()
+
+
+def measure_decode(model, profile, duration, tile_seconds, overlap_seconds, seed):
+    """
+    新しいプロセスで VAE を読み込み、duration 秒分の潜在表現を1回デコードして計測する
+    - ピーク RSS はプロセス全体の最大値なので、条件ごとにプロセスを分けて他の計測の影響を受けないようにする
+    - 戻り値: (読み込み後の RSS, デコード後のピーク RSS, CUDA のピーク割り当て量, 秒数, 音声)
+    """
+    apply_thread_settings(profile)
+    vae = load_vae(model, profile)
+    frames = seconds_to_latent_frames(vae, duration)
+    generator = torch.Generator('cpu').manual_seed(seed)
+    latents = torch.randn((1, vae.config.decoder_input_channels, frames), generator=generator)
+    latents = latents.to(vae.device, vae.dtype)
+    if profile['device'] == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    baseline = peak_rss_bytes()
+
+    with inference_context(profile):
+        start = time.perf_counter()
+        if tile_seconds > 0:
+            tile = seconds_to_latent_frames(vae, tile_seconds)
+            overlap = min(seconds_to_latent_frames(vae, overlap_seconds), tile - 1)
+            audio = tiled_decode(vae, latents, tile, overlap)
+        else:
+            audio = vae.decode(latents).sample
+        if profile['device'] == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+
+    cuda_peak = torch.cuda.max_memory_allocated() if profile['device'] == 'cuda' else 0
+    return baseline, peak_rss_bytes(), cuda_peak, elapsed, audio[0].float().cpu().numpy()
+
+
+class Command(BaseCommand):
+    help = 'VAE を全体で1回デコードした場合とタイル分割でデコードした場合のピークメモリ・時間・出力の差を比較します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--durations', default='5,10,20,47', help='計測する音声の長さ（秒、カンマ区切り）')
+        parser.add_argument('--tile', type=float, default=None,
+                            help='タイルの長さ（秒、省略時は AUDIO_VAE_TILE_SECONDS、0 なら 10）')
+        parser.add_argument('--overlap', type=float, default=None,
+                            help='タイルの重なり（秒、省略時は AUDIO_VAE_TILE_OVERLAP_SECONDS）')
+        parser.add_argument('--profile', default=None, help='実行プロファイル（省略時は AUDIO_EXECUTION_PROFILE）')
+        parser.add_argument('--seed', type=int, default=0, help='潜在表現のシード値（両方のデコードで共通）')
+        parser.add_argument('--random-weights', action='store_true',
+                            help='モデルをダウンロードせず、同じ構成のランダムな重みでメモリと時間だけを計測する')
+
+    def handle(self, *args, **options):
+        durations = [float(value) for value in options['durations'].split(',')]
+        tile_seconds = options['tile'] if options['tile'] is not None else (settings.AUDIO_VAE_TILE_SECONDS or 10.0)
+        overlap_seconds = options['overlap'] if options['overlap'] is not None else settings.AUDIO_VAE_TILE_OVERLAP_SECONDS
+        profile = resolve_execution_profile(options['profile'])
+        model = None if options['random_weights'] else (settings.AUDIO_MODEL_ID, settings.AUDIO_MODEL_REVISION)
+        memory_label = 'CUDA' if profile['device'] == 'cuda' else 'RSS'
+
+        self.stdout.write(
+            f"{profile['name']} / タイル {tile_seconds}秒・重なり {overlap_seconds}秒 で比較します"
+            f"（条件ごとに新しいプロセスで計測。メモリはピーク{memory_label}、MB）\n"
+        )
+        self.stdout.write(
+            f"{'duration':>9}{'load':>9}{'full':>9}{'tiled':>9}{'saved':>8}"
+            f"{'full(s)':>9}{'tiled(s)':>10}{'SNR(dB)':>9}{'max diff':>10}"
+        )
+
+        # fork ではなく spawn で起動し、親プロセスのメモリ使用量を引き継がないようにする
+        context = multiprocessing.get_context('spawn')
+        for duration in durations:
+            results = []
+            for tile in (0, tile_seconds):
+                with context.Pool(1) as pool:
+                    results.append(pool.apply(
+                        measure_decode, (model, profile, duration, tile, overlap_seconds, options['seed'])
+                    ))
+            (load, full_peak, full_cuda, full_time, full_audio), (_, tiled_peak, tiled_cuda, tiled_time, tiled_audio) = results
+            if profile['device'] == 'cuda':
+                full_peak, tiled_peak, load = full_cuda, tiled_cuda, 0
+
+            length = min(full_audio.shape[-1], tiled_audio.shape[-1])
+            full_audio, tiled_audio = full_audio[..., :length], tiled_audio[..., :length]
+            self.stdout.write(
+                f'{duration:>9.1f}{load / 2**20:>9.0f}{full_peak / 2**20:>9.0f}{tiled_peak / 2**20:>9.0f}'
+                f'{1 - tiled_peak / full_peak:>8.0%}{full_time:>9.2f}{tiled_time:>10.2f}'
+                f'{snr_db(full_audio, tiled_audio):>9.1f}{np.abs(full_audio - tiled_audio).max():>10.4f}'
+            )
@@ -0,0 +1,37 @@
+import io
+import os
+
+import torch
+from django.core.management.base import BaseCommand
+
+from mainapp.audio.pipeline import load_audio_pipeline
+from mainapp.audio.profiles import resolve_execution_profile
+from mainapp.audio.quantization import QUANTIZED_COMPONENTS, quantized_model_path, save_quantized_components
+
+
+def serialized_size(module):
+    """state_dict を保存したときのバイト数（量子化済みの重みも含めたモデルサイズの目安）"""
+    buffer = io.BytesIO()
+    torch.save(module.state_dict(), buffer)
+    return buffer.tell()
+
+
+class Command(BaseCommand):
+    help = 'DiT と T5 エンコーダーを動的 int8 量子化したモデルを作成します（AUDIO_QUANTIZATION=int8-dynamic 用）'
+
+    def handle(self, *args, **options):
+        path = quantized_model_path()
+        self.stdout.write('fp32 のパイプラインを読み込み中...')
+        pipe = load_audio_pipeline(resolve_execution_profile('cpu-fp32'))
+
+        sizes = {name: serialized_size(getattr(pipe, name)) for name in QUANTIZED_COMPONENTS}
+        components = save_quantized_components(pipe, path)
+
+        for name, module in components.items():
+            quantized = serialized_size(module)
+            self.stdout.write(
+                f'{name:<14}{sizes[name] / 1024 ** 2:>10.1f} MiB -> {quantized / 1024 ** 2:>8.1f} MiB'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'量子化モデルを保存しました: {path} ({os.path.getsize(path) / 1024 ** 2:.1f} MiB)'
+        ))
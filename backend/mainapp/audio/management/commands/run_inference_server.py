@@ -0,0 +1,64 @@
+import ipaddress
+import os
+import socket
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mainapp.audio.ipc import parse_address
+from mainapp.audio.pipeline import preload_audio_pipeline
+from mainapp.audio.server import make_inference_server
+
+DEFAULT_ADDRESS = 'unix:///tmp/audio-inference.sock'
+
+
+def is_private_address(address):
+    """unix ソケット、またはループバック・プライベートアドレスで待ち受けるかどうか（0.0.0.0 などは False）"""
+    family, sockaddr = parse_address(address)
+    if family == socket.AF_UNIX:
+        return True
+    try:
+        host = ipaddress.ip_address(sockaddr[0])
+    except ValueError:
+        # ホスト名（localhost など）は解決せず、ループバックかどうかだけを見る
+        return sockaddr[0] == 'localhost'
+    return host.is_loopback or (host.is_private and not host.is_unspecified)
+
+
+class Command(BaseCommand):
+    help = '音声生成モデルとリクエストキューを持つ推論サーバーを起動します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--address',
+            default=settings.AUDIO_INFERENCE_SERVER or DEFAULT_ADDRESS,
+            help='待ち受けるアドレス（unix:///path/to.sock または tcp://host:port。認証がないため tcp は localhost かプライベートネットワークのみ）',
+        )
+        parser.add_argument('--no-warmup', action='store_true', help='起動時のウォームアップ生成を省略する')
+
+    def handle(self, *args, **options):
+        address = options['address']
+
+        # 接続を受け付ける前にモデルを読み込み、最初のリクエストから定常状態の速度で生成する
+        preload_audio_pipeline(warmup=not options['no_warmup'])
+
+        server = make_inference_server(address)
+        if address.startswith('unix://'):
+            os.chmod(server.server_address, 0o660)
+
+        self.stdout.write(self.style.SUCCESS(f'推論サーバーを起動しました: {address}'))
+        if not is_private_address(address):
+            self.stdout.write(self.style.WARNING(
+                '推論サーバーは認証を行いません。tcp:// はファイアウォールなどで外部から接続できないようにしてください'
+            ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if address.startswith('unix://'):
+                try:
+                    os.unlink(server.server_address)
+                except FileNotFoundError:
+                    pass
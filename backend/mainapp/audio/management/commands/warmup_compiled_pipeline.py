@@ -0,0 +1,47 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.audio.batching import BatchItem
+from mainapp.audio.compilation import batch_buckets
+from mainapp.audio.pipeline import _run_batch, get_audio_pipeline
+
+
+class Command(BaseCommand):
+    help = 'torch.compile モードのパイプラインを全バッチサイズのバケットについて事前にコンパイルします'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', type=int, default=2, help='コンパイル用の生成ステップ数')
+
+    def handle(self, *args, **options):
+        if not settings.AUDIO_COMPILE:
+            raise CommandError('AUDIO_COMPILE=True を設定してから実行してください。')
+
+        get_audio_pipeline()
+
+        # CFG の打ち切りがあるティアでは、後半ステップで DiT のバッチが半分になるため、その形状もコンパイルする
+        # （打ち切り後のステップが必ず含まれるステップ数で実行する）
+        runs = [(None, options['steps'])]
+        truncated = {
+            name: tier['guidance_cutoff'] for name, tier in settings.AUDIO_GENERATION_TIERS.items()
+            if tier['guidance_cutoff'] < 1.0
+        }
+        if truncated:
+            tier = min(truncated, key=truncated.get)
+            runs.append((tier, max(options['steps'], math.ceil(1 / (1 - truncated[tier])) + 1)))
+
+        for bucket in batch_buckets():
+            for tier, steps in runs:
+                key = (steps, 1.0, tier, None)
+                items = [BatchItem(key, 'warmup', 'Low quality.', seed) for seed in range(bucket)]
+                start = time.perf_counter()
+                _run_batch(key, items)
+                self.stdout.write(
+                    f'batch={bucket} tier={tier or "-"}: {time.perf_counter() - start:.1f}秒'
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'コンパイル結果を保存しました: {settings.AUDIO_COMPILE_CACHE_DIR}'
+        ))
@@ -0,0 +1,130 @@
+import asyncio
+import select
+import socket
+import ssl
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .batching import CancellationToken
+
+# WSGI でクライアントの切断を確認する間隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class SocketCancellationToken(CancellationToken):
+    """
+    WSGI（gunicorn）でクライアントのソケットを監視し、切断されたらキャンセルされるトークン
+    - 監視はトークンが最初に確認されたとき（生成が始まったとき）に始める。ビューがリクエスト本文を
+      読み終えた後なので、本文のデータを次のリクエストと取り違えない
+    - 監視スレッドはソケットを読み取らず（MSG_PEEK）、次のリクエストのデータが届くか stop() されたら終わる
+    """
+
+    def __init__(self, sock):
+        super().__init__()
+        self._sock = sock
+        self._done = threading.Event()
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_cancelled(self):
+        if self._watcher is None:
+            with self._lock:
+                if self._watcher is None and not self._done.is_set():
+                    self._watcher = threading.Thread(target=self._watch, daemon=True)
+                    self._watcher.start()
+        return super().is_cancelled
+
+    def stop(self):
+        """監視を終える（レスポンスを返し終えた後に呼ぶ）"""
+        self._done.set()
+
+    def _watch(self):
+        while not self._done.is_set():
+            try:
+                readable, _, _ = select.select([self._sock], [], [], DISCONNECT_POLL_INTERVAL)
+                if not readable:
+                    continue
+                closed = self._sock.recv(1, socket.MSG_PEEK) == b''
+            except (OSError, ValueError):
+                closed = True
+            if closed:
+                self.cancel()
+            return
+
+
+class ClosingStream:
+    """
+    ストリーミングの本文を包み、レスポンスが閉じられたときに on_close を呼ぶ
+    - Django は本文の close() をレスポンスの終了時（送り終えたとき・切断されたとき）に呼ぶ。
+      ジェネレーターの finally と違い、本文を読み始める前に閉じられた場合も呼ばれる
+    """
+
+    def __init__(self, content, on_close):
+        self._content = content
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._content)
+
+    def close(self):
+        self._on_close()
+
+
+def client_socket(request):
+    """gunicorn が WSGI environ に設定するクライアントのソケット（TLS 終端している場合や他のサーバーでは None）"""
+    sock = request.META.get('gunicorn.socket')
+    if sock is None or isinstance(sock, ssl.SSLSocket):
+        return None
+    return sock
+
+
+class GenerationCancellationMiddleware:
+    """
+    リクエストごとに生成のキャンセルトークンを request.generation_cancel_token に設定するミドルウェア
+    - ASGI で動かしている場合、クライアントが切断すると Django がレスポンスの処理を
+      キャンセルするので、それを受けてトークンをキャンセルする（ビューのスレッドは止まらないため、
+      生成側がトークンを見て打ち切る）
+    - WSGI（gunicorn）では、生成中にクライアントのソケットを監視して切断を検知する（SocketCancellationToken）
+    - ソケットを取得できない WSGI サーバー（runserver など）では、トークンがキャンセルされることはない
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        sock = client_socket(request)
+        if sock is None:
+            request.generation_cancel_token = CancellationToken()
+            return self.get_response(request)
+
+        cancel_token = SocketCancellationToken(sock)
+        request.generation_cancel_token = cancel_token
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            cancel_token.stop()
+            raise
+        if response.streaming and not response.is_async:
+            # 長尺生成などはストリーミング中も生成を続けるため、レスポンスを閉じるまで監視する
+            response.streaming_content = ClosingStream(response.streaming_content, cancel_token.stop)
+        else:
+            cancel_token.stop()
+        return response
+
+    async def __acall__(self, request):
+        cancel_token = CancellationToken()
+        request.generation_cancel_token = cancel_token
+        try:
+            return await self.get_response(request)
+        except asyncio.CancelledError:
+            cancel_token.cancel()
+            raise
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 15:46
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('prompt', models.TextField(verbose_name='プロンプト')),
+                ('neg_prompt', models.TextField(blank=True, default='Low quality.', verbose_name='ネガティブプロンプト')),
+                ('duration', models.FloatField(default=5.0, verbose_name='音声長（秒）')),
+                ('steps', models.IntegerField(default=100, verbose_name='ステップ数')),
+                ('seed', models.BigIntegerField(verbose_name='シード値')),
+                ('status', models.CharField(choices=[('pending', '待機中'), ('running', '生成中'), ('succeeded', '完了'), ('failed', '失敗')], default='pending', max_length=20, verbose_name='ステータス')),
+                ('error', models.TextField(blank=True, default='', verbose_name='エラー内容')),
+                ('result_file', models.FileField(blank=True, null=True, upload_to='audio/jobs/', verbose_name='生成結果')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完了日時')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to=settings.AUTH_USER_MODEL, verbose_name='ユーザー')),
+            ],
+            options={
+                'verbose_name': '音声生成ジョブ',
+                'verbose_name_plural': '音声生成ジョブ',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'status'], name='audio_job_user_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 15:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='output_format',
+            field=models.CharField(default='wav', max_length=10, verbose_name='出力フォーマット'),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='quality',
+            field=models.CharField(default='standard', max_length=20, verbose_name='音声品質'),
+        ),
+    ]
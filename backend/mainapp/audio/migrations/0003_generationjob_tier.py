@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0002_generationjob_output_format_generationjob_quality'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='tier',
+            field=models.CharField(blank=True, default='', max_length=20, verbose_name='生成ティア'),
+        ),
+    ]
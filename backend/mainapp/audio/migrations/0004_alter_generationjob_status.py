@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0003_generationjob_tier'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='generationjob',
+            name='status',
+            field=models.CharField(choices=[('pending', '待機中'), ('running', '生成中'), ('succeeded', '完了'), ('failed', '失敗'), ('cancelled', 'キャンセル')], default='pending', max_length=20, verbose_name='ステータス'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0004_alter_generationjob_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='plan',
+            field=models.CharField(blank=True, default='', max_length=50, verbose_name='プラン'),
+        ),
+    ]
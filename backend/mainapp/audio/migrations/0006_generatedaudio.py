@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 16:31
+
+import django.db.models.deletion
+import mainapp.audio.models
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0005_generationjob_plan'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneratedAudio',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('prompt', models.TextField(verbose_name='プロンプト')),
+                ('neg_prompt', models.TextField(blank=True, default='', verbose_name='ネガティブプロンプト')),
+                ('duration', models.FloatField(verbose_name='音声長（秒）')),
+                ('steps', models.IntegerField(verbose_name='ステップ数')),
+                ('seed', models.BigIntegerField(verbose_name='シード値')),
+                ('output_format', models.CharField(default='wav', max_length=10, verbose_name='出力フォーマット')),
+                ('quality', models.CharField(default='standard', max_length=20, verbose_name='音声品質')),
+                ('tier', models.CharField(blank=True, default='', max_length=20, verbose_name='生成ティア')),
+                ('file', models.FileField(storage=mainapp.audio.models.get_audio_storage, upload_to=mainapp.audio.models.generated_audio_upload_to, verbose_name='音声ファイル')),
+                ('size', models.PositiveBigIntegerField(default=0, verbose_name='ファイルサイズ（バイト）')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generated_audios', to=settings.AUTH_USER_MODEL, verbose_name='ユーザー')),
+            ],
+            options={
+                'verbose_name': '生成音声',
+                'verbose_name_plural': '生成音声',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at'], name='audio_library_user_created_idx')],
+            },
+        ),
+    ]
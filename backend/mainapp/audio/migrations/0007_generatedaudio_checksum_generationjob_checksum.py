@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0006_generatedaudio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedaudio',
+            name='checksum',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='チェックサム'),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='checksum',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='チェックサム'),
+        ),
+    ]
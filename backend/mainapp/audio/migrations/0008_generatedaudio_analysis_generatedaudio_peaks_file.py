@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-18 16:39
+
+import mainapp.audio.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0007_generatedaudio_checksum_generationjob_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedaudio',
+            name='analysis',
+            field=models.JSONField(blank=True, default=dict, verbose_name='解析結果'),
+        ),
+        migrations.AddField(
+            model_name='generatedaudio',
+            name='peaks_file',
+            field=models.FileField(blank=True, storage=mainapp.audio.models.get_audio_storage, upload_to=mainapp.audio.models.generated_audio_upload_to, verbose_name='波形ピーク'),
+        ),
+    ]
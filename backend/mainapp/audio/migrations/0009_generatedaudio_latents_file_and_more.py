@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 17:03
+
+import django.db.models.deletion
+import mainapp.audio.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0008_generatedaudio_analysis_generatedaudio_peaks_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedaudio',
+            name='latents_file',
+            field=models.FileField(blank=True, storage=mainapp.audio.models.get_audio_storage, upload_to=mainapp.audio.models.generated_audio_upload_to, verbose_name='潜在表現'),
+        ),
+        migrations.AddField(
+            model_name='generatedaudio',
+            name='refined_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refinements', to='audio.generatedaudio', verbose_name='リファイン元'),
+        ),
+        migrations.AddField(
+            model_name='generatedaudio',
+            name='sampling',
+            field=models.JSONField(blank=True, default=dict, verbose_name='サンプリング設定'),
+        ),
+    ]
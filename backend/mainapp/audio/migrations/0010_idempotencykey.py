@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 17:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0009_generatedaudio_latents_file_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, verbose_name='キー')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='リクエストのハッシュ')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('audio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='audio.generatedaudio', verbose_name='生成音声')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to=settings.AUTH_USER_MODEL, verbose_name='ユーザー')),
+            ],
+            options={
+                'verbose_name': '冪等キー',
+                'verbose_name_plural': '冪等キー',
+                'unique_together': {('user', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio', '0010_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='seeded',
+            field=models.BooleanField(default=True, verbose_name='シード値指定'),
+        ),
+    ]
@@ -1,3 +1,203 @@
+import uuid
+from django.core.files.storage import storages
 from django.db import models
 
-# Create your models here.
+
+class GenerationJob(models.Model):
+    """
+    非同期音声生成ジョブモデル
+    - APIでジョブを受け付けた時点で作成し、Celeryワーカーが生成を実行する。
+    - 生成結果の音声ファイルは MEDIA_ROOT 配下に保存する。
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '待機中'),
+        (STATUS_RUNNING, '生成中'),
+        (STATUS_SUCCEEDED, '完了'),
+        (STATUS_FAILED, '失敗'),
+        (STATUS_CANCELLED, 'キャンセル'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    user = models.ForeignKey(
+        'users.User',
+        on_delete=models.CASCADE,
+        related_name='generation_jobs',
+        verbose_name="ユーザー"
+    )
+
+    # 生成パラメータ
+    prompt = models.TextField(verbose_name="プロンプト")
+    neg_prompt = models.TextField(blank=True, default='Low quality.', verbose_name="ネガティブプロンプト")
+    duration = models.FloatField(default=5.0, verbose_name="音声長（秒）")
+    steps = models.IntegerField(default=100, verbose_name="ステップ数")
+    seed = models.BigIntegerField(verbose_name="シード値")
+    # シード値をリクエストで指定したかどうか（指定したジョブだけ結果キャッシュを使う）
+    seeded = models.BooleanField(default=True, verbose_name="シード値指定")
+    output_format = models.CharField(max_length=10, default='wav', verbose_name="出力フォーマット")
+    quality = models.CharField(max_length=20, default='standard', verbose_name="音声品質")
+    tier = models.CharField(max_length=20, blank=True, default='', verbose_name="生成ティア")
+    # 待ち時間をプランごとに集計するため、登録時点のプランを記録する
+    plan = models.CharField(max_length=50, blank=True, default='', verbose_name="プラン")
+
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        verbose_name="ステータス"
+    )
+
+    error = models.TextField(blank=True, default='', verbose_name="エラー内容")
+
+    result_file = models.FileField(
+        upload_to='audio/jobs/',
+        blank=True,
+        null=True,
+        verbose_name="生成結果"
+    )
+    # 生成結果の SHA-256（ダウンロード時の ETag に使う）
+    checksum = models.CharField(max_length=64, blank=True, default='', verbose_name="チェックサム")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name="開始日時")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="完了日時")
+
+    class Meta:
+        verbose_name = '音声生成ジョブ'
+        verbose_name_plural = '音声生成ジョブ'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'status'], name='audio_job_user_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.prompt[:30]} ({self.status})"
+
+    @property
+    def is_finished(self):
+        """生成が終了（成功・失敗・キャンセル）しているかどうか"""
+        return self.status in (self.STATUS_SUCCEEDED, self.STATUS_FAILED, self.STATUS_CANCELLED)
+
+
+def get_audio_storage():
+    """生成した音声ライブラリの保存先（settings.STORAGES['audio']。S3 などに差し替えられる）"""
+    return storages['audio']
+
+
+def generated_audio_upload_to(instance, filename):
+    """ユーザーごとのディレクトリに保存する"""
+    return f"audio/library/{instance.user_id}/{filename}"
+
+
+class GeneratedAudio(models.Model):
+    """
+    生成した音声のライブラリ
+    - 生成した音声をファイルとして保存し、同じ音声を再生成せずに何度でもダウンロードできるようにする
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    user = models.ForeignKey(
+        'users.User',
+        on_delete=models.CASCADE,
+        related_name='generated_audios',
+        verbose_name="ユーザー"
+    )
+
+    # 生成パラメータ
+    prompt = models.TextField(verbose_name="プロンプト")
+    neg_prompt = models.TextField(blank=True, default='', verbose_name="ネガティブプロンプト")
+    duration = models.FloatField(verbose_name="音声長（秒）")
+    steps = models.IntegerField(verbose_name="ステップ数")
+    seed = models.BigIntegerField(verbose_name="シード値")
+    output_format = models.CharField(max_length=10, default='wav', verbose_name="出力フォーマット")
+    quality = models.CharField(max_length=20, default='standard', verbose_name="音声品質")
+    tier = models.CharField(max_length=20, blank=True, default='', verbose_name="生成ティア")
+
+    file = models.FileField(
+        upload_to=generated_audio_upload_to,
+        storage=get_audio_storage,
+        verbose_name="音声ファイル"
+    )
+    size = models.PositiveBigIntegerField(default=0, verbose_name="ファイルサイズ（バイト）")
+    checksum = models.CharField(max_length=64, blank=True, default='', verbose_name="チェックサム")
+
+    # 生成後の解析結果（ラウドネス・無音区間・波形ピークの配置）と、波形ピークのバイナリ（float16）
+    analysis = models.JSONField(blank=True, default=dict, verbose_name="解析結果")
+    peaks_file = models.FileField(
+        upload_to=generated_audio_upload_to,
+        storage=get_audio_storage,
+        blank=True,
+        verbose_name="波形ピーク"
+    )
+
+    # 最終的な潜在表現（float16 の .npy）とサンプリングの設定（スケジューラー・ステップ数・リファインの強さ）
+    # - 潜在表現から再サンプリングせずに別のフォーマットへデコードし直したり、下書きからリファインしたりできる
+    latents_file = models.FileField(
+        upload_to=generated_audio_upload_to,
+        storage=get_audio_storage,
+        blank=True,
+        verbose_name="潜在表現"
+    )
+    sampling = models.JSONField(blank=True, default=dict, verbose_name="サンプリング設定")
+    refined_from = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='refinements',
+        verbose_name="リファイン元"
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = '生成音声'
+        verbose_name_plural = '生成音声'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='audio_library_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.prompt[:30]} ({self.seed})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Idempotency-Key ヘッダー付きで受け付けた生成リクエストの記録
+    - 同じキーで再送されたリクエストには、生成も使用量の消費もせずに最初の結果（ライブラリの音声）を返す
+    - audio が空のものは処理中（処理に失敗した場合は削除して、同じキーで再試行できるようにする）
+    - created_at は処理中の記録を引き継いだときに更新する（引き継ぎ前のリクエストの結果で上書きしないため）
+    """
+    user = models.ForeignKey(
+        'users.User',
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys',
+        verbose_name="ユーザー"
+    )
+    key = models.CharField(max_length=255, verbose_name="キー")
+    # 最初のリクエストのパスと内容のハッシュ（同じキーが別のリクエストに使われていないかの確認に使う）
+    fingerprint = models.CharField(max_length=64, verbose_name="リクエストのハッシュ")
+    audio = models.ForeignKey(
+        GeneratedAudio,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="生成音声"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = '冪等キー'
+        verbose_name_plural = '冪等キー'
+        unique_together = ['user', 'key']
+
+    def __str__(self):
+        return f"{self.user.email} - {self.key}"
@@ -0,0 +1,369 @@
+import threading
+import time
+
+import numpy as np
+import torch
+from diffusers import StableAudioPipeline
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .admission import DECODE_COST, get_admission_controller, inference_cost
+from .batching import BatchItem, GenerationCancelled, MicroBatchScheduler
+from .compilation import bucket_batch_size, compile_pipeline
+from .decoding import tiled_decoding
+from .embeddings import encode_texts, get_embedding_cache
+from .ipc import get_inference_client
+from .profiles import (
+    DTYPES,
+    apply_thread_settings,
+    describe_profile,
+    get_execution_profile,
+    inference_context,
+)
+from .quantization import get_quantization_mode, load_quantized_components
+from .sampling import get_tier, refine_latents, refine_start_step, sampling_options
+
+def load_audio_pipeline(profile, quantization='none'):
+    """
+    実行プロファイル・量子化モードに従ってパイプラインを読み込む（キャッシュしない）
+    """
+    dtype = DTYPES[profile['dtype']]
+    components = {}
+    if quantization != 'none':
+        if profile['device'] != 'cpu':
+            raise ImproperlyConfigured("AUDIO_QUANTIZATION is only supported with CPU execution profiles")
+        # 動的量子化した Linear 層は fp32 の入力を受け取るため、残りのコンポーネントも fp32 で動かす
+        dtype = torch.float32
+        components = load_quantized_components()
+
+    pipe = StableAudioPipeline.from_pretrained(
+        settings.AUDIO_MODEL_ID,
+        revision=settings.AUDIO_MODEL_REVISION,
+        torch_dtype=dtype,
+        cache_dir="./model_cache",  # モデルをローカルにキャッシュ
+        **components
+    )
+    pipe = pipe.to(profile['device'])
+    if settings.AUDIO_COMPILE:
+        pipe = compile_pipeline(pipe)
+    return pipe
+
+# グローバルでモデルを一度だけ初期化（キャッシュして使い回し）
+_pipe = None
+
+def get_audio_pipeline():
+    """モデルを一度だけ初期化してキャッシュする"""
+    global _pipe
+    if _pipe is None:
+        # デバイス・dtype・スレッド数は実行プロファイルで決める（CPU では fp16 が遅いため）
+        profile = get_execution_profile()
+        quantization = get_quantization_mode()
+        apply_thread_settings(profile)
+        print(
+            f"Initializing StableAudioPipeline ({describe_profile(profile)} "
+            f"quantization={quantization} compile={settings.AUDIO_COMPILE})..."
+        )
+        _pipe = load_audio_pipeline(profile, quantization)
+        print("StableAudioPipeline initialized successfully!")
+    return _pipe
+
+# パイプラインを使う処理（バッチの生成と、保存済みの潜在表現のデコード）を直列化する
+_pipeline_lock = threading.Lock()
+
+def _run_batch(key, items):
+    """
+    同じステップ数・音声長・ティア・リファインの強さのリクエストをまとめて1回のパイプライン呼び出しで生成する
+    - シード値はアイテムごとの Generator で指定するため、単独で生成した場合と同じ結果になる
+    - ティアが指定されていれば、そのスケジューラーと CFG の打ち切り位置で生成する
+    - strength が指定されていれば、各アイテムの下書きの潜在表現から最後の strength の割合のステップだけを実行する
+    - AUDIO_VAE_TILE_SECONDS が設定されていれば、VAE はタイルに分けてデコードする
+    - 戻り値はアイテムごとの (音声 numpy[samples, channels], 最終的な潜在表現 numpy[channels, frames])
+    """
+    steps, duration, tier, strength = key
+    tier_options = get_tier(tier) or {}
+    pipe = get_audio_pipeline()
+
+    # コンパイルモードではバッチサイズをバケットに切り上げ、形状ごとの再コンパイルを防ぐ
+    # （埋めたアイテムの結果は捨てる。アイテムごとの Generator なので他の結果には影響しない）
+    num_items = len(items)
+    if settings.AUDIO_COMPILE:
+        items = items + [items[-1]] * (bucket_batch_size(num_items) - num_items)
+    generators = [torch.Generator(pipe.device).manual_seed(item.seed) for item in items]
+
+    with _pipeline_lock, inference_context(get_execution_profile()):
+        # テキストエンコーダーの出力はキャッシュから取り出し、埋め込みとしてパイプラインに渡す
+        embedding_cache = get_embedding_cache()
+        model_key = (settings.AUDIO_MODEL_ID, settings.AUDIO_MODEL_REVISION)
+        prompt_embeds, attention_mask = encode_texts(
+            pipe, [item.prompt for item in items], embedding_cache, model_key
+        )
+        negative_prompt_embeds, negative_attention_mask = encode_texts(
+            pipe, [item.neg_prompt for item in items], embedding_cache, model_key, negative=True
+        )
+
+        with sampling_options(
+            pipe,
+            steps,
+            scheduler=tier_options.get('scheduler', 'default'),
+            guidance_cutoff=tier_options.get('guidance_cutoff', 1.0),
+            strength=strength,
+        ):
+            init_latents = None
+            if strength is not None:
+                init_latents = refine_latents(
+                    pipe,
+                    steps,
+                    torch.from_numpy(np.stack([item.init_latents for item in items])).to(pipe.device, prompt_embeds.dtype),
+                    generators,
+                )
+            # 潜在表現のまま受け取り、保存用に残してから波形にデコードする
+            latents = pipe(
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                attention_mask=attention_mask,
+                negative_attention_mask=negative_attention_mask,
+                num_inference_steps=steps,
+                audio_end_in_s=duration,
+                num_waveforms_per_prompt=1,
+                generator=generators,
+                latents=init_latents,
+                callback=_step_callback(items[:num_items], steps - refine_start_step(steps, strength)),
+                callback_steps=1,
+                output_type='latent',
+            ).audios
+        audios = _decode_latents(pipe, latents, duration).float().cpu()
+    latents = latents.float().cpu()
+    return [(audios[i].T.numpy(), latents[i].numpy()) for i in range(num_items)]
+
+def _decode_latents(pipe, latents, duration):
+    """潜在表現 [batch, channels, frames] を波形にデコードし、音声長で切り出す（パイプラインの後処理と同じ）"""
+    with tiled_decoding(
+        pipe.vae,
+        duration,
+        settings.AUDIO_VAE_TILE_SECONDS,
+        settings.AUDIO_VAE_TILE_OVERLAP_SECONDS,
+        fixed_shape=settings.AUDIO_COMPILE,
+    ):
+        audio = pipe.vae.decode(latents).sample
+    return audio[:, :, :int(duration * pipe.vae.sampling_rate)]
+
+def _step_callback(items, steps):
+    """
+    ステップごとに呼ばれるコールバック
+    - バッチ内の全リクエストがキャンセルされていれば生成を打ち切る
+      （一部だけがキャンセルされた場合は、残りのリクエストのために最後まで生成する）
+    - 各リクエストの on_progress に進捗と、ここまでの1ステップあたりの時間から見積もった残り秒数を渡す
+    """
+    started_at = time.monotonic()
+
+    def callback(step, timestep, latents):
+        if all(item.is_cancelled for item in items):
+            raise GenerationCancelled()
+        done = step + 1
+        eta = (time.monotonic() - started_at) / done * (steps - done)
+        for item in items:
+            if item.on_progress is not None and not item.is_cancelled:
+                item.on_progress(done, steps, eta)
+    return callback
+
+def preload_audio_pipeline(warmup=True):
+    """
+    パイプラインを読み込み、短いダミー生成でウォームアップする
+    - gunicorn のマスタープロセスで fork 前に呼ぶと、読み取り専用の重みを全ワーカーで共有できる
+    - ウォームアップはスケジューラーのスレッドを使わずに呼び出し元のスレッドで実行する
+      （スレッドは fork 先に引き継がれないため）
+    """
+    pipe = get_audio_pipeline()
+    if warmup:
+        print("Warming up StableAudioPipeline...")
+        item = BatchItem((2, 1.0, None, None), "warmup", "Low quality.", 0)
+        _run_batch(item.key, [item])
+        print("StableAudioPipeline warmed up.")
+    return pipe
+
+_scheduler = None
+
+def get_batch_scheduler():
+    """マイクロバッチスケジューラーを一度だけ初期化して返す"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = MicroBatchScheduler(
+            _run_batch,
+            window_ms=settings.AUDIO_BATCH_WINDOW_MS,
+            max_batch_size=settings.AUDIO_BATCH_MAX_SIZE,
+        )
+    return _scheduler
+
+def generate_audio(prompt, neg_prompt, steps, duration, seed, tier=None, cancel_token=None, on_progress=None,
+                   requester=None, init_latents=None, strength=None, return_latents=False):
+    """
+    音声を1本生成して (numpy配列[samples, channels], サンプリングレート) を返す
+    - AUDIO_INFERENCE_SERVER が設定されていれば推論サーバーに依頼し、このプロセスではモデルを読み込まない
+    - cancel_token がキャンセルされると、次のステップの終わりで生成を打ち切り GenerationCancelled を送出する
+    - on_progress(step, total_steps, eta) はステップごとに呼ばれる
+    - requester（admission.make_requester）は混雑時の順番とユーザーごとの同時実行数の制限に使う
+    - init_latents（下書きの潜在表現 numpy[channels, frames]）と strength を指定すると、
+      ノイズからではなく下書きから、スケジュールの最後の strength の割合だけを実行する（リファイン）
+    - return_latents=True なら (音声, サンプリングレート, 最終的な潜在表現 numpy[channels, frames]) を返す
+    """
+    client = get_inference_client()
+    generate = client.generate if client is not None else generate_audio_local
+    audio_np, sampling_rate, latents = generate(
+        prompt, neg_prompt, steps, duration, seed, tier,
+        cancel_token=cancel_token, on_progress=on_progress, requester=requester,
+        init_latents=init_latents, strength=strength,
+    )
+    if return_latents:
+        return audio_np, sampling_rate, latents
+    return audio_np, sampling_rate
+
+def generate_audio_local(prompt, neg_prompt, steps, duration, seed, tier=None, cancel_token=None, on_progress=None,
+                         requester=None, init_latents=None, strength=None):
+    """
+    このプロセスのパイプラインで音声を1本生成して (音声, サンプリングレート, 潜在表現) を返す
+    - 実行中の推論コストが上限に達していれば枠が空くまで待つ（待ち行列も満杯なら AdmissionRejected）
+    - 同時に届いたリクエストはスケジューラーでまとめてバッチ実行される
+    """
+    if init_latents is None:
+        strength = None
+    admission = get_admission_controller()
+    cost = inference_cost(steps, tier, strength)
+    admission.acquire(cost, cancel_token, requester)
+    try:
+        future = get_batch_scheduler().submit(
+            (steps, duration, tier, strength), prompt, neg_prompt, seed, cancel_token, on_progress, init_latents
+        )
+        audio_np, latents = future.result()
+    finally:
+        admission.release(cost, requester)
+    return audio_np, get_audio_pipeline().vae.sampling_rate, latents
+
+def generate_audio_batch(items, cancel_token=None, requester=None, return_latents=False):
+    """
+    複数の音声をまとめて生成して ([numpy配列[samples, channels], ...], サンプリングレート) を返す
+    - items は prompt / neg_prompt / steps / duration / seed / tier の dict のリスト（結果も同じ順序）
+    - return_latents=True なら (音声のリスト, サンプリングレート, 潜在表現のリスト) を返す
+    """
+    client = get_inference_client()
+    generate_batch = client.generate_batch if client is not None else generate_audio_batch_local
+    audios, sampling_rate, latents = generate_batch(items, cancel_token=cancel_token, requester=requester)
+    if return_latents:
+        return audios, sampling_rate, latents
+    return audios, sampling_rate
+
+def generate_audio_batch_local(items, cancel_token=None, requester=None):
+    """
+    このプロセスのパイプラインで複数の音声をまとめて生成して (音声のリスト, サンプリングレート, 潜在表現のリスト) を返す
+    - 同じステップ数・音声長・ティアの指定を AUDIO_BATCH_MAX_SIZE 件ずつのチャンクに分け、
+      チャンクごとに推論の枠を確保してスケジューラーに投入する（1チャンクが1回のパイプライン呼び出しになる）
+    - 次のチャンクの枠を待つ間も、投入済みのチャンクの生成は進む
+    """
+    admission = get_admission_controller()
+    scheduler = get_batch_scheduler()
+    groups = {}
+    for index, item in enumerate(items):
+        key = (int(item['steps']), float(item['duration']), item.get('tier') or None, None)
+        groups.setdefault(key, []).append(index)
+
+    futures = [None] * len(items)
+    try:
+        for key, indices in groups.items():
+            for start in range(0, len(indices), settings.AUDIO_BATCH_MAX_SIZE):
+                chunk = indices[start:start + settings.AUDIO_BATCH_MAX_SIZE]
+                cost = inference_cost(key[0], key[2]) * len(chunk)
+                admission.acquire(cost, cancel_token, requester)
+                chunk_futures = [
+                    scheduler.submit(key, items[i]['prompt'], items[i]['neg_prompt'], int(items[i]['seed']), cancel_token)
+                    for i in chunk
+                ]
+                _release_on_completion(admission, cost, requester, chunk_futures)
+                for i, future in zip(chunk, chunk_futures):
+                    futures[i] = future
+        results = [future.result() for future in futures]
+    except BaseException:
+        # 枠を確保できなかった場合などは、まだ実行されていない分を取り消す
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        raise
+    return [audio_np for audio_np, _ in results], get_audio_pipeline().vae.sampling_rate, [latents for _, latents in results]
+
+def decode_latents(latents, duration, cancel_token=None, requester=None):
+    """
+    保存済みの潜在表現 numpy[channels, frames] を再サンプリングせずに波形にデコードして (音声, サンプリングレート) を返す
+    - AUDIO_INFERENCE_SERVER が設定されていれば推論サーバーでデコードする
+    - 生成と同じアドミッション制御を通す（cancel_token / requester の扱いも generate_audio と同じ）
+    """
+    client = get_inference_client()
+    decode = client.decode if client is not None else decode_latents_local
+    return decode(latents, duration, cancel_token=cancel_token, requester=requester)
+
+def decode_latents_local(latents, duration, cancel_token=None, requester=None):
+    """
+    このプロセスの VAE で潜在表現をデコードする（実行中のバッチの生成とは直列に実行する）
+    - 推論の枠（DECODE_COST）を確保してから実行する（待ち行列が満杯なら AdmissionRejected）
+    """
+    admission = get_admission_controller()
+    admission.acquire(DECODE_COST, cancel_token, requester)
+    try:
+        pipe = get_audio_pipeline()
+        with _pipeline_lock, inference_context(get_execution_profile()):
+            latents = torch.from_numpy(np.asarray(latents, dtype=np.float32))[None].to(pipe.device, pipe.vae.dtype)
+            audio = _decode_latents(pipe, latents, duration)
+    finally:
+        admission.release(DECODE_COST, requester)
+    return audio[0].float().cpu().T.numpy(), pipe.vae.sampling_rate
+
+def _release_on_completion(admission, cost, requester, futures):
+    """チャンクの全アイテムが終わった時点で推論の枠を返す"""
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            admission.release(cost, requester)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+# 推論サーバーの実行プロファイルを問い合わせ直す間隔（秒）
+PROFILE_REFRESH_INTERVAL = 60.0
+
+_inference_profile = None
+
+def get_inference_profile():
+    """
+    推論を実行するプロセスの実行プロファイル（name / device / dtype）
+    - 推論サーバーを使っている場合はサーバーに問い合わせ、PROFILE_REFRESH_INTERVAL 秒ごとに問い合わせ直す
+      （Web プロセスと推論サーバーではハードウェアが異なり、'auto' の解決結果も異なるため）
+    """
+    global _inference_profile
+    client = get_inference_client()
+    if client is None:
+        return get_local_inference_profile()
+    if _inference_profile is None or time.monotonic() - _inference_profile[0] > PROFILE_REFRESH_INTERVAL:
+        _inference_profile = (time.monotonic(), client.profile())
+    return _inference_profile[1]
+
+def get_local_inference_profile():
+    """このプロセスの実行プロファイル（name / device / dtype）"""
+    profile = get_execution_profile()
+    return {'name': profile['name'], 'device': profile['device'], 'dtype': profile['dtype']}
+
+def get_inference_stats():
+    """
+    推論側の監視用カウンター（推論サーバーを使っている場合はサーバーから取得する）
+    """
+    client = get_inference_client()
+    if client is not None:
+        return client.stats()
+    return get_local_inference_stats()
+
+def get_local_inference_stats():
+    """このプロセスの推論の監視用カウンター"""
+    return {
+        'embedding_cache': get_embedding_cache().stats(),
+        'admission': get_admission_controller().stats(),
+    }
@@ -0,0 +1,104 @@
+import contextlib
+
+import torch
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from torch.nn.attention import SDPBackend, sdpa_kernel
+
+DTYPES = {
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+    'float32': torch.float32,
+}
+
+# attention に指定できる scaled_dot_product_attention のカーネル（'auto' は PyTorch に任せる）
+SDPA_BACKENDS = {
+    'flash': SDPBackend.FLASH_ATTENTION,
+    'efficient': SDPBackend.EFFICIENT_ATTENTION,
+    'math': SDPBackend.MATH,
+}
+
+
+def cpu_supports_bf16():
+    """CPU が bfloat16 の行列演算命令（AVX512-BF16 / AMX）を持っているか"""
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def detect_profile_name():
+    """ハードウェアに合わせたプロファイル名を選ぶ"""
+    if torch.cuda.is_available():
+        return 'cuda-fp16'
+    if cpu_supports_bf16():
+        return 'cpu-bf16'
+    return 'cpu-fp32'
+
+
+def resolve_execution_profile(name=None):
+    """
+    設定のプロファイル名（'auto' ならハードウェアから判定）を解決して、名前付きの dict を返す
+    """
+    name = name or settings.AUDIO_EXECUTION_PROFILE
+    if name == 'auto':
+        name = detect_profile_name()
+
+    profiles = settings.AUDIO_EXECUTION_PROFILES
+    if name not in profiles:
+        raise ImproperlyConfigured(
+            f"Unknown AUDIO_EXECUTION_PROFILE '{name}'. Available: {', '.join(profiles)}"
+        )
+    profile = dict(profiles[name], name=name)
+
+    if profile['dtype'] not in DTYPES:
+        raise ImproperlyConfigured(f"Unsupported dtype '{profile['dtype']}' in execution profile '{name}'")
+    if profile['attention'] != 'auto' and profile['attention'] not in SDPA_BACKENDS:
+        raise ImproperlyConfigured(f"Unsupported attention '{profile['attention']}' in execution profile '{name}'")
+    if profile['device'] == 'cuda' and not torch.cuda.is_available():
+        raise ImproperlyConfigured(f"Execution profile '{name}' requires CUDA, but CUDA is not available")
+    return profile
+
+
+def apply_thread_settings(profile):
+    """プロファイルで指定された PyTorch の演算スレッド数を設定する（None ならデフォルトのまま）"""
+    if profile['intra_op_threads']:
+        torch.set_num_threads(profile['intra_op_threads'])
+    if profile['inter_op_threads']:
+        try:
+            torch.set_num_interop_threads(profile['inter_op_threads'])
+        except RuntimeError:
+            # 並列処理が一度でも走った後は変更できない（既に設定済みの値を使う）
+            pass
+
+
+def describe_profile(profile):
+    """起動ログ用の1行の説明"""
+    return (
+        f"profile={profile['name']} device={profile['device']} dtype={profile['dtype']} "
+        f"intra_op_threads={torch.get_num_threads()} inter_op_threads={torch.get_num_interop_threads()} "
+        f"inference_mode={profile['inference_mode']} attention={profile['attention']}"
+    )
+
+
+def inference_context(profile):
+    """
+    推論を実行するときのコンテキスト
+    - inference_mode: autograd の記録とバージョンカウンターを省略する（no_grad より軽い）
+    - attention: scaled_dot_product_attention のカーネルを固定する
+    """
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode() if profile['inference_mode'] else torch.no_grad())
+    if profile['attention'] in SDPA_BACKENDS:
+        stack.enter_context(sdpa_kernel(SDPA_BACKENDS[profile['attention']]))
+    return stack
+
+
+_profile = None
+
+def get_execution_profile():
+    """実行プロファイルを一度だけ解決して返す"""
+    global _profile
+    if _profile is None:
+        _profile = resolve_execution_profile()
+    return _profile
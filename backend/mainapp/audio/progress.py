@@ -0,0 +1,154 @@
+import asyncio
+import json
+import queue
+import threading
+import weakref
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+# ジョブごとの進捗イベントを流す Redis のチャンネル名と、最新のイベントを保存するキー
+# - 生成側（Celery ワーカー・推論サーバー）が publish し、Web 側は1本の接続でパターン購読する
+PROGRESS_CHANNEL_PREFIX = 'audio:progress:'
+PROGRESS_SNAPSHOT_PREFIX = 'audio:progress-last:'
+
+# 購読者ごとに溜めておくイベント数（遅いクライアントは古い進捗から捨てる）
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+class ProgressPublisher:
+    """
+    ジョブの進捗イベントを Redis に publish する（生成側のプロセスで使う）
+    - publish はステップのコールバック（推論スレッド）から呼ばれるため、キューに積むだけにして
+      Redis への送信は専用スレッドで行う（Redis が遅くても生成は止まらない）
+    - 接続してきたばかりのクライアントにも現在の状態を返せるよう、最新のイベントをキーにも保存する
+    """
+
+    def __init__(self, redis_url, snapshot_ttl=3600):
+        self.redis_url = redis_url
+        self.snapshot_ttl = snapshot_ttl
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, job_id, event):
+        self._ensure_worker()
+        self._queue.put((str(job_id), event))
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='audio-progress-publisher', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        client = redis.Redis.from_url(self.redis_url)
+        while True:
+            job_id, event = self._queue.get()
+            message = json.dumps(event)
+            try:
+                with client.pipeline(transaction=False) as pipe:
+                    pipe.set(PROGRESS_SNAPSHOT_PREFIX + job_id, message, ex=self.snapshot_ttl)
+                    pipe.publish(PROGRESS_CHANNEL_PREFIX + job_id, message)
+                    pipe.execute()
+            except redis.RedisError as e:
+                # 進捗は補助的な情報なので、送れなくても生成は続ける
+                print(f"[ProgressWarning] Failed to publish progress for job {job_id}: {e}")
+
+
+class ProgressEventBus:
+    """
+    Redis の進捗チャンネルを1本の接続でパターン購読し、同じプロセス内の購読者
+    （SSE のストリーム）にジョブごとに振り分けるイベントバス
+    - ストリームが何本あっても Redis への購読は1つで、各ストリームは asyncio.Queue を待つだけ
+    - 購読者がいなくなったら購読を止める
+    """
+
+    def __init__(self, redis_url):
+        self.redis_url = redis_url
+        self._client = aioredis.Redis.from_url(redis_url)
+        self._subscribers = {}
+        self._task = None
+        self._ready = None
+
+    async def subscribe(self, job_id):
+        """ジョブのイベントを受け取る Queue を返す（Redis の購読が始まるまで待つ）"""
+        subscriber = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(str(job_id), set()).add(subscriber)
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            # Redis に接続できなくても、ストリーム側の DB の確認で完了は通知できる
+            pass
+        return subscriber
+
+    def unsubscribe(self, job_id, subscriber):
+        subscribers = self._subscribers.get(str(job_id))
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[str(job_id)]
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def latest(self, job_id):
+        """ジョブの最新の進捗イベント（なければ None）"""
+        try:
+            message = await self._client.get(PROGRESS_SNAPSHOT_PREFIX + str(job_id))
+        except redis.RedisError:
+            return None
+        return json.loads(message) if message else None
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self._client.pubsub() as pubsub:
+                    await pubsub.psubscribe(PROGRESS_CHANNEL_PREFIX + '*')
+                    self._ready.set()
+                    async for message in pubsub.listen():
+                        if message['type'] == 'pmessage':
+                            job_id = message['channel'].decode()[len(PROGRESS_CHANNEL_PREFIX):]
+                            self._dispatch(job_id, json.loads(message['data']))
+            except redis.RedisError as e:
+                print(f"[ProgressWarning] Progress subscription failed, retrying: {e}")
+                await asyncio.sleep(1.0)
+
+    def _dispatch(self, job_id, event):
+        for subscriber in self._subscribers.get(job_id, ()):
+            # 進捗は新しいもので置き換わるため、溢れた場合は古いものから捨てる
+            if subscriber.full():
+                subscriber.get_nowait()
+            subscriber.put_nowait(event)
+
+
+_publisher = None
+
+def get_progress_publisher():
+    """進捗の publisher を一度だけ初期化して返す"""
+    global _publisher
+    if _publisher is None:
+        _publisher = ProgressPublisher(settings.AUDIO_PROGRESS_REDIS_URL, settings.AUDIO_PROGRESS_SNAPSHOT_TTL)
+    return _publisher
+
+
+def publish_job_progress(job_id, **event):
+    get_progress_publisher().publish(job_id, event)
+
+
+# イベントループごとのイベントバス
+# - ASGI サーバーではプロセスに1つのループなので1つになる
+# - WSGI（runserver など）では非同期ビューがリクエストごとのループで実行されるため、ループごとに作る
+_buses = weakref.WeakKeyDictionary()
+
+def get_progress_bus():
+    """実行中のイベントループのイベントバスを返す"""
+    loop = asyncio.get_running_loop()
+    bus = _buses.get(loop)
+    if bus is None:
+        bus = _buses[loop] = ProgressEventBus(settings.AUDIO_PROGRESS_REDIS_URL)
+    return bus
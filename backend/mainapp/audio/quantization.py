@@ -0,0 +1,59 @@
+import os
+
+import torch
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# 動的 int8 量子化を適用するコンポーネント
+# - 計算量の大半を占める DiT と T5 エンコーダーの Linear 層だけを対象にする
+# - VAE は畳み込みが中心で、量子化すると音質への影響も大きいため対象外
+QUANTIZED_COMPONENTS = ('transformer', 'text_encoder')
+
+QUANTIZATION_MODES = ('none', 'int8-dynamic')
+
+
+def quantize_module(module):
+    """Linear 層を動的 int8 量子化したモジュールを返す（重みは int8、活性は実行時に量子化）"""
+    module = module.to(device='cpu', dtype=torch.float32).eval()
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantized_model_path(model_id=None, revision=None):
+    """モデル・リビジョンごとの量子化済みコンポーネントの保存先"""
+    model_id = model_id or settings.AUDIO_MODEL_ID
+    revision = revision or settings.AUDIO_MODEL_REVISION
+    name = f"{model_id.strip('/').replace('/', '--')}-{revision}-int8-dynamic.pt"
+    return os.path.join(str(settings.AUDIO_QUANTIZED_MODEL_DIR), name)
+
+
+def save_quantized_components(pipe, path):
+    """パイプラインの対象コンポーネントを量子化して1ファイルに保存する"""
+    components = {name: quantize_module(getattr(pipe, name)) for name in QUANTIZED_COMPONENTS}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(components, tmp_path)
+    os.replace(tmp_path, path)
+    return components
+
+
+def load_quantized_components(path=None):
+    """
+    保存済みの量子化コンポーネントを読み込む
+    - from_pretrained に渡すと、元の fp32 の重みを読み込まずに済む
+    - 自分で作成したファイルだけを読み込む前提（モジュールごと pickle で保存している）
+    """
+    path = path or quantized_model_path()
+    if not os.path.exists(path):
+        raise ImproperlyConfigured(
+            f"Quantized model not found: {path}. Run 'python manage.py build_quantized_model' first."
+        )
+    return torch.load(path, map_location='cpu', weights_only=False)
+
+
+def get_quantization_mode():
+    mode = settings.AUDIO_QUANTIZATION
+    if mode not in QUANTIZATION_MODES:
+        raise ImproperlyConfigured(
+            f"Unknown AUDIO_QUANTIZATION '{mode}'. Available: {', '.join(QUANTIZATION_MODES)}"
+        )
+    return mode
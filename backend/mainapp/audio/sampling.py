@@ -0,0 +1,183 @@
+import contextlib
+import math
+
+import torch
+from diffusers import CosineDPMSolverMultistepScheduler
+from django.conf import settings
+
+# 生成ティア（速い順）
+# - 各ティアのスケジューラー・ステップ数・CFG 打ち切り位置は settings.AUDIO_GENERATION_TIERS で定義する
+GENERATION_TIERS = ['draft', 'standard', 'high']
+
+
+class CosineDPMSolverODEScheduler(CosineDPMSolverMultistepScheduler):
+    """
+    Stable Audio 用の DPM-Solver++(2M) の ODE 版
+    - シグマ列・前処理（コサインのノイズ条件付け）は標準のスケジューラーと同じで、
+      各ステップで加えるブラウン運動のノイズだけを除いている
+    - 確率的なノイズがないため少ないステップ数でも収束し、torchsde のノイズ生成も不要になる
+    """
+
+    def set_timesteps(self, num_inference_steps=None, device=None):
+        super().set_timesteps(num_inference_steps, device=device)
+        # 親クラスの step() はノイズ生成器がなければ作るため、常にゼロを返すものを設定しておく
+        self.noise_sampler = lambda sigma, sigma_next: torch.zeros(())
+
+    def dpm_solver_first_order_update(self, model_output, sample=None, noise=None):
+        sigma_t, sigma_s = self.sigmas[self.step_index + 1], self.sigmas[self.step_index]
+        alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma_t)
+        alpha_s, sigma_s = self._sigma_to_alpha_sigma_t(sigma_s)
+        h = (torch.log(alpha_t) - torch.log(sigma_t)) - (torch.log(alpha_s) - torch.log(sigma_s))
+        return (sigma_t / sigma_s) * sample - (alpha_t * (torch.exp(-h) - 1.0)) * model_output
+
+    def multistep_dpm_solver_second_order_update(self, model_output_list, sample=None, noise=None):
+        sigma_t, sigma_s0, sigma_s1 = (
+            self.sigmas[self.step_index + 1],
+            self.sigmas[self.step_index],
+            self.sigmas[self.step_index - 1],
+        )
+        alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma_t)
+        alpha_s0, sigma_s0 = self._sigma_to_alpha_sigma_t(sigma_s0)
+        alpha_s1, sigma_s1 = self._sigma_to_alpha_sigma_t(sigma_s1)
+
+        lambda_t = torch.log(alpha_t) - torch.log(sigma_t)
+        lambda_s0 = torch.log(alpha_s0) - torch.log(sigma_s0)
+        lambda_s1 = torch.log(alpha_s1) - torch.log(sigma_s1)
+
+        m0, m1 = model_output_list[-1], model_output_list[-2]
+        h, h_0 = lambda_t - lambda_s0, lambda_s0 - lambda_s1
+        D0, D1 = m0, (h / h_0) * (m0 - m1)
+        return (
+            (sigma_t / sigma_s0) * sample
+            - (alpha_t * (torch.exp(-h) - 1.0)) * D0
+            - 0.5 * (alpha_t * (torch.exp(-h) - 1.0)) * D1
+        )
+
+
+# スケジューラー名とクラスの対応（'default' はモデルに同梱の設定をそのまま使う）
+SCHEDULERS = {
+    'default': None,
+    'dpmsolver-sde': CosineDPMSolverMultistepScheduler,
+    'dpmsolver-ode': CosineDPMSolverODEScheduler,
+}
+
+
+def get_tier(name):
+    """ティア名から設定（scheduler / steps / guidance_cutoff）を返す。ティアなしなら None"""
+    if not name:
+        return None
+    return settings.AUDIO_GENERATION_TIERS[name]
+
+
+def make_scheduler(pipe, name):
+    """
+    モデルの設定を引き継いだ新しいスケジューラーを作る
+    - スケジューラーは内部状態を持つため、バッチごとに作り直す
+    """
+    scheduler_class = SCHEDULERS[name] or type(pipe.scheduler)
+    return scheduler_class.from_config(pipe.scheduler.config)
+
+
+def refine_start_step(num_inference_steps, strength):
+    """
+    リファイン（途中からのノイズ除去）で飛ばすステップ数
+    - strength（0〜1）の割合のステップだけを、スケジュールの終わりの側から実行する
+    """
+    if strength is None:
+        return 0
+    return num_inference_steps - max(math.ceil(num_inference_steps * strength), 1)
+
+
+def truncate_schedule(scheduler, start_step):
+    """
+    set_timesteps の後にスケジュールの先頭 start_step ステップを取り除くようにする
+    - シグマ列と timesteps を同じ位置で切るため、ステップの位置やソルバーの次数の管理はそのまま働く
+    """
+    if not start_step:
+        return scheduler
+    set_timesteps = scheduler.set_timesteps
+
+    def truncated_set_timesteps(num_inference_steps=None, device=None):
+        set_timesteps(num_inference_steps, device=device)
+        scheduler.timesteps = scheduler.timesteps[start_step:]
+        scheduler.sigmas = scheduler.sigmas[start_step:]
+
+    scheduler.set_timesteps = truncated_set_timesteps
+    return scheduler
+
+
+def refine_latents(pipe, num_inference_steps, init_latents, generators):
+    """
+    下書きの潜在表現から、リファインの開始位置のノイズ量にした初期潜在表現を作る
+    - 開始位置のシグマ σ で x = x0 + σ * ε とし、パイプラインが init_noise_sigma を掛ける分を割っておく
+    - ε はアイテムごとの Generator で作るため、同じシード値なら同じ結果になる
+    """
+    pipe.scheduler.set_timesteps(num_inference_steps)
+    sigma = pipe.scheduler.sigmas[0].item()
+    noise = torch.stack([
+        torch.randn(init_latents.shape[1:], generator=generator, device=generator.device)
+        for generator in generators
+    ]).to(init_latents.device)
+    return (init_latents + sigma * noise) / pipe.scheduler.init_noise_sigma
+
+
+@contextlib.contextmanager
+def sampling_options(pipe, num_inference_steps, scheduler='default', guidance_cutoff=1.0, strength=None):
+    """
+    パイプライン呼び出しの間だけスケジューラーと CFG の打ち切りを適用する
+    - strength を指定した場合は、スケジュールの最後の strength の割合だけを実行する（リファイン）
+    - バッチは専用スレッドで1つずつ実行されるため、共有パイプラインを一時的に書き換えても競合しない
+    """
+    start_step = refine_start_step(num_inference_steps, strength)
+    original_scheduler = pipe.scheduler
+    pipe.scheduler = truncate_schedule(make_scheduler(pipe, scheduler), start_step)
+    try:
+        with guidance_truncation(pipe.transformer, num_inference_steps, guidance_cutoff, start_step):
+            yield
+    finally:
+        pipe.scheduler = original_scheduler
+
+
+@contextlib.contextmanager
+def guidance_truncation(transformer, num_inference_steps, guidance_cutoff, start_step=0):
+    """
+    全ステップのうち guidance_cutoff（0〜1）の割合を過ぎたら、CFG の無条件側の計算を省略する
+    - 後半のステップは大まかな構造が決まっていてガイダンスの影響が小さいため、条件付き側だけを計算する
+    - パイプラインは [無条件, 条件付き] の順でバッチを組み uncond + g * (cond - uncond) を計算するので、
+      両側に条件付きの出力を返せば結果は cond になる
+    - start_step はリファインで飛ばしたステップ数（打ち切り位置は全体のステップ数に対して数える）
+    """
+    if guidance_cutoff >= 1.0:
+        yield
+        return
+
+    cutoff_step = math.ceil(num_inference_steps * guidance_cutoff)
+    forward = transformer.forward
+    # torch.compile 済みの forward がインスタンス属性に設定されている場合は、終了後にそれを戻す
+    instance_forward = transformer.__dict__.get('forward')
+    calls = 0
+
+    def truncated_forward(hidden_states, timestep=None, encoder_hidden_states=None,
+                          global_hidden_states=None, *args, **kwargs):
+        nonlocal calls
+        step = calls + start_step
+        calls += 1
+        if step < cutoff_step or hidden_states.shape[0] % 2:
+            return forward(hidden_states, timestep, encoder_hidden_states, global_hidden_states, *args, **kwargs)
+
+        half = hidden_states.shape[0] // 2
+        output = forward(
+            hidden_states[half:], timestep, encoder_hidden_states[half:], global_hidden_states[half:],
+            *args, **kwargs
+        )
+        sample = output[0] if isinstance(output, tuple) else output.sample
+        return (torch.cat([sample, sample]),)
+
+    transformer.forward = truncated_forward
+    try:
+        yield
+    finally:
+        if instance_forward is not None:
+            transformer.forward = instance_forward
+        else:
+            del transformer.forward
@@ -0,0 +1,72 @@
+from django.urls import reverse
+from rest_framework import serializers
+from .delivery import SIGNED_KIND_JOB, SIGNED_KIND_LIBRARY, make_signed_url
+from .models import GeneratedAudio, GenerationJob
+
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    """音声生成ジョブシリアライザー"""
+    result_url = serializers.SerializerMethodField()
+    signed_result_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GenerationJob
+        fields = [
+            'id', 'status', 'prompt', 'neg_prompt', 'duration', 'steps', 'seed',
+            'output_format', 'quality', 'tier',
+            'error', 'result_url', 'signed_result_url', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+    def get_result_url(self, obj):
+        """完了したジョブのみ結果取得用URLを返す"""
+        if obj.status != GenerationJob.STATUS_SUCCEEDED:
+            return None
+        request = self.context.get('request')
+        path = reverse('audio-job-result', args=[obj.id])
+        return request.build_absolute_uri(path) if request else path
+
+    def get_signed_result_url(self, obj):
+        """完了したジョブのみ、認証なしで取得できる有効期限付きURLを返す（ダウンロードできないプランでは None）"""
+        if obj.status != GenerationJob.STATUS_SUCCEEDED:
+            return None
+        return make_signed_url(self.context.get('request'), SIGNED_KIND_JOB, obj.id)
+
+
+class GeneratedAudioSerializer(serializers.ModelSerializer):
+    """生成音声ライブラリのシリアライザー"""
+    download_url = serializers.SerializerMethodField()
+    signed_url = serializers.SerializerMethodField()
+    peaks_url = serializers.SerializerMethodField()
+    has_latents = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GeneratedAudio
+        fields = [
+            'id', 'prompt', 'neg_prompt', 'duration', 'steps', 'seed',
+            'output_format', 'quality', 'tier', 'size', 'analysis',
+            'sampling', 'refined_from', 'has_latents',
+            'download_url', 'signed_url', 'peaks_url', 'created_at'
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        request = self.context.get('request')
+        path = reverse('audio-library-download', args=[obj.id])
+        return request.build_absolute_uri(path) if request else path
+
+    def get_signed_url(self, obj):
+        """認証なしで取得できる有効期限付きURL（<audio src> での再生用。ダウンロードできないプランでは None）"""
+        return make_signed_url(self.context.get('request'), SIGNED_KIND_LIBRARY, obj.id)
+
+    def get_has_latents(self, obj):
+        """潜在表現が保存されているか（リファインと再デコードに必要）"""
+        return bool(obj.latents_file)
+
+    def get_peaks_url(self, obj):
+        """波形ピークのバイナリのURL（解析済みの場合のみ）"""
+        if not obj.peaks_file:
+            return None
+        request = self.context.get('request')
+        path = reverse('audio-library-peaks', args=[obj.id])
+        return request.build_absolute_uri(path) if request else path
@@ -0,0 +1,181 @@
+import os
+import queue
+import select
+import socket
+import socketserver
+import threading
+import traceback
+
+from .admission import AdmissionRejected
+from .batching import CancellationToken, GenerationCancelled
+from .ipc import pack_audio, pack_audios, parse_address, recv_frame, send_frame, unpack_audio
+from .pipeline import (
+    decode_latents_local,
+    generate_audio_batch_local,
+    generate_audio_local,
+    get_local_inference_profile,
+    get_local_inference_stats,
+)
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    """
+    1接続分のリクエストを処理する（接続ごとに別スレッドで実行される）
+    - 生成はプロセス内のマイクロバッチスケジューラーに投入するため、同時接続はまとめて推論される
+    """
+
+    def handle(self):
+        while True:
+            try:
+                frame = recv_frame(self.request)
+            except (OSError, ValueError):
+                return
+            if frame is None:
+                return
+
+            header, request_payload = frame
+            try:
+                response, payload = self.dispatch(header, request_payload)
+            except Exception as e:
+                traceback.print_exc()
+                response, payload = {'ok': False, 'error': str(e)}, b''
+
+            try:
+                send_frame(self.request, response, payload)
+            except OSError:
+                return
+
+    def dispatch(self, header, payload=b''):
+        op = header.get('op')
+        if op in ('generate', 'generate_batch', 'decode'):
+            # 生成中にクライアントが接続を閉じたら、生成を打ち切る
+            # 進捗は推論スレッドから Queue に積み、監視スレッドがクライアントに送る
+            cancel_token = CancellationToken()
+            progress = queue.SimpleQueue() if header.get('progress') else None
+            done = threading.Event()
+            watcher = threading.Thread(
+                target=watch_disconnect, args=(self.request, cancel_token, done, progress), daemon=True
+            )
+            watcher.start()
+            try:
+                if op == 'generate':
+                    return self.generate(header, payload, cancel_token, progress)
+                if op == 'decode':
+                    return self.decode(header, payload, cancel_token)
+                return self.generate_batch(header, cancel_token)
+            except GenerationCancelled:
+                return {'ok': False, 'cancelled': True, 'error': 'Generation cancelled'}, b''
+            except AdmissionRejected as e:
+                return {'ok': False, 'rejected': True, 'retry_after': e.retry_after, 'error': str(e)}, b''
+            finally:
+                done.set()
+                watcher.join()
+        if op == 'profile':
+            return {'ok': True, 'profile': get_local_inference_profile()}, b''
+        if op == 'stats':
+            return {'ok': True, 'stats': get_local_inference_stats()}, b''
+        return {'ok': False, 'error': f'Unknown op: {op}'}, b''
+
+    def generate(self, header, payload, cancel_token, progress):
+        init_latents = unpack_audio(header['init_latents'], payload) if header.get('init_latents') else None
+        audio_np, sampling_rate, latents = generate_audio_local(
+            header['prompt'],
+            header['neg_prompt'],
+            int(header['steps']),
+            float(header['duration']),
+            int(header['seed']),
+            header.get('tier'),
+            cancel_token=cancel_token,
+            on_progress=progress_callback(progress),
+            requester=header.get('requester'),
+            init_latents=init_latents,
+            strength=header.get('strength'),
+        )
+        audios_header, payload = pack_audios([audio_np, latents])
+        return {'ok': True, 'sampling_rate': sampling_rate, **audios_header}, payload
+
+    def decode(self, header, payload, cancel_token):
+        audio_np, sampling_rate = decode_latents_local(
+            unpack_audio(header['latents'], payload), float(header['duration']),
+            cancel_token=cancel_token, requester=header.get('requester'),
+        )
+        audio_header, payload = pack_audio(audio_np)
+        return {'ok': True, 'sampling_rate': sampling_rate, **audio_header}, payload
+
+    def generate_batch(self, header, cancel_token):
+        audios, sampling_rate, latents = generate_audio_batch_local(
+            header['items'], cancel_token=cancel_token, requester=header.get('requester'),
+        )
+        audios_header, payload = pack_audios(audios + latents)
+        return {'ok': True, 'sampling_rate': sampling_rate, **audios_header}, payload
+
+
+def progress_callback(progress):
+    """進捗を Queue に積むだけのコールバック（推論スレッドを止めない）。progress が None なら None"""
+    if progress is None:
+        return None
+
+    def on_progress(step, total_steps, eta):
+        progress.put({'step': step, 'total_steps': total_steps, 'eta': eta})
+    return on_progress
+
+
+def watch_disconnect(sock, cancel_token, done, progress=None, interval=0.1):
+    """
+    done が設定されるまで接続を監視し、クライアントが接続を閉じたらキャンセルする
+    - progress の Queue に積まれた進捗を進捗フレームとして送る（応答はこのスレッドの終了後に送られる）
+    - 次のリクエストのデータが届いた場合は読み取らずに監視を終える
+    """
+    while not done.is_set():
+        try:
+            readable, _, _ = select.select([sock], [], [], interval)
+            if not readable:
+                send_progress(sock, progress)
+                continue
+            closed = sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            closed = True
+        if closed:
+            cancel_token.cancel()
+        return
+
+
+def send_progress(sock, progress):
+    """溜まっている進捗のうち最新のものだけを送る"""
+    latest = None
+    while progress is not None and not progress.empty():
+        latest = progress.get_nowait()
+    if latest is not None:
+        send_frame(sock, {'progress': latest})
+
+
+class ThreadingUnixInferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPInferenceServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def server_bind(self):
+        # 音声の応答が Nagle アルゴリズムで遅れないようにする
+        super().server_bind()
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def make_inference_server(address):
+    """
+    アドレス（unix:// または tcp://）に応じた推論サーバーを作る
+    - 推論サーバーは認証を行わず、クライアントが送る requester（ユーザー・プラン・重み）を
+      そのままアドミッション制御の公平性に使う。tcp:// は localhost かプライベートネットワーク
+      （docker-compose の内部ネットワークなど）だけで待ち受け、外部に公開しないこと
+    """
+    family, sockaddr = parse_address(address)
+    if family == socket.AF_UNIX:
+        # 前回の起動で残ったソケットファイルを削除する
+        try:
+            os.unlink(sockaddr)
+        except FileNotFoundError:
+            pass
+        return ThreadingUnixInferenceServer(sockaddr, InferenceRequestHandler)
+    return ThreadingTCPInferenceServer(sockaddr, InferenceRequestHandler)
@@ -0,0 +1,114 @@
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from .batching import GenerationCancelled
+
+# 結果を待っている間にキャンセルを確認する間隔（秒）
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class SharedCancellation:
+    """
+    同じ計算に相乗りしているリクエストのキャンセルトークンをまとめたもの
+    - すべてのリクエストがキャンセルした場合だけキャンセル扱いにする（1人が切断しても、他の人の分の生成は続ける）
+    - トークンを持たないリクエスト（WSGI）が1つでもあればキャンセルしない
+    """
+
+    def __init__(self):
+        self._tokens = []
+
+    def attach(self, cancel_token):
+        self._tokens.append(cancel_token)
+
+    @property
+    def is_cancelled(self):
+        tokens = list(self._tokens)
+        return bool(tokens) and all(token is not None and token.is_cancelled for token in tokens)
+
+
+class Flight:
+    """実行中の1つの計算と、その結果を待っているリクエストのキャンセル"""
+    __slots__ = ('future', 'cancellation')
+
+    def __init__(self):
+        self.future = Future()
+        self.cancellation = SharedCancellation()
+
+
+class SingleFlight:
+    """
+    同じキーの計算を同時に1つだけ実行する（シングルフライト）
+    - 実行中の計算と同じキーのリクエストは新しく計算せず、その結果（例外も含む）を受け取る
+    - 計算が終わったキーは忘れる（それ以降は結果キャッシュから返す）
+    - プロセス内だけで重複をまとめる。別のワーカープロセス（gunicorn のワーカー、Celery ワーカー）に届いた
+      同じリクエストはそれぞれ生成し、結果キャッシュには後から書いた方が残る
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def run(self, key, fn, cancel_token=None):
+        """
+        key の計算が実行中ならその結果を待ち、なければ fn(cancel_token) を実行して (結果, 相乗りしたかどうか) を返す
+        - fn に渡すトークンは、相乗りしたすべてのリクエストがキャンセルしたときだけキャンセルされる
+        - 自分のリクエストがキャンセルされた場合は、計算が続いていても GenerationCancelled を送出する
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+            flight.cancellation.attach(cancel_token)
+
+        if not leader:
+            return wait_for_result(flight.future, cancel_token), True
+
+        try:
+            result = fn(flight.cancellation)
+        except BaseException as e:
+            flight.future.set_exception(e)
+            raise
+        else:
+            flight.future.set_result(result)
+        finally:
+            with self._lock:
+                del self._flights[key]
+        # 相乗りしたリクエストのために計算は最後まで続けるが、切断したクライアントには結果を返さない
+        if cancel_token is not None and cancel_token.is_cancelled:
+            raise GenerationCancelled()
+        return result, False
+
+    def stats(self):
+        """監視用の実行中の計算の数と、相乗りで省略した計算の数"""
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+            }
+
+
+def wait_for_result(future, cancel_token=None):
+    """Future の結果を待つ（待っている間にキャンセルされたら GenerationCancelled）"""
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_INTERVAL)
+        except TimeoutError:
+            if cancel_token is not None and cancel_token.is_cancelled:
+                raise GenerationCancelled()
+
+
+_single_flight = None
+
+def get_single_flight():
+    """生成リクエストのシングルフライトを一度だけ初期化して返す"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,174 @@
+import threading
+
+from celery import shared_task
+from celery.signals import worker_ready
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from mainapp.users.models import User
+
+from .admission import AdmissionRejected, make_requester
+from .batching import CancellationToken, GenerationCancelled
+from .cache import get_result_cache, make_cache_key
+from .delivery import audio_checksum
+from .encoding import OUTPUT_FORMATS, submit_encode
+from .models import GenerationJob
+from .pipeline import generate_audio, preload_audio_pipeline
+from .progress import publish_job_progress
+from .usage import get_user_plan_limits, increment_usage
+
+
+@worker_ready.connect
+def preload_pipeline_on_worker_ready(**kwargs):
+    """ワーカー起動時にモデルを読み込み、最初のジョブから定常状態の速度で生成する"""
+    # 推論サーバーを使う場合、このプロセスではモデルを読み込まない
+    if settings.AUDIO_PRELOAD_PIPELINE and not settings.AUDIO_INFERENCE_SERVER:
+        preload_audio_pipeline()
+
+
+def watch_job_cancellation(job_id, cancel_token, done):
+    """
+    生成中のジョブが DELETE でキャンセルされていないかを一定間隔で確認し、
+    キャンセルされていればトークンをキャンセルする（推論スレッドが次のステップで打ち切る）
+    """
+    try:
+        while not done.wait(settings.AUDIO_JOB_CANCEL_POLL_INTERVAL):
+            if GenerationJob.objects.filter(pk=job_id, status=GenerationJob.STATUS_CANCELLED).exists():
+                cancel_token.cancel()
+                return
+    finally:
+        # このスレッド用に開いた DB 接続を閉じる
+        connection.close()
+
+
+def job_progress_callback(job_id):
+    """ステップごとの進捗をジョブの進捗イベントとして publish するコールバック"""
+    def on_progress(step, total_steps, eta):
+        publish_job_progress(
+            job_id, status=GenerationJob.STATUS_RUNNING, step=step, total_steps=total_steps, eta=eta
+        )
+    return on_progress
+
+
+@shared_task(name='audio.run_generation_job')
+def run_generation_job(job_id):
+    """
+    GenerationJob を1件実行して、生成した音声をジョブに保存する
+    """
+    try:
+        job = GenerationJob.objects.select_related('user').get(pk=job_id)
+    except GenerationJob.DoesNotExist:
+        return
+    if job.status != GenerationJob.STATUS_PENDING:
+        return
+
+    # ユーザーごとの同時実行数の上限に達していれば、ワーカーを占有せずに少し後で再実行する
+    limits = get_user_plan_limits(job.user)
+    with transaction.atomic():
+        # 同じユーザーのジョブが同時に上限を超えて開始しないよう、ユーザーの行をロックして数える
+        list(User.objects.select_for_update().filter(pk=job.user_id).values_list('pk', flat=True))
+        running = GenerationJob.objects.filter(user_id=job.user_id, status=GenerationJob.STATUS_RUNNING).count()
+        if running >= limits['max_concurrent_jobs']:
+            started = None
+        else:
+            # 再配送やキャンセルなどで既に終了しているジョブは何もしない
+            # （待機中にキャンセルされた場合と競合しないよう、条件付きで更新する）
+            started_at = timezone.now()
+            started = GenerationJob.objects.filter(
+                pk=job.pk, status=GenerationJob.STATUS_PENDING,
+            ).update(status=GenerationJob.STATUS_RUNNING, started_at=started_at)
+    if started is None:
+        run_generation_job.apply_async((str(job.pk),), countdown=settings.AUDIO_JOB_REQUEUE_DELAY)
+        return
+    if not started:
+        return
+    job.status = GenerationJob.STATUS_RUNNING
+    job.started_at = started_at
+    publish_job_progress(job.pk, status=job.status, step=0, total_steps=job.steps, eta=None)
+
+    cancel_token = CancellationToken()
+    retry_after = None
+    done = threading.Event()
+    watcher = threading.Thread(target=watch_job_cancellation, args=(job.pk, cancel_token, done), daemon=True)
+    watcher.start()
+
+    try:
+        params = {
+            'prompt': job.prompt,
+            'neg_prompt': job.neg_prompt,
+            'steps': job.steps,
+            'duration': job.duration,
+            'seed': job.seed,
+            'output_format': job.output_format,
+            'quality': job.quality,
+            'tier': job.tier,
+        }
+
+        # 同じパラメータ・シード値の生成結果があれば、モデルを使わずに再利用する（シード値を指定したジョブのみ）
+        result_cache = get_result_cache()
+        cache_key = make_cache_key(params) if job.seeded else None
+        data = result_cache.get(cache_key) if job.seeded else None
+        if data is None:
+            audio_np, sampling_rate = generate_audio(
+                job.prompt,
+                job.neg_prompt,
+                job.steps,
+                job.duration,
+                job.seed,
+                job.tier or None,
+                cancel_token=cancel_token,
+                on_progress=job_progress_callback(job.pk),
+                requester=make_requester(job.user_id, limits),
+            )
+
+            data = submit_encode(audio_np, sampling_rate, job.output_format, job.quality).result()
+            if job.seeded:
+                result_cache.set(cache_key, data)
+
+        extension = OUTPUT_FORMATS[job.output_format]['extension']
+        job.result_file.save(f"audio_{job.id}.{extension}", ContentFile(data), save=False)
+        job.checksum = audio_checksum(data)
+
+        job.status = GenerationJob.STATUS_SUCCEEDED
+    except GenerationCancelled:
+        # DELETE で既に cancelled になっているので、ステータスは更新しない
+        return
+    except AdmissionRejected as e:
+        # 推論側が混み合っている場合は待機中に戻し、捌けるまでの見積もり時間後に再実行する
+        retry_after = e.retry_after
+    except Exception as e:
+        job.status = GenerationJob.STATUS_FAILED
+        job.error = str(e)
+    finally:
+        done.set()
+        watcher.join()
+
+    if retry_after is not None:
+        requeued = GenerationJob.objects.filter(
+            pk=job.pk, status=GenerationJob.STATUS_RUNNING,
+        ).update(status=GenerationJob.STATUS_PENDING, started_at=None)
+        if requeued:
+            publish_job_progress(job.pk, status=GenerationJob.STATUS_PENDING)
+            run_generation_job.apply_async((str(job.pk),), countdown=retry_after)
+        return
+
+    # 生成中にキャンセルされていた場合は結果を保存しない
+    finished = GenerationJob.objects.filter(
+        pk=job.pk, status=GenerationJob.STATUS_RUNNING,
+    ).update(
+        status=job.status,
+        error=job.error,
+        result_file=job.result_file.name or None,
+        checksum=job.checksum,
+        finished_at=timezone.now(),
+    )
+    if not finished:
+        if job.result_file:
+            job.result_file.delete(save=False)
+        return
+    publish_job_progress(job.pk, status=job.status)
+
+    # 生成に成功した時点で使用量を増加
+    if job.status == GenerationJob.STATUS_SUCCEEDED:
+        increment_usage(job.user, int(job.duration))
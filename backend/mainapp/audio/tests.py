@@ -1,3 +1,1358 @@
-from django.test import TestCase
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import soundfile as sf
+import torch
+from django.conf import settings
+from django.core.files import File
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone as django_timezone
+from django.utils.http import http_date
+from diffusers.models.autoencoders.autoencoder_oobleck import OobleckDecoderOutput
+from rest_framework.test import APIClient
+
+from mainapp.billing.models import Plan, UserSubscription
+from mainapp.users.models import User
+from .admission import DECODE_COST, AdmissionController, AdmissionRejected
+from . import cache as result_cache_module
+from .analysis import PEAKS_BASE_BLOCK, analyze_audio, measure_loudness, peak_levels
+from .batching import BatchItem, CancellationToken, GenerationCancelled, MicroBatchScheduler
+from .cache import AudioResultCache, make_cache_key
+from .decoding import tile_starts, tiled_decode
+from .delivery import RangeNotSatisfiable, audio_checksum, parse_range, stored_audio_response
+from .editing import EditError, apply_edits, fade_curves
+from .encoding import available_formats, encode_audio, iter_chunks, normalize_format, resample
+from .idempotency import IdempotencyConflict, claim_idempotency_key, finish_idempotency_key
+from .library import pack_latents, save_to_library
+from .longform import plan_windows, stitch_windows, total_frames
+from .middleware import GenerationCancellationMiddleware, SocketCancellationToken
+from .models import GenerationJob, IdempotencyKey
+from .pipeline import _step_callback, decode_latents_local
+from .sampling import CosineDPMSolverODEScheduler, refine_latents, refine_start_step, truncate_schedule
+from .singleflight import SharedCancellation, SingleFlight
+from .tasks import run_generation_job
+from .views import build_batch_zip, job_queue_estimate
+
+# スレッドを待つテストの上限（秒）
+THREAD_TIMEOUT = 5.0
+
+
+def make_test_requester(user, weight=1, max_in_flight=0):
+    return {'user': user, 'plan': 'test', 'weight': weight, 'max_in_flight': max_in_flight}
+
+
+def wait_until(condition):
+    """condition() が真になるまで待つ（他のスレッドが待ち行列に入るのを待つのに使う）"""
+    deadline = time.monotonic() + THREAD_TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("条件が満たされないままタイムアウトしました")
+        time.sleep(0.01)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+
+    def test_admits_until_max_cost_then_rejects_when_queue_is_full(self):
+        controller = AdmissionController(max_cost=10, max_queue=0, default_retry_after=7)
+        controller.acquire(6)
+        controller.acquire(4)
+        with self.assertRaises(AdmissionRejected) as raised:
+            controller.acquire(1)
+        self.assertEqual(raised.exception.retry_after, 7)
+        stats = controller.stats()
+        self.assertEqual((stats['in_flight'], stats['in_flight_cost']), (2, 10))
+        self.assertEqual((stats['admitted'], stats['rejected']), (2, 1))
+
+        controller.release(6)
+        controller.acquire(5)
+        self.assertEqual(controller.stats()['in_flight_cost'], 9)
+
+    def test_admits_one_oversized_request_when_idle(self):
+        controller = AdmissionController(max_cost=10, max_queue=0)
+        controller.acquire(50)
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire(1)
+
+    def test_retry_after_uses_measured_throughput(self):
+        clock = [100.0]
+        controller = AdmissionController(max_cost=4, max_queue=0, default_retry_after=99)
+        with mock.patch('mainapp.audio.admission.time.monotonic', lambda: clock[0]):
+            controller.acquire(4)
+            controller.release(4)
+            clock[0] = 110.0
+            controller.acquire(4)
+            controller.release(4)
+            # 10秒で 4 を処理した（0.4/秒）ので、実行中の 4 が捌けるまで10秒
+            controller.acquire(4)
+            with self.assertRaises(AdmissionRejected) as raised:
+                controller.acquire(1)
+        self.assertEqual(raised.exception.retry_after, 10)
+
+    def test_waiters_run_in_weighted_fair_order(self):
+        controller = AdmissionController(max_cost=1, max_queue=10)
+        holder = make_test_requester('holder')
+        controller.acquire(1, requester=holder)
+
+        order = []
+        threads = []
+
+        def run(name, requester):
+            controller.acquire(1, requester=requester)
+            order.append(name)
+            controller.release(1, requester=requester)
+
+        # a が先に3件並べても、後から来た b（重み2）は a の2件目より先に実行される
+        arrivals = [
+            ('a1', make_test_requester('a')),
+            ('a2', make_test_requester('a')),
+            ('a3', make_test_requester('a')),
+            ('b1', make_test_requester('b', weight=2)),
+            ('b2', make_test_requester('b', weight=2)),
+        ]
+        for depth, (name, requester) in enumerate(arrivals, start=1):
+            thread = threading.Thread(target=run, args=(name, requester))
+            thread.start()
+            threads.append(thread)
+            wait_until(lambda: controller.stats()['queue_depth'] == depth)
+
+        controller.release(1, requester=holder)
+        for thread in threads:
+            thread.join(THREAD_TIMEOUT)
+        self.assertEqual(order, ['b1', 'a1', 'b2', 'a2', 'a3'])
+
+    def test_per_user_limit_counts_in_flight_and_waiting_requests(self):
+        controller = AdmissionController(max_cost=1, max_queue=10)
+        capped = make_test_requester('a', max_in_flight=2)
+        controller.acquire(1, requester=capped)
+
+        waiter = threading.Thread(target=controller.acquire, args=(1, None, capped))
+        waiter.start()
+        wait_until(lambda: controller.stats()['queue_depth'] == 1)
+
+        # 実行中1件 + 待機中1件で上限に達しているので、3件目はすぐに断る
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire(1, requester=capped)
+
+        controller.release(1, requester=capped)
+        waiter.join(THREAD_TIMEOUT)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(controller.stats()['in_flight'], 1)
+
+    def test_per_user_limit_rejects_request_while_user_is_at_limit(self):
+        controller = AdmissionController(max_cost=100, max_queue=10)
+        capped = make_test_requester('a', max_in_flight=1)
+        controller.acquire(1, requester=capped)
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire(1, requester=capped)
+        # 他のユーザーはそのまま実行される
+        controller.acquire(1, requester=make_test_requester('b'))
+        self.assertEqual(controller.stats()['in_flight'], 2)
+
+    def test_cancelled_waiter_does_not_advance_the_users_finish_tag(self):
+        controller = AdmissionController(max_cost=1, max_queue=10)
+        holder = make_test_requester('holder')
+        controller.acquire(1, requester=holder)
+
+        token = CancellationToken()
+        cancelled = []
+
+        def cancel_while_waiting():
+            try:
+                controller.acquire(1, token, make_test_requester('a'))
+            except GenerationCancelled:
+                cancelled.append(True)
+
+        thread = threading.Thread(target=cancel_while_waiting)
+        thread.start()
+        wait_until(lambda: controller.stats()['queue_depth'] == 1)
+        token.cancel()
+        thread.join(THREAD_TIMEOUT)
+        self.assertEqual(cancelled, [True])
+
+        order = []
+        threads = []
+
+        def run(name):
+            requester = make_test_requester(name)
+            controller.acquire(1, requester=requester)
+            order.append(name)
+            controller.release(1, requester=requester)
+
+        # キャンセルした分が残っていれば a は b より後ろになるが、戻しているので到着順に実行される
+        for depth, name in enumerate(('a', 'b'), start=1):
+            threads.append(threading.Thread(target=run, args=(name,)))
+            threads[-1].start()
+            wait_until(lambda: controller.stats()['queue_depth'] == depth)
+
+        controller.release(1, requester=holder)
+        for thread in threads:
+            thread.join(THREAD_TIMEOUT)
+        self.assertEqual(order, ['a', 'b'])
+
+
+def response_body(response):
+    return b''.join(response.streaming_content) if response.streaming else response.content
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_closed_open_and_suffix_ranges(self):
+        self.assertEqual(parse_range('bytes=100-199', 1000), (100, 199))
+        self.assertEqual(parse_range('bytes=100-5000', 1000), (100, 999))
+        self.assertEqual(parse_range('bytes=100-', 1000), (100, 999))
+        self.assertEqual(parse_range('bytes=-300', 1000), (700, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_unparseable_ranges_are_ignored(self):
+        for header in (None, '', 'bytes=-', 'bytes=5-1', 'bytes=0-1,3-4', 'items=0-1', 'bytes=a-b'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_ranges_outside_the_file_are_not_satisfiable(self):
+        for header, size in (('bytes=1000-', 1000), ('bytes=2000-3000', 1000), ('bytes=-0', 1000), ('bytes=-1', 0)):
+            with self.subTest(header=header, size=size):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_range(header, size)
+
+
+@override_settings(AUDIO_DOWNLOAD_OFFLOAD='')
+class StoredAudioResponseTests(SimpleTestCase):
+    data = bytes(range(256)) * 4
+    last_modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.wav')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(self.data)
+        self.addCleanup(os.remove, self.path)
+        self.etag = f'"{audio_checksum(self.data)}"'
+
+    def get(self, **headers):
+        request = RequestFactory().get('/audio', **headers)
+        field_file = File(open(self.path, 'rb'), name=self.path)
+        self.addCleanup(field_file.close)
+        return stored_audio_response(
+            request, field_file, 'audio/wav', 'audio.wav', audio_checksum(self.data), self.last_modified,
+        )
+
+    def test_full_response_has_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_body(response), self.data)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Last-Modified'], http_date(self.last_modified.timestamp()))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+
+    def test_matching_validators_return_not_modified(self):
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=self.etag).status_code, 304)
+        later = http_date((self.last_modified + timedelta(days=1)).timestamp())
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=later).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_range_returns_partial_content(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response_body(response), self.data[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+    def test_if_range_applies_range_only_when_validator_matches(self):
+        response = self.get(HTTP_RANGE='bytes=-4', HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response_body(response), self.data[-4:])
+
+        response = self.get(HTTP_RANGE='bytes=-4', HTTP_IF_RANGE=http_date(self.last_modified.timestamp()))
+        self.assertEqual(response.status_code, 206)
+
+        response = self.get(HTTP_RANGE='bytes=-4', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_body(response), self.data)
+
+    def test_unsatisfiable_range_returns_416(self):
+        response = self.get(HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+
+class LongFormTests(SimpleTestCase):
+
+    def test_short_duration_is_one_window(self):
+        self.assertEqual(plan_windows(30.0, 47.0, 4.0), [(0.0, 30.0)])
+        self.assertEqual(plan_windows(47.0, 47.0, 4.0), [(0.0, 47.0)])
+
+    def test_windows_overlap_and_cover_the_duration(self):
+        windows = plan_windows(100.0, 40.0, 4.0)
+        self.assertEqual(windows, [(0.0, 40.0), (36.0, 40.0), (72.0, 28.0)])
+        for (start, length), (next_start, _) in zip(windows, windows[1:]):
+            self.assertEqual(start + length - next_start, 4.0)
+        start, length = windows[-1]
+        self.assertEqual(start + length, 100.0)
+
+    def test_stitch_crossfades_only_the_overlap(self):
+        overlap = 4
+        windows = [np.full((10, 2), 1.0), np.full((10, 2), 2.0), np.full((6, 2), 3.0)]
+        stitched = np.concatenate(list(stitch_windows(windows, overlap)))
+
+        self.assertEqual(len(stitched), total_frames([10, 10, 6], overlap))
+        np.testing.assert_array_equal(stitched[:6], 1.0)
+        np.testing.assert_array_equal(stitched[10:12], 2.0)
+        np.testing.assert_array_equal(stitched[16:], 3.0)
+        # 重なり部分は前のウィンドウのフェードアウトと次のウィンドウのフェードインの和
+        fade_in, fade_out = fade_curves(overlap, 'equal_power')
+        np.testing.assert_allclose(stitched[6:10, 0], 1.0 * fade_out + 2.0 * fade_in, rtol=1e-6)
+        np.testing.assert_allclose(stitched[12:16, 0], 2.0 * fade_out + 3.0 * fade_in, rtol=1e-6)
+
+    def test_stitch_single_window_is_unchanged(self):
+        audio = np.arange(20, dtype=np.float32).reshape(10, 2)
+        stitched = np.concatenate(list(stitch_windows([audio], 4)))
+        np.testing.assert_array_equal(stitched, audio)
+
+
+class PointwiseVae:
+    """潜在表現の各フレームを hop_length サンプルに複製するだけのデコーダー（タイル分割の有無で結果が変わらない）"""
+    hop_length = 4
+
+    def decode(self, z):
+        return OobleckDecoderOutput(sample=z.repeat_interleave(self.hop_length, dim=-1))
+
+
+class TiledDecodingTests(SimpleTestCase):
+
+    def test_tile_starts(self):
+        self.assertEqual(tile_starts(30, 40, 8), [0])
+        self.assertEqual(tile_starts(100, 40, 8), [0, 32, 64])
+        self.assertEqual(tile_starts(100, 40, 8, fixed_shape=True), [0, 32, 60])
+
+    def test_tiles_cover_the_latents_with_overlap(self):
+        cases = [(100, 40, 8, False), (100, 40, 8, True), (41, 40, 8, False), (257, 64, 16, True)]
+        for length, tile, overlap, fixed_shape in cases:
+            with self.subTest(length=length, tile=tile, overlap=overlap, fixed_shape=fixed_shape):
+                starts = tile_starts(length, tile, overlap, fixed_shape)
+                self.assertEqual(starts[0], 0)
+                self.assertGreaterEqual(starts[-1] + tile, length)
+                for start, next_start in zip(starts, starts[1:]):
+                    self.assertGreaterEqual(start + tile - next_start, overlap)
+                if fixed_shape:
+                    self.assertEqual(starts[-1] + tile, length)
+
+    def test_tiled_decode_matches_full_decode(self):
+        vae = PointwiseVae()
+        latents = torch.randn(1, 2, 100)
+        expected = vae.decode(latents).sample
+        for fixed_shape in (False, True):
+            with self.subTest(fixed_shape=fixed_shape):
+                decoded = tiled_decode(vae, latents, 40, 8, fixed_shape=fixed_shape)
+                torch.testing.assert_close(decoded, expected)
+        decoded = tiled_decode(vae, latents, 40, 8, length=50)
+        torch.testing.assert_close(decoded, expected[..., :50 * vae.hop_length])
+
+
+def cancelled_token():
+    token = CancellationToken()
+    token.cancel()
+    return token
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_shared_cancellation_requires_every_request_to_cancel(self):
+        shared = SharedCancellation()
+        self.assertFalse(shared.is_cancelled)
+        shared.attach(cancelled_token())
+        self.assertTrue(shared.is_cancelled)
+        shared.attach(CancellationToken())
+        self.assertFalse(shared.is_cancelled)
+
+        # トークンを持たないリクエストが相乗りしていればキャンセルしない
+        shared = SharedCancellation()
+        shared.attach(cancelled_token())
+        shared.attach(None)
+        self.assertFalse(shared.is_cancelled)
+
+    def start_leader(self, flight, fn, cancel_token=None):
+        """key の計算を別スレッドで始め、fn が呼ばれるまで待つ"""
+        started = threading.Event()
+        results = []
+
+        def leader_fn(token):
+            started.set()
+            return fn(token)
+
+        def run():
+            try:
+                results.append(flight.run('key', leader_fn, cancel_token))
+            except Exception as e:
+                results.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.assertTrue(started.wait(THREAD_TIMEOUT))
+        return thread, results
+
+    def test_concurrent_requests_share_one_computation(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        leader, leader_results = self.start_leader(flight, lambda token: release.wait(THREAD_TIMEOUT) and 'audio')
+
+        follower_results = []
+        follower = threading.Thread(target=lambda: follower_results.append(flight.run('key', None)))
+        follower.start()
+        wait_until(lambda: flight.stats()['coalesced'] == 1)
+        release.set()
+        leader.join(THREAD_TIMEOUT)
+        follower.join(THREAD_TIMEOUT)
+
+        self.assertEqual(leader_results, [('audio', False)])
+        self.assertEqual(follower_results, [('audio', True)])
+        self.assertEqual(flight.stats(), {'in_flight': 0, 'executed': 1, 'coalesced': 1})
+
+    def test_errors_are_shared_with_coalesced_requests(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fail(token):
+            release.wait(THREAD_TIMEOUT)
+            raise RuntimeError('boom')
+
+        leader, leader_results = self.start_leader(flight, fail)
+        follower_results = []
+
+        def follow():
+            try:
+                flight.run('key', None)
+            except RuntimeError as e:
+                follower_results.append(e)
+
+        follower = threading.Thread(target=follow)
+        follower.start()
+        wait_until(lambda: flight.stats()['coalesced'] == 1)
+        release.set()
+        leader.join(THREAD_TIMEOUT)
+        follower.join(THREAD_TIMEOUT)
+        self.assertIsInstance(leader_results[0], RuntimeError)
+        self.assertEqual([str(e) for e in follower_results], ['boom'])
+
+    def test_cancelled_follower_detaches_without_stopping_the_leader(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        seen_tokens = []
+
+        def compute(token):
+            release.wait(THREAD_TIMEOUT)
+            seen_tokens.append(token.is_cancelled)
+            return 'audio'
+
+        leader, leader_results = self.start_leader(flight, compute, CancellationToken())
+        with self.assertRaises(GenerationCancelled):
+            flight.run('key', None, cancelled_token())
+        release.set()
+        leader.join(THREAD_TIMEOUT)
+        self.assertEqual(seen_tokens, [False])
+        self.assertEqual(leader_results, [('audio', False)])
+
+    def test_computation_is_cancelled_only_when_every_request_cancels(self):
+        flight = SingleFlight()
+        leader_token = CancellationToken()
+        follower_token = CancellationToken()
+
+        def compute(token):
+            wait_until(lambda: token.is_cancelled)
+            raise GenerationCancelled()
+
+        leader, leader_results = self.start_leader(flight, compute, leader_token)
+        follower_results = []
+
+        def follow():
+            try:
+                flight.run('key', None, follower_token)
+            except GenerationCancelled as e:
+                follower_results.append(e)
+
+        follower = threading.Thread(target=follow)
+        follower.start()
+        wait_until(lambda: flight.stats()['coalesced'] == 1)
+        leader_token.cancel()
+        time.sleep(0.2)
+        self.assertTrue(leader.is_alive())
+        follower_token.cancel()
+        leader.join(THREAD_TIMEOUT)
+        follower.join(THREAD_TIMEOUT)
+        self.assertIsInstance(leader_results[0], GenerationCancelled)
+        self.assertEqual(len(follower_results), 1)
+
+
+@override_settings(AUDIO_IDEMPOTENCY_KEY_TTL=3600, AUDIO_IDEMPOTENCY_LOCK_SECONDS=60)
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='idem', email='idem@example.com', password='password12345')
+
+    def make_stale(self, record, seconds):
+        created_at = django_timezone.now() - timedelta(seconds=seconds)
+        IdempotencyKey.objects.filter(pk=record.pk).update(created_at=created_at)
+        record.created_at = created_at
+
+    def test_in_progress_key_conflicts_and_different_request_is_rejected(self):
+        record, audio = claim_idempotency_key(self.user, 'key', 'request-a')
+        self.assertIsNotNone(record)
+        self.assertIsNone(audio)
+        with self.assertRaises(IdempotencyConflict) as raised:
+            claim_idempotency_key(self.user, 'key', 'request-a')
+        self.assertEqual(raised.exception.status_code, 409)
+        with self.assertRaises(IdempotencyConflict) as raised:
+            claim_idempotency_key(self.user, 'key', 'request-b')
+        self.assertEqual(raised.exception.status_code, 422)
+
+    def test_failed_request_frees_the_key(self):
+        record, _ = claim_idempotency_key(self.user, 'key', 'request-a')
+        finish_idempotency_key(record, None)
+        retried, _ = claim_idempotency_key(self.user, 'key', 'request-a')
+        self.assertIsNotNone(retried)
+
+    def test_stale_in_progress_key_is_taken_over_once(self):
+        record, _ = claim_idempotency_key(self.user, 'key', 'request-a')
+        self.make_stale(record, 120)
+
+        retried, audio = claim_idempotency_key(self.user, 'key', 'request-a')
+        self.assertEqual(retried.pk, record.pk)
+        self.assertIsNone(audio)
+        with self.assertRaises(IdempotencyConflict) as raised:
+            claim_idempotency_key(self.user, 'key', 'request-a')
+        self.assertEqual(raised.exception.status_code, 409)
+
+        # 引き継がれた元のリクエストが後から失敗しても、引き継いだ側の記録は消さない
+        finish_idempotency_key(record, None)
+        self.assertTrue(IdempotencyKey.objects.filter(pk=retried.pk).exists())
+
+    def test_expired_key_is_forgotten(self):
+        record, _ = claim_idempotency_key(self.user, 'key', 'request-a')
+        self.make_stale(record, 7200)
+        retried, _ = claim_idempotency_key(self.user, 'key', 'request-b')
+        self.assertNotEqual(retried.pk, record.pk)
+
+
+class MicroBatchSchedulerTests(SimpleTestCase):
+
+    def make_scheduler(self, window_ms=200, max_batch_size=4, fail=None):
+        """実行したバッチを (key, シード値のリスト) で記録し、シード値 * 10 を結果として返すスケジューラー"""
+        batches = []
+
+        def run_batch(key, items):
+            batches.append((key, [item.seed for item in items]))
+            if fail is not None:
+                raise fail
+            return [item.seed * 10 for item in items]
+
+        return MicroBatchScheduler(run_batch, window_ms=window_ms, max_batch_size=max_batch_size), batches
+
+    def test_requests_in_the_same_window_are_batched_by_key(self):
+        scheduler, batches = self.make_scheduler()
+        futures = [
+            scheduler.submit('a', 'p', 'n', 1),
+            scheduler.submit('b', 'p', 'n', 2),
+            scheduler.submit('a', 'p', 'n', 3),
+            scheduler.submit('a', 'p', 'n', 4),
+        ]
+        self.assertEqual([future.result(THREAD_TIMEOUT) for future in futures], [10, 20, 30, 40])
+        self.assertEqual(batches, [('a', [1, 3, 4]), ('b', [2])])
+
+    def test_large_groups_are_split_into_max_batch_size(self):
+        scheduler, batches = self.make_scheduler(max_batch_size=2)
+        futures = [scheduler.submit('a', 'p', 'n', seed) for seed in range(5)]
+        self.assertEqual([future.result(THREAD_TIMEOUT) for future in futures], [0, 10, 20, 30, 40])
+        self.assertEqual(batches, [('a', [0, 1]), ('a', [2, 3]), ('a', [4])])
+
+    def test_request_cancelled_while_queued_is_dropped_from_the_batch(self):
+        release = threading.Event()
+        batches = []
+
+        def run_batch(key, items):
+            batches.append([item.seed for item in items])
+            if key == 'blocker':
+                release.wait(THREAD_TIMEOUT)
+            return [item.seed for item in items]
+
+        scheduler = MicroBatchScheduler(run_batch, window_ms=0)
+        blocker = scheduler.submit('blocker', 'p', 'n', 0)
+        wait_until(lambda: batches)
+        token = CancellationToken()
+        cancelled = scheduler.submit('a', 'p', 'n', 1, cancel_token=token)
+        kept = scheduler.submit('a', 'p', 'n', 2)
+        token.cancel()
+        release.set()
+
+        with self.assertRaises(GenerationCancelled):
+            cancelled.result(THREAD_TIMEOUT)
+        self.assertEqual(kept.result(THREAD_TIMEOUT), 2)
+        self.assertEqual(blocker.result(THREAD_TIMEOUT), 0)
+        self.assertEqual(batches, [[0], [2]])
+
+    def test_batch_error_is_delivered_to_every_item(self):
+        scheduler, batches = self.make_scheduler(fail=RuntimeError('boom'))
+        futures = [scheduler.submit('a', 'p', 'n', seed) for seed in range(3)]
+        for future in futures:
+            with self.assertRaisesMessage(RuntimeError, 'boom'):
+                future.result(THREAD_TIMEOUT)
+        self.assertEqual(len(batches), 1)
+
+    def test_step_callback_stops_only_when_every_item_is_cancelled(self):
+        tokens = [CancellationToken(), CancellationToken()]
+        progress = {0: [], 1: []}
+        items = [
+            BatchItem('a', 'p', 'n', index, tokens[index], lambda *args, index=index: progress[index].append(args))
+            for index in range(2)
+        ]
+        callback = _step_callback(items, 4)
+
+        callback(0, None, None)
+        tokens[0].cancel()
+        # 1件だけキャンセルされた場合は残りのために続け、キャンセルされたアイテムには進捗を送らない
+        callback(1, None, None)
+        self.assertEqual([step for step, _, _ in progress[0]], [1])
+        self.assertEqual([(step, total) for step, total, _ in progress[1]], [(1, 4), (2, 4)])
+
+        tokens[1].cancel()
+        with self.assertRaises(GenerationCancelled):
+            callback(2, None, None)
+
+
+class AudioResultCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def key(self, name):
+        return name * 8
+
+    def age(self, cache, key, seconds):
+        """エントリの最後に使われた日時を seconds 秒前にする"""
+        past = time.time() - seconds
+        os.utime(cache._path(key), (past, past))
+
+    def test_get_returns_stored_data_and_none_for_missing_keys(self):
+        cache = AudioResultCache(self.directory, 1000)
+        self.assertIsNone(cache.get(self.key('a')))
+        cache.set(self.key('a'), b'audio')
+        self.assertEqual(cache.get(self.key('a')), b'audio')
+
+    def test_entries_larger_than_the_limit_or_disabled_cache_are_not_stored(self):
+        cache = AudioResultCache(self.directory, 10)
+        cache.set(self.key('a'), b'x' * 11)
+        self.assertIsNone(cache.get(self.key('a')))
+        disabled = AudioResultCache(self.directory, 0)
+        disabled.set(self.key('b'), b'x')
+        self.assertIsNone(disabled.get(self.key('b')))
+
+    def test_evicts_least_recently_used_entries_down_to_the_target(self):
+        cache = AudioResultCache(self.directory, 100)
+        cache.set(self.key('a'), b'a' * 40)
+        cache.set(self.key('b'), b'b' * 40)
+        self.age(cache, self.key('a'), 200)
+        self.age(cache, self.key('b'), 100)
+        # 読み出したエントリは最近使われたものとして残る
+        self.assertIsNotNone(cache.get(self.key('a')))
+
+        cache.set(self.key('c'), b'c' * 40)
+        self.assertIsNone(cache.get(self.key('b')))
+        self.assertIsNotNone(cache.get(self.key('a')))
+        self.assertIsNotNone(cache.get(self.key('c')))
+        self.assertEqual(cache._total, 80)
+
+    def test_total_tracks_overwrites_and_is_rescanned_after_the_interval(self):
+        clock = [1000.0]
+        cache = AudioResultCache(self.directory, 100)
+        with mock.patch.object(result_cache_module.time, 'monotonic', lambda: clock[0]):
+            cache.set(self.key('a'), b'a' * 40)
+            cache.set(self.key('a'), b'a' * 30)
+            self.assertEqual(cache._total, 30)
+
+            # 他のプロセスの書き込みは、数え直すまで合計に含まれない
+            other = AudioResultCache(self.directory, 100)
+            other.set(self.key('b'), b'b' * 50)
+            cache.set(self.key('c'), b'c' * 10)
+            self.assertEqual(cache._total, 40)
+
+            clock[0] += result_cache_module.RESCAN_INTERVAL + 1
+            self.age(cache, self.key('a'), 100)
+            cache.set(self.key('d'), b'd' * 20)
+        # 数え直すと 110 バイトで上限を超えるため、最も古い a を削除する
+        self.assertIsNone(cache.get(self.key('a')))
+        self.assertEqual(cache._total, 80)
+
+    def test_stale_temporary_files_from_crashed_writers_are_removed(self):
+        cache = AudioResultCache(self.directory, 100)
+        os.makedirs(os.path.join(self.directory, 'aa'))
+        stale = os.path.join(self.directory, 'aa', 'stale.tmp')
+        fresh = os.path.join(self.directory, 'aa', 'fresh.tmp')
+        for path in (stale, fresh):
+            with open(path, 'wb') as f:
+                f.write(b'x' * 60)
+        past = time.time() - result_cache_module.STALE_TMP_SECONDS - 1
+        os.utime(stale, (past, past))
+
+        cache.set(self.key('a'), b'a' * 10)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        # 書き込み中の一時ファイルは合計サイズに数えない
+        self.assertEqual(cache._total, 10)
+
+    def test_cache_key_normalizes_text_and_includes_the_execution_profile(self):
+        params = {'prompt': ' rain  on glass ', 'neg_prompt': 'Low quality.', 'steps': 50, 'duration': 5, 'seed': 1}
+        profile = {'name': 'cpu-fp32', 'device': 'cpu', 'dtype': 'float32'}
+        with mock.patch.object(result_cache_module, 'get_inference_profile', lambda: profile):
+            key = make_cache_key(params)
+            self.assertEqual(key, make_cache_key(dict(params, prompt='rain on glass')))
+            self.assertNotEqual(key, make_cache_key(dict(params, seed=2)))
+            profile = {'name': 'cpu-bf16', 'device': 'cpu', 'dtype': 'bfloat16'}
+            self.assertNotEqual(key, make_cache_key(params))
+
+
+def sine(frequency, seconds, sampling_rate, channels=2, amplitude=0.5):
+    """[samples, channels] の正弦波"""
+    t = np.arange(int(round(seconds * sampling_rate))) / sampling_rate
+    wave = (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+    return np.repeat(wave[:, None], channels, axis=1)
+
+
+class EncodingTests(SimpleTestCase):
+
+    def test_resample_length_and_waveform(self):
+        # 0.1 秒の 1kHz は周期がちょうど収まるので、FFT での変換は解析的な正弦波と一致する
+        for src_rate, dst_rate in ((44100, 48000), (48000, 16000), (16000, 44100)):
+            with self.subTest(src_rate=src_rate, dst_rate=dst_rate):
+                resampled = resample(sine(1000, 0.1, src_rate), src_rate, dst_rate)
+                self.assertEqual(resampled.shape, (int(0.1 * dst_rate), 2))
+                self.assertEqual(resampled.dtype, np.float32)
+                np.testing.assert_allclose(resampled, sine(1000, 0.1, dst_rate), atol=1e-4)
+
+    def test_resample_rounds_the_length_and_keeps_same_rate_input(self):
+        audio = np.zeros((1000, 1), dtype=np.float32)
+        self.assertEqual(len(resample(audio, 44100, 48000)), 1088)
+        self.assertIs(resample(audio, 44100, 44100), audio)
+
+    def test_normalize_format(self):
+        self.assertEqual(normalize_format('WAV'), 'wav')
+        self.assertEqual(normalize_format(None), 'wav')
+        self.assertEqual(normalize_format('opus'), 'ogg')
+        self.assertIsNone(normalize_format('aac'))
+
+    def test_lossless_encoding_round_trips(self):
+        audio = sine(440, 0.5, 44100)
+        for output_format in ('wav', 'flac'):
+            with self.subTest(output_format=output_format):
+                decoded, sampling_rate = sf.read(io.BytesIO(encode_audio(audio, 44100, output_format)), dtype='float32')
+                self.assertEqual(sampling_rate, 44100)
+                np.testing.assert_allclose(decoded, audio, atol=1 / 32768)
+
+    def test_lossy_encoding_uses_a_supported_sampling_rate_and_quality(self):
+        if 'ogg' not in available_formats():
+            self.skipTest("この環境の libsndfile は Opus に対応していません")
+        audio = np.random.default_rng(0).uniform(-0.5, 0.5, (44100, 2)).astype(np.float32)
+        low = encode_audio(audio, 44100, 'ogg', 'low')
+        high = encode_audio(audio, 44100, 'ogg', 'high')
+        info = sf.info(io.BytesIO(high))
+        # Opus は 44.1kHz に対応しないため、それより高い最も近いレートに変換する
+        self.assertEqual(info.samplerate, 48000)
+        self.assertAlmostEqual(info.duration, 1.0, places=2)
+        self.assertGreater(len(high), len(low))
+
+    def test_iter_chunks_splits_without_copying(self):
+        data = bytes(range(10))
+        chunks = list(iter_chunks(data, chunk_size=4))
+        self.assertEqual([bytes(chunk) for chunk in chunks], [data[:4], data[4:8], data[8:]])
+        self.assertTrue(all(isinstance(chunk, memoryview) for chunk in chunks))
+
+
+class DisconnectCancellationTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server_sock, self.client_sock = socket.socketpair()
+        self.addCleanup(self.server_sock.close)
+        self.addCleanup(self.client_sock.close)
+
+    def test_token_is_cancelled_when_the_client_disconnects(self):
+        token = SocketCancellationToken(self.server_sock)
+        self.addCleanup(token.stop)
+        self.assertFalse(token.is_cancelled)
+        self.client_sock.close()
+        wait_until(lambda: token.is_cancelled)
+
+    def test_pipelined_request_data_is_not_consumed_or_treated_as_disconnect(self):
+        token = SocketCancellationToken(self.server_sock)
+        self.addCleanup(token.stop)
+        self.assertFalse(token.is_cancelled)
+        self.client_sock.sendall(b'GET / HTTP/1.1')
+        wait_until(lambda: not token._watcher.is_alive())
+        self.assertFalse(token.is_cancelled)
+        self.assertEqual(self.server_sock.recv(3), b'GET')
+
+    def test_token_that_was_never_checked_does_not_watch(self):
+        token = SocketCancellationToken(self.server_sock)
+        token.stop()
+        self.client_sock.close()
+        self.assertFalse(token.is_cancelled)
+        self.assertIsNone(token._watcher)
+
+    def call_middleware(self, response, sock=None):
+        request = RequestFactory().get('/audio')
+        if sock is not None:
+            request.META['gunicorn.socket'] = sock
+        tokens = []
+
+        def get_response(request):
+            tokens.append(request.generation_cancel_token)
+            return response
+
+        return GenerationCancellationMiddleware(get_response)(request), tokens[0]
+
+    def test_middleware_stops_watching_after_a_regular_response(self):
+        response, token = self.call_middleware(HttpResponse(b'ok'), self.server_sock)
+        self.assertIsInstance(token, SocketCancellationToken)
+        self.assertTrue(token._done.is_set())
+
+    def test_middleware_watches_streaming_responses_until_closed(self):
+        response, token = self.call_middleware(StreamingHttpResponse(iter([b'a', b'b'])), self.server_sock)
+        self.assertFalse(token._done.is_set())
+        self.assertEqual(response_body(response), b'ab')
+        response.close()
+        self.assertTrue(token._done.is_set())
+
+        # 本文を読み始める前に閉じられた場合も監視を終える
+        response, token = self.call_middleware(StreamingHttpResponse(iter([b'a'])), self.server_sock)
+        response.close()
+        self.assertTrue(token._done.is_set())
+
+    def test_middleware_without_a_client_socket_uses_a_plain_token(self):
+        response, token = self.call_middleware(HttpResponse(b'ok'))
+        self.assertIsInstance(token, CancellationToken)
+        self.assertNotIsInstance(token, SocketCancellationToken)
+
+
+def make_plan_user(username, plan_name='test', **plan_fields):
+    """指定したプランを契約しているユーザーを作る"""
+    plan, _ = Plan.objects.get_or_create(
+        name=plan_name, defaults=dict({'display_name': plan_name, 'description': plan_name}, **plan_fields),
+    )
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='password12345')
+    UserSubscription.objects.create(user=user, plan=plan, status='active')
+    return user
+
+
+def make_job(user, created_at=None, **fields):
+    """ジョブを作る（created_at を指定した場合は登録日時を書き換える）"""
+    fields = dict({'prompt': 'rain', 'steps': 100, 'seed': 1, 'plan': user.subscription.plan.name}, **fields)
+    job = GenerationJob.objects.create(user=user, **fields)
+    if created_at is not None:
+        GenerationJob.objects.filter(pk=job.pk).update(created_at=created_at)
+        job.refresh_from_db()
+    return job
+
+
+class JobQueueEstimateTests(TestCase):
+
+    def setUp(self):
+        self.free_user = make_plan_user('free', 'free', priority=1)
+        self.pro_user = make_plan_user('pro', 'pro', priority=4)
+        self.start = django_timezone.now() - timedelta(minutes=10)
+
+    def at(self, seconds):
+        return self.start + timedelta(seconds=seconds)
+
+    def test_position_follows_weighted_fair_order(self):
+        first = make_job(self.free_user, self.at(0))
+        second = make_job(self.free_user, self.at(1))
+        # 重み4のプランのジョブは、先に登録された重み1のプランのジョブより前に実行される
+        pro = make_job(self.pro_user, self.at(2))
+        later_pro = make_job(self.pro_user, self.at(3))
+
+        self.assertEqual(job_queue_estimate(pro)[0], 1)
+        self.assertEqual(job_queue_estimate(later_pro)[0], 2)
+        self.assertEqual(job_queue_estimate(first)[0], 3)
+        self.assertEqual(job_queue_estimate(second)[0], 4)
+
+    def test_only_pending_jobs_are_counted(self):
+        make_job(self.free_user, self.at(0), status=GenerationJob.STATUS_RUNNING)
+        make_job(self.free_user, self.at(1), status=GenerationJob.STATUS_CANCELLED)
+        job = make_job(self.free_user, self.at(2))
+        self.assertEqual(job_queue_estimate(job), (1, None))
+
+    def test_eta_uses_recent_seconds_per_inference_cost(self):
+        # 50 ステップに 10 秒かかった（推論コストあたり 0.2 秒）
+        make_job(
+            self.free_user, self.at(0), steps=50, status=GenerationJob.STATUS_SUCCEEDED,
+            started_at=self.at(0), finished_at=self.at(10),
+        )
+        free = make_job(self.free_user, self.at(20))
+        pro = make_job(self.pro_user, self.at(21))
+        self.assertEqual(job_queue_estimate(pro), (1, 20.0))
+        self.assertEqual(job_queue_estimate(free), (2, 40.0))
+
+
+class GenerationJobFlowTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        for target in ('mainapp.audio.tasks.publish_job_progress', 'mainapp.audio.views.publish_job_progress'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = make_plan_user('jobs', 'jobs', daily_audio_limit=10, max_concurrent_jobs=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_job(self, job, result=None, error=None):
+        """generate_audio を差し替えてジョブを実行する"""
+        generate = mock.Mock(return_value=result or (np.zeros((400, 2), dtype=np.float32), 4000), side_effect=error)
+        with mock.patch('mainapp.audio.tasks.generate_audio', generate), \
+                mock.patch.object(run_generation_job, 'apply_async') as apply_async:
+            run_generation_job(str(job.pk))
+        job.refresh_from_db()
+        return generate, apply_async
+
+    def test_create_returns_accepted_and_queues_the_job(self):
+        with mock.patch.object(run_generation_job, 'delay') as delay:
+            response = self.client.post('/api/audio/jobs/', {'prompt': 'rain', 'steps': 10, 'duration': 1}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = GenerationJob.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, GenerationJob.STATUS_PENDING)
+        self.assertFalse(job.seeded)
+        self.assertEqual(job.plan, 'jobs')
+        delay.assert_called_once_with(str(job.pk))
+
+    def test_successful_job_stores_the_result_and_counts_usage(self):
+        job = make_job(self.user, steps=10, duration=0.1, seeded=False)
+        generate, _ = self.run_job(job)
+
+        self.assertEqual(job.status, GenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(generate.call_args.args[:5], ('rain', job.neg_prompt, 10, 0.1, 1))
+        self.assertEqual(self.user.usage_logs.get().audio_generations, 1)
+        response = self.client.get(f'/api/audio/jobs/{job.pk}/result')
+        self.assertEqual(response.status_code, 200)
+        data = response_body(response)
+        self.assertEqual(audio_checksum(data), job.checksum)
+        self.assertEqual(sf.info(io.BytesIO(data)).samplerate, 4000)
+
+    def test_failed_job_records_the_error(self):
+        job = make_job(self.user, seeded=False)
+        self.run_job(job, error=RuntimeError('boom'))
+        self.assertEqual((job.status, job.error), (GenerationJob.STATUS_FAILED, 'boom'))
+        response = self.client.get(f'/api/audio/jobs/{job.pk}/result')
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(self.user.usage_logs.exists())
+
+    def test_job_over_the_concurrency_limit_is_requeued_without_running(self):
+        make_job(self.user, status=GenerationJob.STATUS_RUNNING)
+        job = make_job(self.user, seeded=False)
+        generate, apply_async = self.run_job(job)
+        generate.assert_not_called()
+        self.assertEqual(job.status, GenerationJob.STATUS_PENDING)
+        apply_async.assert_called_once_with((str(job.pk),), countdown=settings.AUDIO_JOB_REQUEUE_DELAY)
+
+    def test_admission_rejection_returns_the_job_to_pending(self):
+        job = make_job(self.user, seeded=False)
+        _, apply_async = self.run_job(job, error=AdmissionRejected(12))
+        self.assertEqual(job.status, GenerationJob.STATUS_PENDING)
+        self.assertIsNone(job.started_at)
+        apply_async.assert_called_once_with((str(job.pk),), countdown=12)
+
+    def test_cancel_pending_job_and_reject_cancelling_finished_job(self):
+        job = make_job(self.user, seeded=False)
+        response = self.client.delete(f'/api/audio/jobs/{job.pk}/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], GenerationJob.STATUS_CANCELLED)
+
+        # キャンセルされたジョブはワーカーに届いても実行しない
+        generate, _ = self.run_job(job)
+        generate.assert_not_called()
+        self.assertEqual(self.client.delete(f'/api/audio/jobs/{job.pk}/').status_code, 409)
+
+    def test_result_of_unfinished_or_other_users_job(self):
+        job = make_job(self.user, seeded=False)
+        self.assertEqual(self.client.get(f'/api/audio/jobs/{job.pk}/result').status_code, 409)
+        other = APIClient()
+        other.force_authenticate(make_plan_user('other', 'jobs'))
+        self.assertEqual(other.get(f'/api/audio/jobs/{job.pk}/').status_code, 404)
+
+
+class BatchZipTests(TestCase):
+
+    def batch_params(self, index, variation, seed, output_format='wav'):
+        return {
+            'index': index, 'variation': variation, 'seed': seed, 'prompt': f'prompt {index}', 'neg_prompt': 'noise',
+            'duration': 1.0, 'steps': 10, 'tier': '', 'output_format': output_format, 'quality': 'standard',
+        }
+
+    def test_members_are_stored_with_index_variation_seed_names_and_manifest(self):
+        outputs = [self.batch_params(0, 0, 7), self.batch_params(0, 1, 8), self.batch_params(1, 0, 42, 'flac')]
+        results = [(b'first', 'MISS', None, None), (b'second', 'HIT', None, None), (b'third', 'BYPASS', None, None)]
+        library_audios = [SimpleNamespace(id=f'id-{i}') for i in range(3)]
+
+        with zipfile.ZipFile(io.BytesIO(build_batch_zip(outputs, results, library_audios))) as archive:
+            names = ['000_00_7.wav', '000_01_8.wav', '001_00_42.flac']
+            self.assertEqual(archive.namelist(), names + ['manifest.json'])
+            self.assertEqual([archive.read(name) for name in names], [b'first', b'second', b'third'])
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+            manifest = json.loads(archive.read('manifest.json'))
+
+        self.assertEqual([entry['file'] for entry in manifest], names)
+        self.assertEqual([entry['id'] for entry in manifest], ['id-0', 'id-1', 'id-2'])
+        self.assertEqual([entry['cache'] for entry in manifest], ['MISS', 'HIT', 'BYPASS'])
+        self.assertEqual(
+            {key: manifest[2][key] for key in ('index', 'variation', 'prompt', 'seed', 'format', 'quality')},
+            {'index': 1, 'variation': 0, 'prompt': 'prompt 1', 'seed': 42, 'format': 'flac', 'quality': 'standard'},
+        )
+
+    def test_batch_endpoint_returns_every_variation_in_the_zip(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        client = APIClient()
+        client.force_authenticate(make_plan_user('batch'))
+        audios = [sine(220 * (i + 1), 0.25, 4000) for i in range(3)]
+        latents = [np.zeros((4, 8), dtype=np.float32)] * 3
+
+        with override_settings(MEDIA_ROOT=media.name), \
+                mock.patch('mainapp.audio.views.get_result_cache', return_value=AudioResultCache(media.name, 10 ** 6)), \
+                mock.patch('mainapp.audio.views.generate_audio_batch', return_value=(audios, 4000, latents)) as generate:
+            response = client.post('/api/audio/generate/batch/', {'items': [
+                {'prompt': 'rain', 'seed': 5, 'num_waveforms_per_prompt': 2, 'duration': 1, 'steps': 10},
+                {'prompt': 'wind', 'seed': 9, 'duration': 1, 'steps': 10, 'format': 'flac'},
+            ]}, format='json')
+            self.assertEqual(response.status_code, 200)
+            data = response_body(response)
+
+        self.assertEqual([item['seed'] for item in generate.call_args.args[0]], [5, 6, 9])
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            names = ['000_00_5.wav', '000_01_6.wav', '001_00_9.flac']
+            self.assertEqual(archive.namelist(), names + ['manifest.json'])
+            for name, audio_np in zip(names, audios):
+                decoded, sampling_rate = sf.read(io.BytesIO(archive.read(name)), dtype='float32')
+                self.assertEqual(sampling_rate, 4000)
+                np.testing.assert_allclose(decoded, audio_np, atol=1e-4)
+            manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual([entry['prompt'] for entry in manifest], ['rain', 'rain', 'wind'])
+        self.assertEqual(response['X-Usage-Count'], '3')
+
+
+class DownloadPermissionTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def client_with_library_audio(self, username, can_download):
+        user = make_plan_user(username, f'download-{can_download}', can_download=can_download)
+        params = {
+            'prompt': 'rain', 'neg_prompt': '', 'duration': 1.0, 'steps': 10, 'seed': 3,
+            'output_format': 'wav', 'quality': 'standard', 'tier': '',
+        }
+        audio = save_to_library(user, params, bytes(encode_audio(sine(440, 0.1, 4000), 4000)), analysis={})
+        client = APIClient()
+        client.force_authenticate(user)
+        return client, audio
+
+    def test_download_and_signed_url_require_can_download(self):
+        client, audio = self.client_with_library_audio('nodownload', False)
+        response = client.get(f'/api/audio/library/{audio.id}/download')
+        self.assertEqual(response.status_code, 403)
+        self.assertIsNone(client.get(f'/api/audio/library/{audio.id}/').data['signed_url'])
+
+    def test_plan_with_can_download_gets_file_and_signed_url(self):
+        client, audio = self.client_with_library_audio('download', True)
+        response = client.get(f'/api/audio/library/{audio.id}/download')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(audio_checksum(response_body(response)), audio.checksum)
+
+        signed_url = client.get(f'/api/audio/library/{audio.id}/').data['signed_url']
+        response = APIClient().get(signed_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(audio_checksum(response_body(response)), audio.checksum)
+
+
+class AnalysisTests(SimpleTestCase):
+
+    def read_level(self, data, level):
+        """波形ピークのバイナリから1つの解像度の (min, max) を取り出す"""
+        values = np.frombuffer(data, dtype='<f2', count=level['count'] * 2, offset=level['offset'])
+        return values.reshape(-1, 2).astype(np.float32)
+
+    def test_peaks_levels_are_laid_out_back_to_back(self):
+        rng = np.random.default_rng(0)
+        audio_np = rng.uniform(-0.5, 0.5, (PEAKS_BASE_BLOCK * 300, 2)).astype(np.float32)
+        metadata, data = analyze_audio(audio_np, 48000)
+
+        levels = metadata['peaks']['levels']
+        self.assertEqual(metadata['peaks']['format'], 'float16-le')
+        self.assertEqual(levels, [
+            {'samples_per_peak': 256, 'count': 300, 'offset': 0},
+            {'samples_per_peak': 1024, 'count': 75, 'offset': 300 * 4},
+        ])
+        self.assertEqual(len(data), (300 + 75) * 4)
+
+        # 全チャンネルをまとめた包絡の min / max が [min0, max0, min1, max1, ...] の順に並ぶ
+        for level in levels:
+            blocks = audio_np.reshape(level['count'], level['samples_per_peak'] * 2)
+            expected = np.stack([blocks.min(axis=1), blocks.max(axis=1)], axis=1)
+            np.testing.assert_allclose(self.read_level(data, level), expected, atol=1e-3)
+
+    def test_peak_levels_pad_partial_blocks(self):
+        lows = -np.arange(1, 258, dtype=np.float32)
+        highs = np.arange(1, 258, dtype=np.float32)
+        levels = peak_levels(lows, highs)
+        # 65 点の次は PEAKS_MIN_COUNT を下回るので作らない
+        self.assertEqual([(samples, len(level_lows)) for samples, level_lows, _ in levels], [(256, 257), (1024, 65)])
+        self.assertEqual((levels[1][1][0], levels[1][2][0]), (-4, 4))
+        # 端数のブロックは残りの値だけで集約する
+        self.assertEqual((levels[1][1][-1], levels[1][2][-1]), (-257, 257))
+
+    def test_empty_and_silent_input(self):
+        metadata, data = analyze_audio(np.zeros((0, 2), dtype=np.float32), 48000)
+        self.assertEqual(data, b'')
+        self.assertEqual(metadata['peaks']['levels'], [{'samples_per_peak': 256, 'count': 0, 'offset': 0}])
+        self.assertEqual((metadata['duration'], metadata['loudness_lufs'], metadata['silences']), (0.0, None, []))
+
+        metadata, data = analyze_audio(np.zeros((48000, 2), dtype=np.float32), 48000)
+        self.assertIsNone(metadata['loudness_lufs'])
+        self.assertEqual((metadata['rms_db'], metadata['sample_peak_db'], metadata['true_peak_db']), (-120, -120, -120))
+        self.assertEqual(metadata['silences'], [[0.0, 1.0]])
+        self.assertFalse(self.read_level(data, metadata['peaks']['levels'][0]).any())
+
+    def test_input_shorter_than_one_peak_block(self):
+        audio_np = sine(1000, 100 / 48000, 48000)
+        metadata, data = analyze_audio(audio_np, 48000)
+        level, = metadata['peaks']['levels']
+        self.assertEqual((level['count'], len(data)), (1, 4))
+        np.testing.assert_allclose(self.read_level(data, level), [[audio_np.min(), audio_np.max()]], atol=1e-3)
+        self.assertIsNotNone(metadata['loudness_lufs'])
+
+    def test_loudness_and_true_peak_of_known_sines(self):
+        # 両チャンネルに振幅 0.5 の 1kHz の正弦波: -6.02 dBFS のピーク、BS.1770 で -6.02 LUFS
+        metadata, _ = analyze_audio(sine(1000, 3.0, 48000, amplitude=0.5), 48000)
+        self.assertAlmostEqual(metadata['loudness_lufs'], -6.02, delta=0.1)
+        self.assertAlmostEqual(metadata['sample_peak_db'], -6.02, delta=0.05)
+        self.assertAlmostEqual(metadata['true_peak_db'], -6.02, delta=0.05)
+        self.assertAlmostEqual(metadata['rms_db'], -9.03, delta=0.05)
+
+        # fs/4 で位相が 45° ずれた正弦波はサンプルがピークの 1/√2 にしか届かないが、トゥルーピークは振幅になる
+        t = np.arange(48000)
+        audio_np = (0.5 * np.sin(2 * np.pi * t / 4 + np.pi / 4)).astype(np.float32)[:, None]
+        metadata, _ = analyze_audio(audio_np, 48000)
+        self.assertAlmostEqual(metadata['sample_peak_db'], -9.03, delta=0.05)
+        self.assertAlmostEqual(metadata['true_peak_db'], -6.02, delta=0.1)
+
+
+def no_source(source_id):
+    raise AssertionError('source is not used')
+
+
+class EditingTests(SimpleTestCase):
+
+    def edit(self, audio_np, *operations):
+        return apply_edits(audio_np, 4000, list(operations), no_source, max_duration=60)
+
+    def test_normalize_to_target_loudness(self):
+        audio_np = sine(1000, 2.0, 48000, amplitude=0.05)
+        edited = apply_edits(audio_np, 48000, [{'op': 'normalize', 'lufs': -14}], no_source, max_duration=60)
+        self.assertAlmostEqual(measure_loudness(edited, 48000), -14.0, delta=0.05)
+        # 無音は基準がないのでそのまま返す
+        silent = np.zeros((4000, 2), dtype=np.float32)
+        np.testing.assert_array_equal(self.edit(silent, {'op': 'normalize', 'lufs': -14}), silent)
+
+    def test_fades_start_and_end_at_the_clip_boundaries(self):
+        audio_np = np.ones((4000, 2), dtype=np.float32)
+        edited = self.edit(audio_np, {'op': 'fade', 'in': 0.25, 'out': 0.5})
+        fade_in, _ = fade_curves(1000, 'linear')
+        _, fade_out = fade_curves(2000, 'linear')
+        np.testing.assert_allclose(edited[:1000, 0], fade_in)
+        np.testing.assert_allclose(edited[-2000:, 1], fade_out)
+        np.testing.assert_array_equal(edited[1000:2000], 1.0)
+        self.assertLess(edited[0, 0], 0.001)
+        self.assertLess(edited[-1, 0], 0.001)
+
+        # 音声より長いフェードは音声全体にかかる
+        edited = self.edit(audio_np, {'op': 'fade', 'in': 5, 'curve': 'equal_power'})
+        np.testing.assert_allclose(edited[:, 0], fade_curves(4000, 'equal_power')[0], rtol=1e-6)
+
+    def test_invalid_trims_raise_edit_error(self):
+        audio_np = sine(440, 1.0, 4000)
+        for op in (
+            {'op': 'trim', 'start': -1},
+            {'op': 'trim', 'start': 0.5, 'end': 0.5},
+            {'op': 'trim', 'start': 'a'},
+            {'op': 'trim', 'start': 2},
+            {'op': 'unknown'},
+        ):
+            with self.subTest(op=op), self.assertRaises(EditError):
+                self.edit(audio_np, op)
+        self.assertEqual(len(self.edit(audio_np, {'op': 'trim', 'start': 0.25, 'end': 0.75})), 2000)
+
+
+class AudioEditViewTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def post_edit(self, username, can_edit_audio, operations):
+        user = make_plan_user(username, f'edit-{can_edit_audio}', can_edit_audio=can_edit_audio)
+        params = {
+            'prompt': 'rain', 'neg_prompt': '', 'duration': 1.0, 'steps': 10, 'seed': 3,
+            'output_format': 'wav', 'quality': 'standard', 'tier': '',
+        }
+        audio = save_to_library(user, params, bytes(encode_audio(sine(440, 1.0, 4000), 4000)), analysis={})
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(f'/api/audio/library/{audio.id}/edit', {'operations': operations}, format='json')
+
+    def test_plan_without_editing_is_forbidden(self):
+        response = self.post_edit('noedit', False, [{'op': 'trim', 'start': 0, 'end': 0.5}])
+        self.assertEqual(response.status_code, 403)
+
+    def test_edit_returns_edited_audio_or_bad_request(self):
+        response = self.post_edit('edit', True, [{'op': 'trim', 'start': 0, 'end': 0.5}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Audio-Duration'], '0.500')
+        self.assertEqual(sf.info(io.BytesIO(response_body(response))).frames, 2000)
+
+        response = self.post_edit('badtrim', True, [{'op': 'trim', 'start': 0.8, 'end': 0.2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('trim', response.data['detail'])
+
+
+def make_cosine_scheduler():
+    return CosineDPMSolverODEScheduler(
+        solver_order=2, prediction_type='v_prediction', sigma_data=1.0, sigma_schedule='exponential',
+    )
+
+
+class RefineSamplingTests(SimpleTestCase):
+
+    def test_refine_start_step_runs_the_last_strength_fraction(self):
+        self.assertEqual(refine_start_step(10, None), 0)
+        self.assertEqual(refine_start_step(10, 1.0), 0)
+        self.assertEqual(refine_start_step(10, 0.5), 5)
+        self.assertEqual(refine_start_step(10, 0.25), 7)
+        # strength が小さくても最低1ステップは実行する
+        self.assertEqual(refine_start_step(10, 0.01), 9)
+
+    def test_truncate_schedule_drops_leading_steps(self):
+        full = make_cosine_scheduler()
+        full.set_timesteps(10)
+        scheduler = truncate_schedule(make_cosine_scheduler(), 4)
+        scheduler.set_timesteps(10)
+        torch.testing.assert_close(scheduler.timesteps, full.timesteps[4:])
+        torch.testing.assert_close(scheduler.sigmas, full.sigmas[4:])
+        self.assertEqual(len(scheduler.timesteps), 6)
+
+        untouched = make_cosine_scheduler()
+        self.assertIs(truncate_schedule(untouched, 0), untouched)
+        self.assertNotIn('set_timesteps', untouched.__dict__)
+
+    def test_refine_latents_noises_to_the_start_sigma_and_divides_by_init_noise_sigma(self):
+        pipe = SimpleNamespace(scheduler=truncate_schedule(make_cosine_scheduler(), 5))
+        init_latents = torch.linspace(-1, 1, 2 * 4 * 8).reshape(2, 4, 8)
+
+        def generators():
+            return [torch.Generator().manual_seed(seed) for seed in (1, 2)]
+
+        latents = refine_latents(pipe, 10, init_latents, generators())
+        sigma = pipe.scheduler.sigmas[0].item()
+        noise = torch.stack([torch.randn((4, 8), generator=generator) for generator in generators()])
+        torch.testing.assert_close(latents * pipe.scheduler.init_noise_sigma, init_latents + sigma * noise)
+        self.assertGreater(pipe.scheduler.init_noise_sigma, sigma)
+
+        # 同じシード値なら同じ初期潜在表現になる
+        torch.testing.assert_close(refine_latents(pipe, 10, init_latents, generators()), latents)
+
+
+class RenderTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.user = make_plan_user('render')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def library_audio(self, latents=None):
+        params = {
+            'prompt': 'rain', 'neg_prompt': '', 'duration': 1.0, 'steps': 10, 'seed': 3,
+            'output_format': 'wav', 'quality': 'standard', 'tier': '',
+        }
+        data = bytes(encode_audio(sine(440, 1.0, 4000), 4000))
+        return save_to_library(self.user, params, data, analysis={}, latents=latents)
+
+    def render(self, audio, decode):
+        with mock.patch('mainapp.audio.views.decode_latents', decode):
+            return self.client.post(f'/api/audio/library/{audio.id}/render', {'format': 'flac'}, format='json')
+
+    def test_render_decodes_saved_latents_with_the_users_requester(self):
+        latents = np.ones((4, 8), dtype=np.float32)
+        audio = self.library_audio(pack_latents(latents))
+        decode = mock.Mock(return_value=(sine(440, 1.0, 4000), 4000))
+        response = self.render(audio, decode)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sf.info(io.BytesIO(response_body(response))).format, 'FLAC')
+        (decoded_latents, duration), kwargs = decode.call_args
+        np.testing.assert_array_equal(decoded_latents, latents)
+        self.assertEqual(duration, 1.0)
+        self.assertEqual(kwargs['requester']['user'], str(self.user.pk))
+
+    def test_render_errors_use_the_generation_error_responses(self):
+        audio = self.library_audio(pack_latents(np.ones((4, 8), dtype=np.float32)))
+        response = self.render(audio, mock.Mock(side_effect=AdmissionRejected(5)))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(self.render(audio, mock.Mock(side_effect=RuntimeError('boom'))).status_code, 500)
+
+    def test_render_without_latents_is_rejected(self):
+        decode = mock.Mock()
+        self.assertEqual(self.render(self.library_audio(), decode).status_code, 400)
+        decode.assert_not_called()
+
+    def test_local_decode_goes_through_admission(self):
+        controller = AdmissionController(max_cost=1, max_queue=0)
+        requester = make_test_requester('a')
+        pipe = SimpleNamespace(
+            device='cpu', vae=SimpleNamespace(dtype=torch.float32, sampling_rate=4000),
+        )
+        with mock.patch('mainapp.audio.pipeline.get_admission_controller', return_value=controller), \
+                mock.patch('mainapp.audio.pipeline.get_audio_pipeline', return_value=pipe), \
+                mock.patch('mainapp.audio.pipeline._decode_latents', return_value=torch.zeros(1, 2, 16)) as decode:
+            audio_np, sampling_rate = decode_latents_local(np.zeros((4, 8), dtype=np.float32), 1.0, requester=requester)
+            self.assertEqual((audio_np.shape, sampling_rate), ((16, 2), 4000))
+            self.assertEqual(controller.stats()['in_flight'], 0)
+            self.assertEqual(controller.stats()['admitted'], 1)
+
+            # 枠が埋まっていて待ち行列もなければ、VAE を使わずに断る
+            controller.acquire(DECODE_COST)
+            with self.assertRaises(AdmissionRejected):
+                decode_latents_local(np.zeros((4, 8), dtype=np.float32), 1.0, requester=requester)
+        self.assertEqual(decode.call_count, 1)
@@ -1,6 +1,46 @@
 from django.urls import path
-from .views import AudioGenerateView
- 
+from .views import (
+    AudioGenerateView,
+    AudioDraftGenerateView,
+    AudioLongFormGenerateView,
+    AudioBatchGenerateView,
+    GenerationJobCreateView,
+    GenerationJobDetailView,
+    GenerationJobResultView,
+    GeneratedAudioListView,
+    GeneratedAudioDetailView,
+    GeneratedAudioDownloadView,
+    GeneratedAudioPeaksView,
+    GeneratedAudioEditView,
+    GeneratedAudioRefineView,
+    GeneratedAudioRenderView,
+    SignedAudioDownloadView,
+    AudioStatsView,
+    generation_job_events,
+)
+
 urlpatterns = [
     path('generate/', AudioGenerateView.as_view(), name='audio-generate'),
-] 
\ No newline at end of file
+    path('generate/draft/', AudioDraftGenerateView.as_view(), name='audio-generate-draft'),
+    path('generate/long/', AudioLongFormGenerateView.as_view(), name='audio-generate-long'),
+    path('generate/batch/', AudioBatchGenerateView.as_view(), name='audio-generate-batch'),
+
+    # ── 非同期生成ジョブ ──
+    path('jobs/', GenerationJobCreateView.as_view(), name='audio-job-create'),
+    path('jobs/<uuid:job_id>/', GenerationJobDetailView.as_view(), name='audio-job-detail'),
+    path('jobs/<uuid:job_id>/result', GenerationJobResultView.as_view(), name='audio-job-result'),
+    path('jobs/<uuid:job_id>/events', generation_job_events, name='audio-job-events'),
+
+    # ── 生成音声ライブラリ ──
+    path('library/', GeneratedAudioListView.as_view(), name='audio-library-list'),
+    path('library/<uuid:audio_id>/', GeneratedAudioDetailView.as_view(), name='audio-library-detail'),
+    path('library/<uuid:audio_id>/download', GeneratedAudioDownloadView.as_view(), name='audio-library-download'),
+    path('library/<uuid:audio_id>/peaks', GeneratedAudioPeaksView.as_view(), name='audio-library-peaks'),
+    path('library/<uuid:audio_id>/edit', GeneratedAudioEditView.as_view(), name='audio-library-edit'),
+    path('library/<uuid:audio_id>/refine', GeneratedAudioRefineView.as_view(), name='audio-library-refine'),
+    path('library/<uuid:audio_id>/render', GeneratedAudioRenderView.as_view(), name='audio-library-render'),
+    path('files/<str:token>', SignedAudioDownloadView.as_view(), name='audio-signed-download'),
+
+    # ── 監視用 ──
+    path('stats/', AudioStatsView.as_view(), name='audio-stats'),
+]
\ No newline at end of file
@@ -0,0 +1,134 @@
+from datetime import date
+from django.db.models import F
+from mainapp.billing.models import UserSubscription, Plan, UsageLog
+
+def get_user_plan_limits(user):
+    """ユーザーのプラン制限を取得"""
+    try:
+        subscription = user.subscription
+        if subscription.is_active:
+            plan = subscription.plan
+            return {
+                'daily_audio_limit': plan.daily_audio_limit,
+                'max_audio_duration': plan.max_audio_duration,
+                'max_steps': plan.max_steps,
+                'max_audio_quality': plan.max_audio_quality,
+                'max_generation_tier': plan.max_generation_tier,
+                'plan': plan.name,
+                'priority': plan.priority,
+                'max_concurrent_jobs': plan.max_concurrent_jobs,
+                'can_use_api': plan.can_use_api,
+                'can_download': plan.can_download,
+                'can_edit_audio': plan.can_edit_audio,
+            }
+    except UserSubscription.DoesNotExist:
+        pass
+
+    # デフォルトプラン（無料プラン）の制限
+    default_plan = Plan.objects.filter(is_active=True, price=0).first()
+    if default_plan:
+        return {
+            'daily_audio_limit': default_plan.daily_audio_limit,
+            'max_audio_duration': default_plan.max_audio_duration,
+            'max_steps': default_plan.max_steps,
+            'max_audio_quality': default_plan.max_audio_quality,
+            'max_generation_tier': default_plan.max_generation_tier,
+            'plan': default_plan.name,
+            'priority': default_plan.priority,
+            'max_concurrent_jobs': default_plan.max_concurrent_jobs,
+            'can_use_api': default_plan.can_use_api,
+            'can_download': default_plan.can_download,
+            'can_edit_audio': default_plan.can_edit_audio,
+        }
+
+    # フォールバック
+    return {
+        'daily_audio_limit': 20,
+        'max_audio_duration': 30,
+        'max_steps': 200,
+        'max_audio_quality': 'standard',
+        'max_generation_tier': 'standard',
+        'plan': 'default',
+        'priority': 1,
+        'max_concurrent_jobs': 1,
+        'can_use_api': False,
+        'can_download': True,
+        'can_edit_audio': False,
+    }
+
+def check_usage_limit(user):
+    """使用量制限をチェック"""
+    today = date.today()
+
+    # 使用量ログを取得または作成
+    usage_log, created = UsageLog.objects.get_or_create(
+        user=user,
+        date=today,
+        defaults={
+            'audio_generations': 0,
+            'api_calls': 0,
+            'total_duration': 0
+        }
+    )
+
+    # プラン制限を取得
+    limits = get_user_plan_limits(user)
+    daily_limit = limits['daily_audio_limit']
+
+    # 制限チェック
+    if usage_log.audio_generations >= daily_limit:
+        return False, usage_log.audio_generations, daily_limit
+
+    return True, usage_log.audio_generations, daily_limit
+
+def increment_usage(user, duration=0):
+    """使用量を増加"""
+    today = date.today()
+    usage_log, created = UsageLog.objects.get_or_create(
+        user=user,
+        date=today,
+        defaults={
+            'audio_generations': 0,
+            'api_calls': 0,
+            'total_duration': 0
+        }
+    )
+
+    usage_log.audio_generations += 1
+    usage_log.total_duration += duration
+    usage_log.save()
+
+    return usage_log
+
+def charge_usage(user, generations, duration, daily_limit):
+    """
+    1日の上限を超えない場合だけ、使用量をまとめて加算する
+    - 条件付きの UPDATE 1回で確認と加算を行うため、同時リクエストがあっても上限を超えない
+    - 戻り値: (加算できたかどうか, 使用量ログ)
+    """
+    today = date.today()
+    usage_log, created = UsageLog.objects.get_or_create(
+        user=user,
+        date=today,
+        defaults={
+            'audio_generations': 0,
+            'api_calls': 0,
+            'total_duration': 0
+        }
+    )
+
+    charged = UsageLog.objects.filter(
+        pk=usage_log.pk, audio_generations__lte=daily_limit - generations,
+    ).update(
+        audio_generations=F('audio_generations') + generations,
+        total_duration=F('total_duration') + duration,
+    )
+    usage_log.refresh_from_db()
+    return bool(charged), usage_log
+
+def refund_usage(usage_log, generations, duration):
+    """charge_usage で加算した使用量を戻す（生成に失敗した場合）"""
+    UsageLog.objects.filter(pk=usage_log.pk).update(
+        audio_generations=F('audio_generations') - generations,
+        total_duration=F('total_duration') - duration,
+    )
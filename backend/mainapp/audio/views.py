@@ -1,39 +1,67 @@
+import asyncio
+import io
+import json
+import zipfile
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.core.exceptions import ValidationError
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework import status
 from django.utils import timezone
 from django.core.cache import cache
 from django.conf import settings
-import os
-import tempfile
-import torch
-import soundfile as sf
-from diffusers import StableAudioPipeline
+import random
 # from pydub import AudioSegment
 from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from mainapp.billing.models import Plan
 from mainapp.users.models import User
-from mainapp.billing.models import UserSubscription, Plan, UsageLog
-from datetime import date
-
-# グローバルでモデルを一度だけ初期化（キャッシュして使い回し）
-_pipe = None
-
-def get_audio_pipeline():
-    """モデルを一度だけ初期化してキャッシュする"""
-    global _pipe
-    if _pipe is None:
-        print("Initializing StableAudioPipeline...")
-        _pipe = StableAudioPipeline.from_pretrained(
-            "stabilityai/stable-audio-open-1.0",
-            torch_dtype=torch.float16,
-            cache_dir="./model_cache"  # モデルをローカルにキャッシュ
-        )
-        _pipe = _pipe.to("cuda" if torch.cuda.is_available() else "cpu")
-        print("StableAudioPipeline initialized successfully!")
-    return _pipe
+from .admission import AdmissionRejected, inference_cost, make_requester, summarize_waits
+from .analysis import submit_analysis, submit_encoded_analysis
+from .batching import GenerationCancelled
+from .cache import get_result_cache, latents_cache_key, make_cache_key
+from .delivery import SIGNED_KIND_JOB, SIGNED_KIND_LIBRARY, load_signed_token, stored_audio_response
+from .editing import EditError, apply_edits, open_stored_audio
+from .encoding import (
+    OUTPUT_FORMATS,
+    QUALITY_LEVELS,
+    audio_streaming_response,
+    available_formats,
+    iter_chunks,
+    normalize_format,
+    submit_encode,
+)
+from .idempotency import (
+    MAX_KEY_LENGTH,
+    IdempotencyConflict,
+    claim_idempotency_key,
+    finish_idempotency_key,
+    request_fingerprint,
+)
+from .ipc import InferenceServerError
+from .library import load_latents, pack_latents, save_to_library
+from .longform import fit_length, pcm16_bytes, plan_windows, stitch_windows, total_frames, wav_header, window_frames
+from .models import GeneratedAudio, GenerationJob
+from .pipeline import decode_latents, generate_audio, generate_audio_batch, get_inference_stats
+from .progress import get_progress_bus, publish_job_progress
+from .sampling import GENERATION_TIERS, get_tier, refine_start_step
+from .serializers import GeneratedAudioSerializer, GenerationJobSerializer
+from .singleflight import get_single_flight
+from .tasks import run_generation_job
+from .usage import get_user_plan_limits, check_usage_limit, increment_usage, charge_usage, refund_usage
+
+MAX_SEED = 2**32 - 1
+
+# クライアントが応答を待たずに切断した場合のステータスコード（nginx の慣例）
+CLIENT_CLOSED_REQUEST = 499
 
 class ApiKeyAuthentication(BaseAuthentication):
     def authenticate(self, request):
@@ -46,174 +74,1269 @@ class ApiKeyAuthentication(BaseAuthentication):
         except User.DoesNotExist:
             return None
 
-def get_user_plan_limits(user):
-    """ユーザーのプラン制限を取得"""
-    try:
-        subscription = user.subscription
-        if subscription.is_active:
-            plan = subscription.plan
-            return {
-                'daily_audio_limit': plan.daily_audio_limit,
-                'max_audio_duration': plan.max_audio_duration,
-                'max_steps': plan.max_steps,
-                'can_use_api': plan.can_use_api,
-                'can_download': plan.can_download,
-                'can_edit_audio': plan.can_edit_audio,
-            }
-    except UserSubscription.DoesNotExist:
-        pass
-    
-    # デフォルトプラン（無料プラン）の制限
-    default_plan = Plan.objects.filter(is_active=True, price=0).first()
-    if default_plan:
-        return {
-            'daily_audio_limit': default_plan.daily_audio_limit,
-            'max_audio_duration': default_plan.max_audio_duration,
-            'max_steps': default_plan.max_steps,
-            'can_use_api': default_plan.can_use_api,
-            'can_download': default_plan.can_download,
-            'can_edit_audio': default_plan.can_edit_audio,
-        }
-    
-    # フォールバック
+def parse_generation_params(data, limits, long_form=False):
+    """
+    リクエストから生成パラメータを取り出し、プラン制限をチェックする
+    - long_form が False の場合、モデルが一度に生成できる長さ（AUDIO_LONGFORM_WINDOW）を超える音声長は受け付けない
+    - 戻り値: (params, error_response) のどちらか一方が None
+    """
+    prompt = data.get('prompt')
+    duration = float(data.get('duration', 5.0))
+    steps = int(data.get('steps', 100))
+    neg_prompt = data.get('neg_prompt', 'Low quality.')
+    seed = data.get('seed')
+    tier = data.get('tier') or ''
+
+    if not prompt:
+        return None, Response({"detail": "promptは必須です。"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # シード値は任意。指定された場合は同じパラメータで同じ音声が生成される
+    if seed is not None and seed != '':
+        try:
+            seed = int(seed)
+        except (TypeError, ValueError):
+            seed = -1
+        if not 0 <= seed <= MAX_SEED:
+            return None, Response({
+                "detail": f"seedは0〜{MAX_SEED}の整数で指定してください。",
+            }, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        seed = None
+
+    # 出力フォーマットと品質のチェック（品質はプランごとに上限あり）
+    output_format, quality, error_response = parse_output_params(data, limits)
+    if error_response is not None:
+        return None, error_response
+
+    # 生成ティアのチェック（指定した場合はステップ数もティアで決まる。選択できる上限はプランごと）
+    if tier:
+        if tier not in GENERATION_TIERS:
+            return None, Response({
+                "detail": f"tierは{', '.join(GENERATION_TIERS)}のいずれかを指定してください。",
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if GENERATION_TIERS.index(tier) > GENERATION_TIERS.index(limits['max_generation_tier']):
+            return None, Response({
+                "detail": f"現在のプランで選択できる生成ティアは{limits['max_generation_tier']}までです。",
+                "requested_tier": tier,
+                "max_tier": limits['max_generation_tier']
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        steps = get_tier(tier)['steps']
+
+    # 音声長の制限チェック
+    if duration > limits['max_audio_duration']:
+        return None, Response({
+            "detail": f"音声長は最大{limits['max_audio_duration']}秒までです。",
+            "requested_duration": duration,
+            "max_duration": limits['max_audio_duration']
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # 一度に生成できる長さを超える場合は、ウィンドウをつなぐ長尺生成を使ってもらう
+    if not long_form and duration > settings.AUDIO_LONGFORM_WINDOW:
+        return None, Response({
+            "detail": f"{settings.AUDIO_LONGFORM_WINDOW}秒を超える音声は /api/audio/generate/long/ で生成してください。",
+            "requested_duration": duration,
+            "max_duration": settings.AUDIO_LONGFORM_WINDOW
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # ステップ数の制限チェック
+    if steps > limits['max_steps']:
+        return None, Response({
+            "detail": f"ステップ数は最大{limits['max_steps']}までです。",
+            "requested_steps": steps,
+            "max_steps": limits['max_steps']
+        }, status=status.HTTP_400_BAD_REQUEST)
+
     return {
-        'daily_audio_limit': 20,
-        'max_audio_duration': 30,
-        'max_steps': 200,
-        'can_use_api': False,
-        'can_download': True,
-        'can_edit_audio': False,
-    }
-
-def check_usage_limit(user):
-    """使用量制限をチェック"""
-    today = date.today()
-    
-    # 使用量ログを取得または作成
-    usage_log, created = UsageLog.objects.get_or_create(
-        user=user,
-        date=today,
-        defaults={
-            'audio_generations': 0,
-            'api_calls': 0,
-            'total_duration': 0
-        }
-    )
-    
-    # プラン制限を取得
-    limits = get_user_plan_limits(user)
-    daily_limit = limits['daily_audio_limit']
-    
-    # 制限チェック
-    if usage_log.audio_generations >= daily_limit:
-        return False, usage_log.audio_generations, daily_limit
-    
-    return True, usage_log.audio_generations, daily_limit
-
-def increment_usage(user, duration=0):
-    """使用量を増加"""
-    today = date.today()
-    usage_log, created = UsageLog.objects.get_or_create(
-        user=user,
-        date=today,
-        defaults={
-            'audio_generations': 0,
-            'api_calls': 0,
-            'total_duration': 0
-        }
-    )
-    
-    usage_log.audio_generations += 1
-    usage_log.total_duration += duration
-    usage_log.save()
-    
-    return usage_log
+        'prompt': prompt,
+        'neg_prompt': neg_prompt,
+        'steps': steps,
+        'duration': duration,
+        'seed': seed,
+        'output_format': output_format,
+        'quality': quality,
+        'tier': tier,
+    }, None
+
+def parse_output_params(data, limits):
+    """
+    リクエストから出力フォーマットと品質を取り出し、プラン制限をチェックする
+    - 品質は非可逆フォーマット（ogg / mp3）のビットレートにだけ効くため、可逆フォーマット（wav / flac）では
+      指定を無視して standard とする（プランの品質の上限もかからず、キャッシュのキーも品質によらず同じになる）
+    - 戻り値: (output_format, quality, error_response)
+    """
+    output_format = normalize_format(data.get('format', 'wav'))
+    quality = data.get('quality', 'standard')
+
+    if output_format is None:
+        return None, None, Response({
+            "detail": f"formatは{', '.join(available_formats())}のいずれかを指定してください。",
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if not OUTPUT_FORMATS[output_format]['lossy']:
+        return output_format, 'standard', None
+
+    if quality not in QUALITY_LEVELS:
+        return None, None, Response({
+            "detail": f"qualityは{', '.join(QUALITY_LEVELS)}のいずれかを指定してください。",
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if QUALITY_LEVELS.index(quality) > QUALITY_LEVELS.index(limits['max_audio_quality']):
+        return None, None, Response({
+            "detail": f"現在のプランで選択できる品質は{limits['max_audio_quality']}までです。",
+            "requested_quality": quality,
+            "max_quality": limits['max_audio_quality']
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    return output_format, quality, None
+
+def usage_limit_response(current_usage, daily_limit):
+    """1日の上限に達したときのレスポンス"""
+    return Response({
+        "detail": f"プランの1日上限（{daily_limit}回）に達しました。",
+        "current_usage": current_usage,
+        "daily_limit": daily_limit
+    }, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+def generation_error_response(error):
+    """
+    生成中に発生した例外をレスポンスに変換する（生成を行うビューで共通）
+    - GenerationCancelled: 499（クライアントは切断済みのため、このレスポンスは送信されない）
+    - AdmissionRejected: 503 と Retry-After（推論の待ち行列が満杯。捌けるまでの見積もり秒数後に再試行してもらう）
+    - InferenceServerError: 503（推論サーバーに接続できない、またはサーバー側で失敗した）
+    - それ以外: 500
+    """
+    if isinstance(error, GenerationCancelled):
+        return Response({"detail": "音声生成はキャンセルされました。"}, status=CLIENT_CLOSED_REQUEST)
+    if isinstance(error, AdmissionRejected):
+        response = Response({
+            "detail": "現在混み合っています。しばらくしてから再度お試しください。",
+            "retry_after": error.retry_after,
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response["Retry-After"] = str(error.retry_after)
+        return response
+    if isinstance(error, InferenceServerError):
+        return Response({"detail": f"推論サーバーエラー: {str(error)}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({"detail": f"音声生成エラー: {str(error)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def idempotent_response(request, handler):
+    """
+    Idempotency-Key ヘッダー付きのリクエストを1回だけ処理する（ヘッダーがなければ handler(request) をそのまま返す）
+    - 処理済みのキーで再送されたリクエストには、生成も使用量の消費もせずに最初の結果（ライブラリの音声）を返す
+    - 処理中のキーは 409、別の内容のリクエストに使われたキーは 422
+    - 処理中のまま AUDIO_IDEMPOTENCY_LOCK_SECONDS を過ぎたキーは、落ちたリクエストのものとして引き継いで処理する
+    - 失敗したリクエスト（X-Audio-Id のないレスポンス）のキーは記録せず、同じキーで再試行できるようにする
+    """
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        return handler(request)
+    if len(key) > MAX_KEY_LENGTH:
+        return Response({
+            "detail": f"Idempotency-Keyは{MAX_KEY_LENGTH}文字以内で指定してください。",
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        record, audio = claim_idempotency_key(request.user, key, request_fingerprint(request.path, request.data))
+    except IdempotencyConflict as e:
+        return Response({"detail": e.detail}, status=e.status_code)
+    if audio is not None:
+        response = library_audio_response(request, audio)
+        response["X-Audio-Id"] = str(audio.id)
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    response = None
+    try:
+        response = handler(request)
+    finally:
+        audio_id = response.get("X-Audio-Id") if response is not None and response.status_code == 200 else None
+        finish_idempotency_key(record, audio_id)
+    return response
 
 # Create your views here.
 
 class AudioGenerateView(APIView):
     authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
     permission_classes = [IsAuthenticated]
+    # 指定した場合はリクエストの tier / steps によらず、このティアで生成する
+    forced_tier = None
 
     def post(self, request):
+        return idempotent_response(request, self.create)
+
+    def create(self, request):
         user = request.user
-        
+
         # 使用量制限をチェック
         can_generate, current_usage, daily_limit = check_usage_limit(user)
         if not can_generate:
+            return usage_limit_response(current_usage, daily_limit)
+
+        # パラメータとプラン制限をチェック
+        limits = get_user_plan_limits(user)
+        params, error_response = parse_generation_params(request.data, limits)
+        if error_response is not None:
+            return error_response
+        # 下書き生成ではティアを固定する（draft は最も軽いティアのため、プランの上限を超えない）
+        if self.forced_tier:
+            params.update(tier=self.forced_tier, steps=get_tier(self.forced_tier)['steps'])
+
+        try:
+            # 結果キャッシュはシード値を指定したリクエストだけに使う（ランダムなシード値の結果は再利用されない）
+            seeded = params['seed'] is not None
+            if not seeded:
+                params['seed'] = random.randint(0, MAX_SEED)
+            seed = params['seed']
+            requester = make_requester(user.pk, limits)
+            cancel_token = getattr(request, 'generation_cancel_token', None)
+
+            # 同じパラメータ・シード値の生成結果があれば、モデルを使わずに返す
+            result_cache = get_result_cache()
+            cache_key = make_cache_key(params) if seeded else None
+            data = result_cache.get(cache_key) if seeded else None
+
+            if data is not None:
+                cache_status = 'HIT'
+                analysis = submit_encoded_analysis(data)
+                latents = result_cache.get(latents_cache_key(cache_key))
+            elif not seeded:
+                cache_status = 'BYPASS'
+                data, analysis, latents = self.generate(params, None, cancel_token, requester)
+            else:
+                # 同じキーの生成が実行中（連打・クライアントの再試行）なら、新しく生成せずにその結果を受け取る
+                # クライアントが切断したら生成を打ち切る（ASGI のみ。相乗りしたリクエストがすべて切断した場合）
+                (data, analysis, latents), coalesced = get_single_flight().run(
+                    cache_key,
+                    lambda shared_token: self.generate(params, cache_key, shared_token, requester),
+                    cancel_token,
+                )
+                cache_status = 'COALESCED' if coalesced else 'MISS'
+
+            # ライブラリに保存し、後から推論なしで再ダウンロードできるようにする
+            # （潜在表現も保存し、リファインや別フォーマットへの再デコードに使う）
+            library_audio = save_to_library(user, params, data, analysis.result(), latents)
+
+            # 使用量を増加
+            usage_log = increment_usage(user, int(params['duration']))
+
+            # エンコード済みのバッファをチャンクごとにストリーミングで返す
+            spec = OUTPUT_FORMATS[params['output_format']]
+            response = audio_streaming_response(data, spec['content_type'], f"audio_{seed}.{spec['extension']}")
+            response["X-Cache"] = cache_status
+            response["X-Audio-Id"] = str(library_audio.id)
+
+            # レスポンスヘッダーに使用量情報を追加
+            response["X-Usage-Count"] = str(usage_log.audio_generations)
+            response["X-Usage-Limit"] = str(daily_limit)
+            response["X-Usage-Remaining"] = str(daily_limit - usage_log.audio_generations)
+
+            return response
+
+        except Exception as e:
+            # キャンセル・混雑・失敗のいずれも使用量は増やさない
+            return generation_error_response(e)
+
+    def generate(self, params, cache_key, cancel_token, requester):
+        """
+        音声を生成してエンコードし、結果キャッシュに保存して (データ, 解析の Future, 潜在表現) を返す
+        - シード値を指定したリクエストはシングルフライトで実行し、同時に届いた同じキーのリクエストにも同じ結果を返す
+        - cache_key が None（シード値の指定なし）なら結果キャッシュには保存しない
+        """
+        audio_np, sampling_rate, latents_np = generate_audio(
+            params['prompt'],
+            params['neg_prompt'],
+            params['steps'],
+            params['duration'],
+            params['seed'],
+            params['tier'] or None,
+            cancel_token=cancel_token,
+            requester=requester,
+            return_latents=True,
+        )
+
+        # 一時ファイルを使わずメモリ上でエンコード（エンコード用スレッドで実行）
+        # 波形ピーク・ラウドネスの解析も同時に進める
+        analysis = submit_analysis(audio_np, sampling_rate)
+        data = submit_encode(
+            audio_np, sampling_rate, params['output_format'], params['quality']
+        ).result()
+        latents = pack_latents(latents_np)
+        if cache_key is not None:
+            result_cache = get_result_cache()
+            result_cache.set(cache_key, data)
+            result_cache.set(latents_cache_key(cache_key), latents)
+        return data, analysis, latents
+
+
+class AudioDraftGenerateView(AudioGenerateView):
+    """
+    下書き生成
+    - POST /api/audio/generate/draft/ : /api/audio/generate/ と同じパラメータを受け付け、draft ティア（少ないステップ数）で生成する
+    - 潜在表現もライブラリに保存されるため、気に入った下書きを /api/audio/library/<id>/refine で仕上げられる
+    """
+    forced_tier = 'draft'
+
+
+class AudioLongFormGenerateView(APIView):
+    """
+    モデルが一度に生成できる長さを超える音声の生成（長尺生成）
+    - POST /api/audio/generate/long/ : /api/audio/generate/ と同じパラメータを受け付ける（出力は wav のみ）
+    - AUDIO_LONGFORM_WINDOW 秒のウィンドウを AUDIO_LONGFORM_OVERLAP 秒ずつ重ねて順に生成し、重なりをクロスフェードでつなぐ
+      （ウィンドウ k のシード値は seed + k。プロンプトの埋め込みは埋め込みキャッシュで全ウィンドウに共有される）
+    - 生成し終えたウィンドウから順に 16bit PCM の WAV としてストリーミングで返す
+      （全体をメモリに持たないため、音声長によらずメモリ使用量は一定）
+    - 使用量はウィンドウの数だけ最初にまとめて消費し、生成できなかったウィンドウの分は戻す
+    - 結果キャッシュとライブラリには保存しない
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+        limits = get_user_plan_limits(user)
+        params, error_response = parse_generation_params(request.data, limits, long_form=True)
+        if error_response is not None:
+            return error_response
+        if params['output_format'] != 'wav':
+            return Response({"detail": "長尺生成の出力フォーマットはwavのみです。"}, status=status.HTTP_400_BAD_REQUEST)
+
+        seed = params['seed'] if params['seed'] is not None else random.randint(0, MAX_SEED)
+        overlap = settings.AUDIO_LONGFORM_OVERLAP
+        windows = plan_windows(params['duration'], settings.AUDIO_LONGFORM_WINDOW, overlap)
+
+        # ウィンドウの数だけ使用量をまとめて消費する
+        daily_limit = limits['daily_audio_limit']
+        charged, usage_log = charge_usage(user, len(windows), int(params['duration']), daily_limit)
+        if not charged:
+            response = usage_limit_response(usage_log.audio_generations, daily_limit)
+            response.data['requested'] = len(windows)
+            return response
+
+        cancel_token = getattr(request, 'generation_cancel_token', None)
+        requester = make_requester(user.pk, limits)
+
+        def generate_window(index):
+            return generate_audio(
+                params['prompt'],
+                params['neg_prompt'],
+                params['steps'],
+                windows[index][1],
+                (seed + index) % (MAX_SEED + 1),
+                params['tier'] or None,
+                cancel_token=cancel_token,
+                requester=requester,
+            )
+
+        # 最初のウィンドウはレスポンスを返す前に生成し、混雑やエラーを通常のステータスコードで返せるようにする
+        try:
+            first, sampling_rate = generate_window(0)
+        except Exception as e:
+            refund_usage(usage_log, len(windows), int(params['duration']))
+            return generation_error_response(e)
+
+        # 全体の長さは先に決まるので、WAV ヘッダーと Content-Length を最初に送れる
+        frames = window_frames(windows, sampling_rate, len(first))
+        overlap_frames = int(overlap * sampling_rate)
+        header = wav_header(total_frames(frames, overlap_frames), first.shape[1], sampling_rate)
+        stream = long_form_stream(
+            header, first, frames, overlap_frames, generate_window,
+            on_finish=lambda generated: self.refund_remaining(usage_log, params, len(windows), generated),
+        )
+        response = StreamingHttpResponse(stream, content_type=OUTPUT_FORMATS['wav']['content_type'])
+        response["Content-Length"] = str(len(header) + total_frames(frames, overlap_frames) * first.shape[1] * 2)
+        response["Content-Disposition"] = f'attachment; filename="audio_{seed}.wav"'
+        response["X-Audio-Seed"] = str(seed)
+        response["X-Long-Form-Windows"] = str(len(windows))
+
+        usage_log.refresh_from_db()
+        response["X-Usage-Count"] = str(usage_log.audio_generations)
+        response["X-Usage-Limit"] = str(daily_limit)
+        response["X-Usage-Remaining"] = str(max(daily_limit - usage_log.audio_generations, 0))
+        return response
+
+    def refund_remaining(self, usage_log, params, count, generated):
+        """切断・キャンセル・エラーで生成できなかったウィンドウの分の使用量を戻す"""
+        if generated < count:
+            refund_usage(usage_log, count - generated, int(params['duration'] * (count - generated) / count))
+
+
+def long_form_stream(header, first, frames, overlap_frames, generate_window, on_finish):
+    """
+    長尺生成の WAV を順に返すジェネレーター
+    - 2つ目以降のウィンドウは、前のウィンドウを送り出してから生成する（クライアントが切断すればそこで止まる）
+    - 終了時（切断を含む）に on_finish(生成したウィンドウ数) を呼ぶ
+    """
+    generated = 1
+
+    def generate_windows():
+        nonlocal generated
+        yield fit_length(first, frames[0])
+        for index in range(1, len(frames)):
+            audio_np, _ = generate_window(index)
+            generated += 1
+            yield fit_length(audio_np, frames[index])
+
+    try:
+        yield header
+        for chunk in stitch_windows(generate_windows(), overlap_frames):
+            yield from iter_chunks(pcm16_bytes(chunk))
+    except GenerationCancelled:
+        # クライアントは切断済みのため、残りは送らない
+        return
+    finally:
+        on_finish(generated)
+
+
+class AudioBatchGenerateView(APIView):
+    """
+    複数プロンプト・複数バリエーションの一括生成
+    - POST /api/audio/generate/batch/ : {"items": [{"prompt": ..., "num_waveforms_per_prompt": 4, ...}, ...]}
+      各アイテムは /api/audio/generate/ と同じパラメータを受け付ける
+    - 同じステップ数・音声長・ティアの音声はまとめてパイプラインに渡される
+    - 結果は音声ファイルと manifest.json をまとめた zip で返す（各音声はライブラリにも保存する）
+    - 使用量は生成する音声の本数分を最初にまとめて消費し、足りなければ何も生成しない
+      （生成に失敗した場合はまとめて戻す）
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+        limits = get_user_plan_limits(user)
+        outputs, error_response = self.parse_items(request.data.get('items'), limits)
+        if error_response is not None:
+            return error_response
+
+        # 本数分の使用量をまとめて消費する
+        daily_limit = limits['daily_audio_limit']
+        total_duration = sum(int(params['duration']) for params in outputs)
+        charged, usage_log = charge_usage(user, len(outputs), total_duration, daily_limit)
+        if not charged:
+            response = usage_limit_response(usage_log.audio_generations, daily_limit)
+            response.data['requested'] = len(outputs)
+            return response
+
+        try:
+            results = self.generate(outputs, request, limits)
+            library_audios = [
+                save_to_library(user, params, data, analysis.result(), latents)
+                for params, (data, _, analysis, latents) in zip(outputs, results)
+            ]
+        except Exception as e:
+            refund_usage(usage_log, len(outputs), total_duration)
+            return generation_error_response(e)
+
+        response = audio_streaming_response(
+            build_batch_zip(outputs, results, library_audios), 'application/zip', 'audio_batch.zip'
+        )
+        usage_log.refresh_from_db()
+        response["X-Usage-Count"] = str(usage_log.audio_generations)
+        response["X-Usage-Limit"] = str(daily_limit)
+        response["X-Usage-Remaining"] = str(max(daily_limit - usage_log.audio_generations, 0))
+        return response
+
+    def parse_items(self, items, limits):
+        """
+        アイテムごとにパラメータとプラン制限をチェックし、バリエーションを1本ずつのパラメータに展開する
+        - シード値を指定した場合、バリエーションは seed, seed + 1, ... で生成する
+        """
+        max_outputs = settings.AUDIO_BATCH_API_MAX_OUTPUTS
+        if not isinstance(items, list) or not items:
+            return None, Response({"detail": "itemsは1件以上のリストで指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+
+        outputs = []
+        for index, data in enumerate(items):
+            if not isinstance(data, dict):
+                return None, Response({
+                    "detail": "itemsの各要素はオブジェクトで指定してください。",
+                    "index": index,
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            params, error_response = parse_generation_params(data, limits)
+            if error_response is not None:
+                error_response.data['index'] = index
+                return None, error_response
+
+            try:
+                count = int(data.get('num_waveforms_per_prompt', 1))
+            except (TypeError, ValueError):
+                count = 0
+            if not 1 <= count <= max_outputs:
+                return None, Response({
+                    "detail": f"num_waveforms_per_promptは1〜{max_outputs}の整数で指定してください。",
+                    "index": index,
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            # シード値を指定したアイテムだけ結果キャッシュを使う
+            seeded = params['seed'] is not None
+            seed = params['seed'] if seeded else random.randint(0, MAX_SEED)
+            for variation in range(count):
+                outputs.append(dict(
+                    params, seed=(seed + variation) % (MAX_SEED + 1), seeded=seeded, index=index, variation=variation,
+                ))
+
+        if len(outputs) > max_outputs:
+            return None, Response({
+                "detail": f"1回のバッチで生成できる音声は最大{max_outputs}本です。",
+                "requested": len(outputs),
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return outputs, None
+
+    def generate(self, outputs, request, limits):
+        """
+        キャッシュにない音声をまとめて生成し、すべてエンコードして (データ, キャッシュ状態, 解析の Future, 潜在表現) のリストを返す
+        - シード値を指定していないアイテムはキャッシュを読み書きしない（キャッシュ状態は BYPASS）
+        """
+        result_cache = get_result_cache()
+        cache_keys = [make_cache_key(params) if params['seeded'] else None for params in outputs]
+        results = [result_cache.get(cache_key) if cache_key else None for cache_key in cache_keys]
+        missing = [i for i, data in enumerate(results) if data is None]
+
+        if missing:
+            audios, sampling_rate, latents = generate_audio_batch(
+                [
+                    {
+                        'prompt': outputs[i]['prompt'],
+                        'neg_prompt': outputs[i]['neg_prompt'],
+                        'steps': outputs[i]['steps'],
+                        'duration': outputs[i]['duration'],
+                        'seed': outputs[i]['seed'],
+                        'tier': outputs[i]['tier'] or None,
+                    }
+                    for i in missing
+                ],
+                cancel_token=getattr(request, 'generation_cancel_token', None),
+                requester=make_requester(request.user.pk, limits),
+                return_latents=True,
+            )
+            # エンコードと解析はエンコード用スレッドで並列に実行する
+            encodes = [
+                submit_encode(audio_np, sampling_rate, outputs[i]['output_format'], outputs[i]['quality'])
+                for i, audio_np in zip(missing, audios)
+            ]
+            analyses = {i: submit_analysis(audio_np, sampling_rate) for i, audio_np in zip(missing, audios)}
+            packed = {i: pack_latents(latents_np) for i, latents_np in zip(missing, latents)}
+            for i, future in zip(missing, encodes):
+                results[i] = future.result()
+                if cache_keys[i]:
+                    result_cache.set(cache_keys[i], results[i])
+                    result_cache.set(latents_cache_key(cache_keys[i]), packed[i])
+        else:
+            analyses, packed = {}, {}
+
+        return [
+            (data, 'MISS' if cache_keys[i] else 'BYPASS', analyses[i], packed[i]) if i in analyses else (
+                data, 'HIT', submit_encoded_analysis(data), result_cache.get(latents_cache_key(cache_keys[i]))
+            )
+            for i, data in enumerate(results)
+        ]
+
+
+def build_batch_zip(outputs, results, library_audios):
+    """
+    一括生成の結果を zip にまとめる（音声は圧縮済みのものが多いため無圧縮で格納する）
+    - manifest.json に各ファイルのパラメータとライブラリのIDを入れる
+    """
+    buffer = io.BytesIO()
+    manifest = []
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for params, (data, cache_status, _, _), library_audio in zip(outputs, results, library_audios):
+            extension = OUTPUT_FORMATS[params['output_format']]['extension']
+            filename = f"{params['index']:03d}_{params['variation']:02d}_{params['seed']}.{extension}"
+            archive.writestr(filename, data)
+            manifest.append({
+                'file': filename,
+                'id': str(library_audio.id),
+                'index': params['index'],
+                'variation': params['variation'],
+                'prompt': params['prompt'],
+                'neg_prompt': params['neg_prompt'],
+                'seed': params['seed'],
+                'duration': params['duration'],
+                'steps': params['steps'],
+                'tier': params['tier'],
+                'format': params['output_format'],
+                'quality': params['quality'],
+                'cache': cache_status,
+            })
+        archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    return buffer.getvalue()
+
+
+class GenerationJobCreateView(APIView):
+    """
+    非同期音声生成ジョブの登録
+    - POST /api/audio/jobs/ : ジョブを作成してワーカーに投入し、すぐに 202 を返す
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+
+        # 使用量制限をチェック（実行待ちのジョブも使用予定として数える）
+        can_generate, current_usage, daily_limit = check_usage_limit(user)
+        in_flight = GenerationJob.objects.filter(
+            user=user,
+            status__in=[GenerationJob.STATUS_PENDING, GenerationJob.STATUS_RUNNING],
+        ).count()
+        if not can_generate or current_usage + in_flight >= daily_limit:
+            return usage_limit_response(current_usage, daily_limit)
+
+        limits = get_user_plan_limits(user)
+        params, error_response = parse_generation_params(request.data, limits)
+        if error_response is not None:
+            return error_response
+
+        # シード値を指定したジョブだけ結果キャッシュを使う
+        seeded = params['seed'] is not None
+        if not seeded:
+            params['seed'] = random.randint(0, MAX_SEED)
+
+        job = GenerationJob.objects.create(user=user, plan=limits['plan'], seeded=seeded, **params)
+        run_generation_job.delay(str(job.id))
+        job.refresh_from_db()
+
+        serializer = GenerationJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class GenerationJobDetailView(APIView):
+    """
+    ジョブの状態取得・キャンセル
+    - GET /api/audio/jobs/<id>/ : ステータスと完了時の結果URLを返す
+    - DELETE /api/audio/jobs/<id>/ : 待機中・生成中のジョブをキャンセルする（生成中なら次のステップで打ち切る）
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = GenerationJob.objects.get(pk=job_id, user=request.user)
+        except GenerationJob.DoesNotExist:
+            return Response({"detail": "ジョブが見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = GenerationJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def delete(self, request, job_id):
+        try:
+            job = GenerationJob.objects.get(pk=job_id, user=request.user)
+        except GenerationJob.DoesNotExist:
+            return Response({"detail": "ジョブが見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        # ワーカーと同時に更新しないよう、未終了の場合だけ条件付きで更新する
+        cancelled = GenerationJob.objects.filter(
+            pk=job.pk,
+            status__in=[GenerationJob.STATUS_PENDING, GenerationJob.STATUS_RUNNING],
+        ).update(status=GenerationJob.STATUS_CANCELLED, finished_at=timezone.now())
+        job.refresh_from_db()
+
+        if not cancelled:
+            return Response({
+                "detail": "ジョブは既に終了しています。",
+                "status": job.status,
+            }, status=status.HTTP_409_CONFLICT)
+        publish_job_progress(job.pk, status=job.status)
+
+        serializer = GenerationJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class GenerationJobResultView(APIView):
+    """
+    ジョブの生成結果取得
+    - GET /api/audio/jobs/<id>/result : 完了したジョブの音声ファイルを返す
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = GenerationJob.objects.get(pk=job_id, user=request.user)
+        except GenerationJob.DoesNotExist:
+            return Response({"detail": "ジョブが見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        if job.status == GenerationJob.STATUS_FAILED:
+            return Response({"detail": f"音声生成エラー: {job.error}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if job.status != GenerationJob.STATUS_SUCCEEDED or not job.result_file:
             return Response({
-                "detail": f"プランの1日上限（{daily_limit}回）に達しました。",
-                "current_usage": current_usage,
-                "daily_limit": daily_limit
-            }, status=status.HTTP_429_TOO_MANY_REQUESTS)
-
-        prompt = request.data.get('prompt')
-        duration = float(request.data.get('duration', 5.0))
-        steps = int(request.data.get('steps', 100))
-        neg_prompt = request.data.get('neg_prompt', 'Low quality.')
-        
-        if not prompt:
-            return Response({"detail": "promptは必須です。"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # プラン制限をチェック
+                "detail": "音声はまだ生成中です。",
+                "status": job.status,
+            }, status=status.HTTP_409_CONFLICT)
+
+        return job_result_response(request, job)
+
+
+def job_result_response(request, job):
+    """完了したジョブの音声ファイルを Range・ETag 対応で返す"""
+    spec = OUTPUT_FORMATS[job.output_format]
+    try:
+        return stored_audio_response(
+            request, job.result_file, spec['content_type'], f"audio_{job.seed}.{spec['extension']}",
+            job.checksum, job.finished_at,
+        )
+    except FileNotFoundError:
+        return Response({"detail": "音声ファイルが見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+
+# ライブラリ一覧の1ページあたりの件数（既定値・上限）
+LIBRARY_PAGE_SIZE = 50
+LIBRARY_MAX_PAGE_SIZE = 200
+
+
+class GeneratedAudioListView(APIView):
+    """
+    生成音声ライブラリの一覧
+    - GET /api/audio/library/?limit=50&offset=0 : 新しい順に返す
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', LIBRARY_PAGE_SIZE))
+            offset = int(request.query_params.get('offset', 0))
+        except (TypeError, ValueError):
+            return Response({"detail": "limitとoffsetは整数で指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= LIBRARY_MAX_PAGE_SIZE or offset < 0:
+            return Response({
+                "detail": f"limitは1〜{LIBRARY_MAX_PAGE_SIZE}、offsetは0以上で指定してください。"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        audios = GeneratedAudio.objects.filter(user=request.user)
+        serializer = GeneratedAudioSerializer(
+            audios[offset:offset + limit], many=True, context={'request': request}
+        )
+        return Response({
+            "count": audios.count(),
+            "results": serializer.data,
+        }, status=status.HTTP_200_OK)
+
+
+class GeneratedAudioDetailView(APIView):
+    """
+    生成音声の詳細取得・削除
+    - GET /api/audio/library/<id>/ : パラメータとダウンロードURLを返す
+    - DELETE /api/audio/library/<id>/ : ライブラリから削除し、保存済みのファイルも消す
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, audio_id):
+        try:
+            audio = GeneratedAudio.objects.get(pk=audio_id, user=request.user)
+        except GeneratedAudio.DoesNotExist:
+            return Response({"detail": "音声が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = GeneratedAudioSerializer(audio, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def delete(self, request, audio_id):
+        try:
+            audio = GeneratedAudio.objects.get(pk=audio_id, user=request.user)
+        except GeneratedAudio.DoesNotExist:
+            return Response({"detail": "音声が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        audio.file.delete(save=False)
+        audio.peaks_file.delete(save=False)
+        audio.latents_file.delete(save=False)
+        audio.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class GeneratedAudioDownloadView(APIView):
+    """
+    生成音声の再ダウンロード
+    - GET /api/audio/library/<id>/download : 保存済みのファイルを返す（推論も使用量の消費もしない）
+      Range・ETag・条件付きGETに対応しているため、プレーヤーのシークで全体を再取得しない
+    - プランの can_download が必要
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, audio_id):
+        if not get_user_plan_limits(request.user)['can_download']:
+            return Response({"detail": "現在のプランではダウンロードを利用できません。"}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            audio = GeneratedAudio.objects.get(pk=audio_id, user=request.user)
+        except GeneratedAudio.DoesNotExist:
+            return Response({"detail": "音声が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        return library_audio_response(request, audio)
+
+
+def library_audio_response(request, audio):
+    """ライブラリの音声ファイルを Range・ETag 対応で返す"""
+    spec = OUTPUT_FORMATS[audio.output_format]
+    try:
+        return stored_audio_response(
+            request, audio.file, spec['content_type'], f"audio_{audio.seed}.{spec['extension']}",
+            audio.checksum, audio.created_at,
+        )
+    except FileNotFoundError:
+        return Response({"detail": "音声ファイルが見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class GeneratedAudioEditView(APIView):
+    """
+    ライブラリの音声の編集（プランの can_edit_audio が必要）
+    - POST /api/audio/library/<id>/edit : {"operations": [{"op": "trim", "start": 1, "end": 4}, ...], "format": "wav"}
+      trim / fade / gain / normalize / loop / concat / mix を順に適用した音声を返す
+    - 保存済みの音声に対する配列演算だけで済み、推論も使用量の消費もしない
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, audio_id):
+        limits = get_user_plan_limits(request.user)
+        if not limits['can_edit_audio']:
+            return Response({"detail": "現在のプランでは音声編集を利用できません。"}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            audio = GeneratedAudio.objects.get(pk=audio_id, user=request.user)
+        except GeneratedAudio.DoesNotExist:
+            return Response({"detail": "音声が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        output_format, quality, error_response = parse_output_params(request.data, limits)
+        if error_response is not None:
+            return error_response
+
+        sources = {}
+
+        def load_source(source_id):
+            """concat / mix で使う同じユーザーのライブラリの音声（同じ音声は1回だけ開く）"""
+            if source_id not in sources:
+                try:
+                    source = GeneratedAudio.objects.get(pk=source_id, user=request.user)
+                except (GeneratedAudio.DoesNotExist, ValidationError, ValueError, TypeError):
+                    raise EditError(f"sourceの音声が見つかりません: {source_id}")
+                sources[source_id] = open_stored_audio(source.file)
+            return sources[source_id]
+
+        try:
+            audio_np, sampling_rate = open_stored_audio(audio.file)
+            edited = apply_edits(
+                audio_np, sampling_rate, request.data.get('operations', []), load_source,
+                settings.AUDIO_EDIT_MAX_DURATION,
+            )
+        except EditError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FileNotFoundError:
+            return Response({"detail": "音声ファイルが見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        data = submit_encode(edited, sampling_rate, output_format, quality).result()
+        spec = OUTPUT_FORMATS[output_format]
+        response = audio_streaming_response(data, spec['content_type'], f"audio_{audio.seed}_edit.{spec['extension']}")
+        response["X-Audio-Duration"] = f"{len(edited) / sampling_rate:.3f}"
+        return response
+
+
+class GeneratedAudioRefineView(APIView):
+    """
+    下書きからのリファイン
+    - POST /api/audio/library/<id>/refine : {"tier": "high", "strength": 0.5, "format": "wav"}
+      保存済みの潜在表現にノイズを加え、指定ティアのスケジュールの最後の strength の割合のステップだけでノイズ除去する
+      （ノイズから生成し直すより少ないステップ数で、下書きの構成を保ったまま品質を上げる）
+    - プロンプト・音声長・シード値は下書きのものを使う。tier を省略した場合はプランで選択できる最上位のティア
+    - 結果はライブラリに新しい音声として保存し（refined_from に下書きのID）、使用量を1回分消費する
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, audio_id):
+        return idempotent_response(request, lambda request: self.refine(request, audio_id))
+
+    def refine(self, request, audio_id):
+        user = request.user
+        can_generate, current_usage, daily_limit = check_usage_limit(user)
+        if not can_generate:
+            return usage_limit_response(current_usage, daily_limit)
+
+        try:
+            draft = GeneratedAudio.objects.get(pk=audio_id, user=user)
+        except GeneratedAudio.DoesNotExist:
+            return Response({"detail": "音声が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
         limits = get_user_plan_limits(user)
-        
-        # 音声長の制限チェック
-        if duration > limits['max_audio_duration']:
+        params, strength, error_response = self.parse_params(request.data, limits, draft)
+        if error_response is not None:
+            return error_response
+
+        try:
+            latents = load_latents(draft)
+        except FileNotFoundError:
+            latents = None
+        if latents is None:
             return Response({
-                "detail": f"音声長は最大{limits['max_audio_duration']}秒までです。",
-                "requested_duration": duration,
-                "max_duration": limits['max_audio_duration']
+                "detail": "この音声には潜在表現が保存されていないため、リファインできません。",
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # ステップ数の制限チェック
+
+        try:
+            audio_np, sampling_rate, refined_latents = generate_audio(
+                params['prompt'],
+                params['neg_prompt'],
+                params['steps'],
+                params['duration'],
+                params['seed'],
+                params['tier'],
+                cancel_token=getattr(request, 'generation_cancel_token', None),
+                requester=make_requester(user.pk, limits),
+                init_latents=latents,
+                strength=strength,
+                return_latents=True,
+            )
+            analysis = submit_analysis(audio_np, sampling_rate)
+            data = submit_encode(audio_np, sampling_rate, params['output_format'], params['quality']).result()
+            library_audio = save_to_library(
+                user, params, data, analysis.result(), pack_latents(refined_latents),
+                refined_from=draft, strength=strength,
+            )
+            usage_log = increment_usage(user, int(params['duration']))
+        except Exception as e:
+            return generation_error_response(e)
+
+        spec = OUTPUT_FORMATS[params['output_format']]
+        response = audio_streaming_response(data, spec['content_type'], f"audio_{params['seed']}_refined.{spec['extension']}")
+        response["X-Audio-Id"] = str(library_audio.id)
+        response["X-Refined-From"] = str(draft.id)
+        response["X-Refine-Steps"] = str(params['steps'] - refine_start_step(params['steps'], strength))
+        response["X-Usage-Count"] = str(usage_log.audio_generations)
+        response["X-Usage-Limit"] = str(daily_limit)
+        response["X-Usage-Remaining"] = str(daily_limit - usage_log.audio_generations)
+        return response
+
+    def parse_params(self, data, limits, draft):
+        """
+        リファインのティア・強さ・出力フォーマットを取り出し、プラン制限をチェックする
+        - 戻り値: (params, strength, error_response)
+        """
+        output_format, quality, error_response = parse_output_params(data, limits)
+        if error_response is not None:
+            return None, None, error_response
+
+        tier = data.get('tier') or limits['max_generation_tier']
+        if tier not in GENERATION_TIERS:
+            return None, None, Response({
+                "detail": f"tierは{', '.join(GENERATION_TIERS)}のいずれかを指定してください。",
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if GENERATION_TIERS.index(tier) > GENERATION_TIERS.index(limits['max_generation_tier']):
+            return None, None, Response({
+                "detail": f"現在のプランで選択できる生成ティアは{limits['max_generation_tier']}までです。",
+                "requested_tier": tier,
+                "max_tier": limits['max_generation_tier']
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        steps = get_tier(tier)['steps']
         if steps > limits['max_steps']:
-            return Response({
+            return None, None, Response({
                 "detail": f"ステップ数は最大{limits['max_steps']}までです。",
                 "requested_steps": steps,
                 "max_steps": limits['max_steps']
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # キャッシュされたモデルを取得
-            pipe = get_audio_pipeline()
-            
-            import random
-            seed = random.randint(0, 2**32 - 1)
-            gen = torch.Generator(pipe.device).manual_seed(seed)
-            result = pipe(
-                prompt,
-                negative_prompt=neg_prompt,
-                num_inference_steps=steps,
-                audio_end_in_s=duration,
-                num_waveforms_per_prompt=1,
-                generator=gen
+            strength = float(data.get('strength', settings.AUDIO_REFINE_DEFAULT_STRENGTH))
+        except (TypeError, ValueError):
+            strength = -1.0
+        if not 0 < strength <= 1:
+            return None, None, Response({
+                "detail": "strengthは0より大きく1以下の数値で指定してください。",
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return {
+            'prompt': draft.prompt,
+            'neg_prompt': draft.neg_prompt,
+            'steps': steps,
+            'duration': draft.duration,
+            'seed': draft.seed,
+            'output_format': output_format,
+            'quality': quality,
+            'tier': tier,
+        }, strength, None
+
+
+class GeneratedAudioRenderView(APIView):
+    """
+    保存済みの潜在表現からの再デコード
+    - POST /api/audio/library/<id>/render : {"format": "flac", "quality": "high"}
+      潜在表現を VAE でデコードし直して指定のフォーマットで返す（サンプリングをしないため使用量も消費しない）
+      デコードは生成と同じアドミッション制御を通り、混雑時は 503 と Retry-After を返す
+    - 圧縮フォーマットで保存した音声も、再エンコードによる劣化なしに別のフォーマットで取得できる
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, audio_id):
+        try:
+            audio = GeneratedAudio.objects.get(pk=audio_id, user=request.user)
+        except GeneratedAudio.DoesNotExist:
+            return Response({"detail": "音声が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        limits = get_user_plan_limits(request.user)
+        output_format, quality, error_response = parse_output_params(request.data, limits)
+        if error_response is not None:
+            return error_response
+
+        try:
+            latents = load_latents(audio)
+        except FileNotFoundError:
+            latents = None
+        if latents is None:
+            return Response({
+                "detail": "この音声には潜在表現が保存されていないため、再デコードできません。",
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            audio_np, sampling_rate = decode_latents(
+                latents, audio.duration,
+                cancel_token=getattr(request, 'generation_cancel_token', None),
+                requester=make_requester(request.user.pk, limits),
             )
-            audio_np = result.audios[0].T.float().cpu().numpy()
-            
-            # 一時ファイルに保存
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmpfile:
-                sf.write(tmpfile.name, audio_np, pipe.vae.sampling_rate)
-                out_path = tmpfile.name
-            
-            # 使用量を増加
-            usage_log = increment_usage(user, int(duration))
-            
-            # ファイルをレスポンス
-            with open(out_path, "rb") as f:
-                data = f.read()
-            os.remove(out_path)
-            
-            # HttpResponseを使用してバイナリデータを直接返す
-            response = HttpResponse(data, content_type="audio/wav")
-            response["Content-Disposition"] = f'attachment; filename="audio_{seed}.wav"'
-            
-            # レスポンスヘッダーに使用量情報を追加
-            response["X-Usage-Count"] = str(usage_log.audio_generations)
-            response["X-Usage-Limit"] = str(daily_limit)
-            response["X-Usage-Remaining"] = str(daily_limit - usage_log.audio_generations)
-            
-            return response
-            
+            data = submit_encode(audio_np, sampling_rate, output_format, quality).result()
         except Exception as e:
-            return Response({"detail": f"音声生成エラー: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return generation_error_response(e)
+
+        spec = OUTPUT_FORMATS[output_format]
+        return audio_streaming_response(data, spec['content_type'], f"audio_{audio.seed}.{spec['extension']}")
+
+
+class GeneratedAudioPeaksView(APIView):
+    """
+    波形ピークの取得
+    - GET /api/audio/library/<id>/peaks : 複数解像度の min/max を float16（リトルエンディアン）で並べたバイナリ
+      各解像度の位置（offset / count）は詳細・一覧の analysis.peaks.levels にあり、Range で1解像度だけ取得できる
+    - 音声全体をダウンロード・デコードせずに、数十KBで波形を描画できる
+    """
+    authentication_classes = [ApiKeyAuthentication] + APIView.authentication_classes
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, audio_id):
+        try:
+            audio = GeneratedAudio.objects.get(pk=audio_id, user=request.user)
+        except GeneratedAudio.DoesNotExist:
+            return Response({"detail": "音声が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+        if not audio.peaks_file:
+            return Response({"detail": "波形データがありません。"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            return stored_audio_response(
+                request, audio.peaks_file, 'application/octet-stream', f"audio_{audio.seed}.peaks",
+                audio.analysis.get('peaks', {}).get('checksum', ''), audio.created_at,
+            )
+        except FileNotFoundError:
+            return Response({"detail": "波形データがありません。"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class SignedAudioDownloadView(APIView):
+    """
+    署名付きURLによる保存済み音声の取得
+    - GET /api/audio/files/<token> : 認証ヘッダーなしで取得できる（<audio src> で直接再生・シークする用途）
+    - URLは詳細・一覧の signed_url で発行され、AUDIO_SIGNED_URL_MAX_AGE 秒で失効する
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, token):
+        try:
+            payload = load_signed_token(token)
+        except signing.SignatureExpired:
+            return Response({"detail": "URLの有効期限が切れています。"}, status=status.HTTP_403_FORBIDDEN)
+        except signing.BadSignature:
+            return Response({"detail": "URLが不正です。"}, status=status.HTTP_403_FORBIDDEN)
+
+        if payload.get('kind') == SIGNED_KIND_LIBRARY:
+            audio = GeneratedAudio.objects.filter(pk=payload['id']).first()
+            if audio is not None:
+                return library_audio_response(request, audio)
+        elif payload.get('kind') == SIGNED_KIND_JOB:
+            job = GenerationJob.objects.filter(
+                pk=payload['id'], status=GenerationJob.STATUS_SUCCEEDED,
+            ).exclude(result_file='').first()
+            if job is not None:
+                return job_result_response(request, job)
+        return Response({"detail": "音声が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+
+# 待ち時間の見積もりに使う、直近に完了したジョブの件数
+ETA_SAMPLE_JOBS = 20
+
+
+def authenticate_stream_request(request):
+    """
+    進捗ストリーム用の認証（X-API-KEY / Authorization: Bearer / ?token=<アクセストークン>）
+    - ブラウザの EventSource はヘッダーを付けられないため、クエリ文字列のアクセストークンも受け付ける
+    - 認証できなければ None
+    """
+    user_and_auth = ApiKeyAuthentication().authenticate(request)
+    if user_and_auth is not None:
+        return user_and_auth[0]
+
+    jwt_auth = JWTAuthentication()
+    try:
+        user_and_auth = jwt_auth.authenticate(request)
+        if user_and_auth is not None:
+            return user_and_auth[0]
+        raw_token = request.GET.get('token')
+        if raw_token:
+            return jwt_auth.get_user(jwt_auth.get_validated_token(raw_token))
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        pass
+    return None
+
+
+def job_queue_estimate(job):
+    """
+    待機中のジョブの順番（1始まり）と、完了までの残り秒数の見積もりを返す
+    - 実行順は推論のアドミッション制御と同じ重み付き公平キューイングで見積もる。待機中のジョブをユーザーごとに
+      登録順に並べて「推論コスト / プランの重み」を累積した仮想終了時刻を求め、自分より小さいジョブを先に実行されるものとする
+      （重みの大きいプランのジョブは、先に登録された重みの小さいプランのジョブより前になりうる）
+    - 残り秒数は、直近に完了したジョブの推論コストあたりの実時間 × (先に実行されるジョブと自分の推論コストの合計)
+    """
+    pending = list(GenerationJob.objects.filter(
+        status=GenerationJob.STATUS_PENDING,
+    ).order_by('created_at').values_list('pk', 'user_id', 'plan', 'steps', 'tier'))
+    if job.pk not in {pk for pk, _, _, _, _ in pending}:
+        pending.append((job.pk, job.user_id, job.plan, job.steps, job.tier))
+    weights = dict(Plan.objects.filter(
+        name__in={plan for _, _, plan, _, _ in pending},
+    ).values_list('name', 'priority'))
+
+    finish_tags = {}
+    queued = []
+    for order, (pk, user_id, plan, steps, tier) in enumerate(pending):
+        cost = inference_cost(steps, tier or None)
+        finish_tags[user_id] = finish_tags.get(user_id, 0.0) + cost / max(weights.get(plan, 1), 1)
+        queued.append(((finish_tags[user_id], order), pk, cost))
+    own_tag, own_cost = next((tag, cost) for tag, pk, cost in queued if pk == job.pk)
+    ahead_costs = [cost for tag, _, cost in queued if tag < own_tag]
+
+    recent = GenerationJob.objects.filter(
+        status=GenerationJob.STATUS_SUCCEEDED, started_at__isnull=False, finished_at__isnull=False,
+    ).order_by('-finished_at').values_list('started_at', 'finished_at', 'steps', 'tier')[:ETA_SAMPLE_JOBS]
+    recent = list(recent)
+    recent_cost = sum(inference_cost(steps, tier or None) for _, _, steps, tier in recent)
+    eta = None
+    if recent_cost:
+        seconds_per_cost = sum((finished - started).total_seconds() for started, finished, _, _ in recent) / recent_cost
+        eta = seconds_per_cost * (sum(ahead_costs) + own_cost)
+    return len(ahead_costs) + 1, eta
+
+
+def job_stream_state(job_id, request):
+    """
+    ストリームに送るジョブの現在の状態を (イベント名, データ) で返す
+    - 終了していれば結果URLを含むジョブ全体、待機中なら順番と見積もり、生成中なら None（進捗イベントに任せる）
+    """
+    job = GenerationJob.objects.get(pk=job_id)
+    if job.is_finished:
+        return 'finished', GenerationJobSerializer(job, context={'request': request}).data
+    if job.status == GenerationJob.STATUS_PENDING:
+        queue_position, eta = job_queue_estimate(job)
+        return 'queued', {'status': job.status, 'queue_position': queue_position, 'eta': eta}
+    return None
+
+
+def format_sse(event, data):
+    """Server-Sent Events の1イベント分の文字列"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def generation_job_event_stream(request, job_id):
+    """
+    ジョブの状態を Server-Sent Events として送り、終了したら結果を送って閉じる
+    - queued: 待機中の順番と完了までの見積もり秒数
+    - progress: 生成中のステップ数と残り秒数（推論のステップごとのコールバックから届く）
+    - finished: 終了したジョブ（result_url を含む）
+    """
+    bus = get_progress_bus()
+    # 購読を始めてから現在の状態を読むことで、その間のイベントを取りこぼさない
+    subscriber = await bus.subscribe(job_id)
+    get_state = sync_to_async(job_stream_state)
+    try:
+        state = await get_state(job_id, request)
+        if state is None:
+            latest = await bus.latest(job_id)
+            state = ('progress', latest) if latest and latest['status'] == GenerationJob.STATUS_RUNNING else None
+        while True:
+            if state is not None:
+                event, data = state
+                yield format_sse(event, data)
+                if event == 'finished':
+                    return
+
+            try:
+                message = await asyncio.wait_for(subscriber.get(), timeout=settings.AUDIO_PROGRESS_STREAM_INTERVAL)
+            except asyncio.TimeoutError:
+                # 完了のイベントを取りこぼしていないか、待機中の順番が進んでいないかを DB で確認する
+                state = await get_state(job_id, request)
+                if state is None:
+                    yield ": keepalive\n\n"
+                continue
+
+            if message['status'] == GenerationJob.STATUS_RUNNING:
+                state = ('progress', message)
+            else:
+                state = await get_state(job_id, request)
+    finally:
+        bus.unsubscribe(job_id, subscriber)
+
+
+async def generation_job_events(request, job_id):
+    """
+    ジョブの進捗ストリーム（Server-Sent Events）
+    - GET /api/audio/jobs/<id>/events
+    - 非同期ビューなので ASGI サーバーで動かすと、接続中もワーカーのスレッドを占有しない
+    """
+    if request.method != 'GET':
+        return JsonResponse({"detail": "GET のみ対応しています。"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    user = await sync_to_async(authenticate_stream_request)(request)
+    if user is None:
+        return JsonResponse({"detail": "認証情報が正しくありません。"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if not await GenerationJob.objects.filter(pk=job_id, user=user).aexists():
+        return JsonResponse({"detail": "ジョブが見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+
+    response = StreamingHttpResponse(
+        generation_job_event_stream(request, str(job_id)), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # nginx などのリバースプロキシでバッファリングさせない
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ジョブの待ち時間をプランごとに集計する期間（秒）
+JOB_WAIT_WINDOW = 60 * 60
+
+
+def job_wait_by_plan(since):
+    """since 以降に開始したジョブの、登録から開始までの待ち時間（秒）をプランごとに集計する"""
+    waits = {}
+    jobs = GenerationJob.objects.filter(started_at__gte=since).values_list('plan', 'created_at', 'started_at')
+    for plan, created_at, started_at in jobs:
+        waits.setdefault(plan or 'none', []).append((started_at - created_at).total_seconds())
+    return {plan: summarize_waits(samples) for plan, samples in waits.items()}
+
+
+class AudioStatsView(APIView):
+    """
+    監視用の統計情報（管理者のみ）
+    - GET /api/audio/stats/ : 推論プロセスのキャッシュのヒット率、待ち行列の状態、
+      プランごとの待ち時間（推論の枠待ち・直近1時間のジョブの開始待ち）などを返す
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            stats = get_inference_stats()
+        except InferenceServerError as e:
+            return Response({'detail': f'推論サーバーに接続できません: {str(e)}'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        stats['job_wait_by_plan'] = job_wait_by_plan(timezone.now() - timedelta(seconds=JOB_WAIT_WINDOW))
+        # 同時に届いた同じ生成リクエストの相乗り（この Web プロセス内の値）
+        stats['single_flight'] = get_single_flight().stats()
+        return Response(stats, status=status.HTTP_200_OK)
@@ -18,7 +18,10 @@ class PlanAdmin(admin.ModelAdmin):
             'fields': ('name', 'display_name', 'description', 'price')
         }),
         ('制限設定', {
-            'fields': ('daily_audio_limit', 'max_audio_duration', 'max_steps')
+            'fields': ('daily_audio_limit', 'max_audio_duration', 'max_steps', 'max_audio_quality', 'max_generation_tier')
+        }),
+        ('生成の優先度', {
+            'fields': ('priority', 'max_concurrent_jobs')
         }),
         ('機能設定', {
             'fields': ('can_use_api', 'can_download', 'can_edit_audio')
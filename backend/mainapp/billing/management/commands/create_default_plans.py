@@ -20,6 +20,10 @@ class Command(BaseCommand):
                 'daily_audio_limit': 20,
                 'max_audio_duration': 30,
                 'max_steps': 200,
+                'max_audio_quality': 'standard',
+                'max_generation_tier': 'standard',
+                'priority': 1,
+                'max_concurrent_jobs': 1,
                 'can_use_api': False,
                 'can_download': True,
                 'can_edit_audio': False,
@@ -48,6 +52,10 @@ class Command(BaseCommand):
                 'daily_audio_limit': 100,
                 'max_audio_duration': 60,
                 'max_steps': 300,
+                'max_audio_quality': 'high',
+                'max_generation_tier': 'high',
+                'priority': 4,
+                'max_concurrent_jobs': 2,
                 'can_use_api': True,
                 'can_download': True,
                 'can_edit_audio': True,
@@ -77,6 +85,10 @@ class Command(BaseCommand):
                 'daily_audio_limit': 500,
                 'max_audio_duration': 120,
                 'max_steps': 500,
+                'max_audio_quality': 'high',
+                'max_generation_tier': 'high',
+                'priority': 8,
+                'max_concurrent_jobs': 4,
                 'can_use_api': True,
                 'can_download': True,
                 'can_edit_audio': True,
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='max_audio_quality',
+            field=models.CharField(choices=[('low', '低'), ('standard', '標準'), ('high', '高')], default='standard', help_text='圧縮フォーマット（Ogg Opus / MP3）で選択できる最大品質（ビットレート）', max_length=20, verbose_name='最大音声品質'),
+        ),
+    ]
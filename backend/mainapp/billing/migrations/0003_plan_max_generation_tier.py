@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0002_plan_max_audio_quality'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='max_generation_tier',
+            field=models.CharField(choices=[('draft', 'ドラフト'), ('standard', '標準'), ('high', '高品質')], default='standard', help_text='選択できる最上位の生成ティア（スケジューラー・ステップ数の組み合わせ）', max_length=20, verbose_name='最大生成ティア'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-18 16:26
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0003_plan_max_generation_tier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='max_concurrent_jobs',
+            field=models.IntegerField(default=1, help_text='ユーザーごとに同時に実行できる生成数', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)], verbose_name='最大同時生成数'),
+        ),
+        migrations.AddField(
+            model_name='plan',
+            name='priority',
+            field=models.IntegerField(default=1, help_text='混雑時の生成の重み（重み付き公平キューイング。大きいほど多くの枠を割り当てる）', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)], verbose_name='優先度'),
+        ),
+    ]
@@ -55,6 +55,45 @@ class Plan(models.Model):
         verbose_name="最大ステップ数"
     )
     
+    max_audio_quality = models.CharField(
+        max_length=20,
+        choices=[
+            ('low', '低'),
+            ('standard', '標準'),
+            ('high', '高'),
+        ],
+        default='standard',
+        help_text="圧縮フォーマット（Ogg Opus / MP3）で選択できる最大品質（ビットレート）",
+        verbose_name="最大音声品質"
+    )
+    
+    max_generation_tier = models.CharField(
+        max_length=20,
+        choices=[
+            ('draft', 'ドラフト'),
+            ('standard', '標準'),
+            ('high', '高品質'),
+        ],
+        default='standard',
+        help_text="選択できる最上位の生成ティア（スケジューラー・ステップ数の組み合わせ）",
+        verbose_name="最大生成ティア"
+    )
+    
+    # 生成の待ち行列での扱い
+    priority = models.IntegerField(
+        default=1,
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text="混雑時の生成の重み（重み付き公平キューイング。大きいほど多くの枠を割り当てる）",
+        verbose_name="優先度"
+    )
+    
+    max_concurrent_jobs = models.IntegerField(
+        default=1,
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text="ユーザーごとに同時に実行できる生成数",
+        verbose_name="最大同時生成数"
+    )
+    
     # 機能フラグ
     can_use_api = models.BooleanField(
         default=False,
@@ -11,6 +11,7 @@ class PlanSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'display_name', 'description', 'price',
             'daily_audio_limit', 'max_audio_duration', 'max_steps',
+            'max_audio_quality', 'max_generation_tier', 'priority', 'max_concurrent_jobs',
             'can_use_api', 'can_download', 'can_edit_audio',
             'is_active', 'is_popular', 'sort_order',
             'features_list', 'is_free'